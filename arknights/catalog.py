@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+import numpy as np
+
+MAX_DATE = 99991230
+
+
+def parse_date(date: Optional[str]) -> int:
+    return int(date) if date else MAX_DATE
+
+
+class OperatorCatalog:
+    """Columnar, indexed view of the operators list
+
+    Every operator is parsed once into rarity (int8), release date (int32
+    YYYYMMDD) and an approach bitmask. For each (approach, rarity) pair the
+    operator indices are kept sorted by release date, so "pool of approach A
+    and rarity R as of date D" is a binary search plus a slice.
+    """
+    APPROACH_SEP = re.compile(r"[,，\s]+")
+
+    def __init__(self, operators: list[dict]) -> None:
+        self.operators = operators
+        self.approaches: dict[str, int] = {}
+        masks = []
+        for op in operators:
+            mask = 0
+            for approach in self.APPROACH_SEP.split(op["approach"]):
+                if approach:
+                    bit = self.approaches.setdefault(approach,
+                                                     len(self.approaches))
+                    mask |= 1 << bit
+            masks.append(mask)
+
+        self.rarities = np.array([op["rarity"] for op in operators],
+                                 dtype=np.int8)
+        self.release_dates = np.array(
+            [parse_date(op["release_time"]) for op in operators],
+            dtype=np.int32,
+        )
+        self.approach_masks = np.array(masks, dtype=np.uint32)
+
+        self._index: dict[tuple[int, int], tuple[np.ndarray,
+                                                 np.ndarray]] = {}
+        for approach, bit in self.approaches.items():
+            has_approach = (self.approach_masks >> bit) & 1 == 1
+            for rarity in np.unique(self.rarities).tolist():
+                indices = np.flatnonzero(has_approach
+                                         & (self.rarities == rarity))
+                order = np.argsort(self.release_dates[indices],
+                                   kind="stable")
+                indices = indices[order]
+                self._index[bit, rarity] = (self.release_dates[indices],
+                                            indices)
+
+    def pool(
+        self,
+        rarity: int,
+        approach: str = "标准寻访",
+        before_date: Optional[str] = None,
+    ) -> np.ndarray:
+        """Indices of operators of ``rarity`` obtainable through ``approach``
+        and released on or before ``before_date``"""
+        bit = self.approaches.get(approach)
+        if bit is None or (bit, rarity) not in self._index:
+            return np.empty(0, dtype=np.intp)
+        dates, indices = self._index[bit, rarity]
+        end = np.searchsorted(dates, parse_date(before_date), side="right")
+        return indices[:end]
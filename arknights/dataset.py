@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+from itertools import count
+from pathlib import Path
+from threading import Lock
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Mapping, Optional
+
+from .catalog import OperatorCatalog
+from .utils import update_assets
+
+if TYPE_CHECKING:
+    from .gacha import ArknightsBanner
+
+ASSETS_DIR = Path(__file__).parent.parent / "assets" / "arknights"
+OPERATORS_INFO_FILEPATH = str(ASSETS_DIR / "operators_less.json")
+BANNERS_FILEPATH = str(ASSETS_DIR / "banners.json")
+
+
+def _freeze(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(i) for i in obj)
+    return obj
+
+
+class GachaDataset:
+    """Read-only operators and banners data shared by every banner
+
+    Loaded once per process through ``get_dataset``. ``ArknightsBanner``
+    instances only keep references into it, and ``get_banner`` caches one
+    compiled banner per name for the lifetime of this dataset version.
+    """
+    _versions = count(1)
+
+    def __init__(
+        self,
+        operators: list[dict],
+        banners: list[dict],
+    ) -> None:
+        self.version = next(self._versions)
+        self.operators: tuple[Mapping[str, Any], ...] = _freeze(operators)
+        self.operators_dict = MappingProxyType(
+            {op["cn_name"]: op
+             for op in self.operators})
+        self.operators_index = MappingProxyType(
+            {op["cn_name"]: i
+             for i, op in enumerate(self.operators)})
+        self.catalog = OperatorCatalog(self.operators)
+        self.banners: tuple[Mapping[str, Any], ...] = _freeze(banners)
+        self.banners_dict = MappingProxyType(
+            {banner["name"]: banner
+             for banner in self.banners})
+        self._banners: dict[str, ArknightsBanner] = {}
+        self._lock = Lock()
+
+    @classmethod
+    def load(
+        cls,
+        operators_path: str = OPERATORS_INFO_FILEPATH,
+        banners_path: str = BANNERS_FILEPATH,
+    ) -> GachaDataset:
+        with Path(operators_path).open("r", encoding="utf-8") as f:
+            operators = json.loads(f.read())
+        with Path(banners_path).open("r", encoding="utf-8") as f:
+            banners = json.loads(f.read())
+        return cls(operators, banners)
+
+    def get_banner(self, name: str) -> ArknightsBanner:
+        """Compiled banner shared by every caller; never call set_banner"""
+        banner = self._banners.get(name)
+        if banner is None:
+            from .gacha import ArknightsBanner
+            with self._lock:
+                banner = self._banners.get(name)
+                if banner is None:
+                    banner = ArknightsBanner(name, dataset=self)
+                    self._banners[name] = banner
+        return banner
+
+    def __repr__(self) -> str:
+        return (f"<GachaDataset v{self.version}: {len(self.operators)} "
+                f"operators, {len(self.banners)} banners>")
+
+
+_dataset: Optional[GachaDataset] = None
+_load_lock = Lock()
+# serializes fetching and writing the assets; get_dataset never waits on it
+_update_lock = Lock()
+
+
+def get_dataset() -> GachaDataset:
+    global _dataset
+    dataset = _dataset
+    if dataset is None:
+        with _load_lock:
+            if _dataset is None:
+                _dataset = GachaDataset.load()
+            dataset = _dataset
+    return dataset
+
+
+def refresh_dataset(force: bool = False) -> Optional[GachaDataset]:
+    """Re-scrape the assets and swap in a new dataset if anything changed
+
+    Meant to run off the request path: readers keep using the current
+    dataset during the network I/O and only wait for the swap.
+    """
+    with _update_lock:
+        if not update_assets(force=force):
+            return None
+        return _swap_dataset(GachaDataset.load())
+
+
+def reload_dataset(update: bool = False) -> GachaDataset:
+    """Load a new dataset version and swap it in
+
+    Banners built from the previous version keep working on it until their
+    holders drop them, so in-flight pulls are never blocked.
+    """
+    with _update_lock:
+        if update:
+            update_assets()
+        return _swap_dataset(GachaDataset.load())
+
+
+def _swap_dataset(dataset: GachaDataset) -> GachaDataset:
+    global _dataset
+    with _load_lock:
+        _dataset = dataset
+    return dataset
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional, Sequence
+
+import aiohttp
+
+CACHE_DIR = str(
+    Path(__file__).parent.parent / "assets" / "arknights" / ".http_cache")
+USER_AGENT = "ExusiaiBot (+https://github.com/SIGUSR97/ExusiaiBot)"
+
+
+class FetchError(Exception):
+    """Raised when a page cannot be fetched and no cached copy exists"""
+
+
+class Page(NamedTuple):
+    """A fetched page, backed by its file in the response cache"""
+    url: str
+    path: Path
+    modified: bool
+    encoding: str = "utf-8"
+
+    @property
+    def text(self) -> str:
+        with self.path.open("r", encoding=self.encoding) as f:
+            return f.read()
+
+    def iter_chunks(self, size: int = 1 << 16) -> Iterator[str]:
+        with self.path.open("r", encoding=self.encoding) as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+class PRTSFetcher:
+    """Concurrent page fetcher with conditional requests and a disk cache
+
+    Responses are stored under ``cache_dir`` together with their ETag and
+    Last-Modified headers, which are sent back on the next request so
+    unchanged pages come back as ``304 Not Modified`` and are read from disk.
+    """
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR,
+        timeout: float = 30,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_connections: int = 4,
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> PRTSFetcher:
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"User-Agent": USER_AGENT},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        assert self._session is not None
+        await self._session.close()
+        self._session = None
+
+    async def fetch_all(self, urls: Sequence[str]) -> list[Page]:
+        return list(await asyncio.gather(*map(self.fetch, urls)))
+
+    async def fetch(self, url: str) -> Page:
+        assert self._session is not None, "use PRTSFetcher as a context manager"
+        meta = self._read_meta(url)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2**(attempt - 1))
+            try:
+                async with self._session.get(url, headers=headers) as res:
+                    if res.status == 304:
+                        logging.info("%s not modified, using cache", url)
+                        return self._cached_page(url, meta)
+                    res.raise_for_status()
+                    meta = await self._write_cache(url, res)
+                    return Page(url, self._cache_path(url), True,
+                                meta["encoding"])
+            except aiohttp.ClientResponseError as e:
+                error = e
+                # a 4xx other than 429 will not go away by retrying
+                if e.status < 500 and e.status != 429:
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+        if meta:
+            logging.warning("fetching %s failed (%r), using cache", url, error)
+            return self._cached_page(url, meta)
+        raise FetchError(url) from error
+
+    def _cache_path(self, url: str) -> Path:
+        return self.cache_dir / hashlib.sha1(url.encode()).hexdigest()
+
+    def _read_meta(self, url: str) -> dict:
+        path = self._cache_path(url).with_suffix(".json")
+        if not path.exists() or not self._cache_path(url).exists():
+            return {}
+        with path.open("r", encoding="utf-8") as f:
+            return json.loads(f.read())
+
+    def _cached_page(self, url: str, meta: dict) -> Page:
+        return Page(url, self._cache_path(url), False,
+                    meta.get("encoding") or "utf-8")
+
+    async def _write_cache(
+        self,
+        url: str,
+        res: aiohttp.ClientResponse,
+    ) -> dict:
+        """Stream the response body to the cache without buffering it"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._cache_path(url)
+        meta = {
+            "url": url,
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+            "encoding": res.charset or "utf-8",
+        }
+        temp = path.with_name(f"{path.name}.tmp")
+        with temp.open("wb") as f:
+            async for chunk in res.content.iter_chunked(1 << 16):
+                f.write(chunk)
+        os.replace(temp, path)
+        meta_path = path.with_suffix(".json")
+        temp = meta_path.with_name(f"{meta_path.name}.tmp")
+        with temp.open("w", encoding="utf-8") as f:
+            f.write(json.dumps(meta))
+        os.replace(temp, meta_path)
+        return meta
+
+
+async def fetch_pages(urls: Sequence[str], **kwargs) -> list[Page]:
+    async with PRTSFetcher(**kwargs) as fetcher:
+        return await fetcher.fetch_all(urls)
+
+
+def fetch_pages_sync(urls: Sequence[str], **kwargs) -> list[Page]:
+    return asyncio.run(fetch_pages(urls, **kwargs))
@@ -1,16 +1,15 @@
-import json
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
-from pathlib import Path
-from typing import Any, Optional, Union
-from functools import partial
+from typing import Any, Optional, Sequence, Union, overload
 from collections import defaultdict
-from random import choice
 
 import arrow
+import numpy as np
 
-from .probability_tree import ProbabilityNode
-from .utils import (get_banners_info, get_operators_info, save_banners_info,
-                    save_operators_info)
+from .dataset import (BANNERS_FILEPATH, OPERATORS_INFO_FILEPATH,
+                      GachaDataset, get_dataset, reload_dataset)
+from .probability_tree import AliasTable, ProbabilityNode
 
 
 class NoneExistantBanner(Exception):
@@ -27,15 +26,85 @@ class GachaBanner(ABC):
         pass
 
 
+class BannerSampler:
+    """Flat alias table over the (rarity, rateup, operator index) outcomes"""
+    def __init__(
+        self,
+        table: AliasTable,
+        operators_index: dict[str, int],
+    ) -> None:
+        self.table = table
+        self.operator_indices = np.array(
+            [operators_index[op["cn_name"]] for op in table.values],
+            dtype=np.intp,
+        )
+        self.rarities = np.array([op["rarity"] for op in table.values],
+                                 dtype=np.int8)
+        self.rateups = np.array(
+            [leaf.name.startswith("RATEUP_") for leaf in table.leaves],
+            dtype=bool,
+        )
+        self._operator_indices = self.operator_indices.tolist()
+
+    def sample(self, size: Optional[int] = None) -> Any:
+        if size is None:
+            return self._operator_indices[self.table.sample()]
+        return self.operator_indices[self.table.sample(size)]
+
+    def subset(self, mask: np.ndarray) -> Optional[BannerSampler]:
+        if not mask.any():
+            return None
+        sampler = BannerSampler.__new__(BannerSampler)
+        sampler.table = self.table.subset(mask)
+        sampler.operator_indices = self.operator_indices[mask]
+        sampler.rarities = self.rarities[mask]
+        sampler.rateups = self.rateups[mask]
+        sampler._operator_indices = sampler.operator_indices.tolist()
+        return sampler
+
+
+class PullView(Sequence):
+    """Read-only view of pulled operator indices as operator dicts"""
+    def __init__(self, operators: list[dict], indices: np.ndarray) -> None:
+        self.operators = operators
+        self.indices = indices
+
+    @overload
+    def __getitem__(self, i: int) -> dict:
+        ...
+
+    @overload
+    def __getitem__(self, i: slice) -> PullView:
+        ...
+
+    def __getitem__(self, i: Union[int, slice]) -> Any:
+        if isinstance(i, slice):
+            return PullView(self.operators, self.indices[i])
+        return self.operators[self.indices[i]]
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
 class ArknightsBanner(GachaBanner):
     SIX_STAR_RATE = 0.02
     FIVE_STAR_RATE = 0.08
     FOUR_STAR_RATE = 0.50
     THREE_STAR_RATE = 0.40
     RATEUP = 0.50
+    SIX_STAR_PITY_START = 50
+    SIX_STAR_PITY_STEP = 0.02
+    # pulls looked ahead at once by pull_with_counter
+    SIX_STAR_WINDOW = 128
+    PITY_PROBABILITIES = {
+        "FIVE_STAR": 0.98,
+        "SIX_STAR": 0.02,
+        "FOUR_STAR": 0,
+        "THREE_STAR": 0,
+    }
 
-    OPERATORS_INFO_FILEPATH = "../assets/arknights/operators_less.json"
-    BANNERS_FILEPATH = "../assets/arknights/banners.json"
+    OPERATORS_INFO_FILEPATH = OPERATORS_INFO_FILEPATH
+    BANNERS_FILEPATH = BANNERS_FILEPATH
     NUM2WORD = {
         1: "ONE",
         2: "TWO",
@@ -51,58 +120,131 @@ class ArknightsBanner(GachaBanner):
         rateups: dict[str, Any] = {},
         end_time: Optional[str] = None,
         update: bool = False,
+        dataset: Optional[GachaDataset] = None,
     ) -> None:
         self.name = name
         self.end_time = end_time
         self.rateups = rateups
 
-        self._load_banner(update)
+        self._load_banner(update, dataset)
 
     def pull(self) -> Any:
-        return choice(self.rng.choice_recursive().value)
+        return self.operators[self.sampler.sample()]
 
     def pull10(
         self,
         with_pity: bool = False,
     ) -> list:
-        flag = True
-        result = []
-        for _ in range(9 + (not with_pity)):
-            pull = self.pull()
-            result.append(pull)
-            if pull["rarity"] >= 5:
-                flag = False
-        if with_pity and flag:
-            self.rng.set_children_probabilities({
-                "FIVE_STAR": 0.98,
-                "SIX_STAR": 0.02,
-                "FOUR_STAR": 0,
-                "THREE_STAR": 0,
-            })
-            result.append(self.pull())
-            self.rng.reset_children_recursive()
-        return result
-
-    def _load_banner(self, update: bool = False) -> None:
+        return list(self.pull_many(10, with_pity, as_dicts=True))
+
+    def pull_many(
+        self,
+        n: int,
+        with_pity: bool = False,
+        as_dicts: bool = False,
+    ) -> Union[np.ndarray, PullView]:
+        """Pull ``n`` times in one batched draw
+
+        Returns operator indices into ``self.operators``, or a lazy
+        ``PullView`` of operator dicts if ``as_dicts`` is set. With pity, every
+        complete block of ten follows the ``pull10`` rule: the tenth pull is
+        drawn from the pity table if the first nine are all below 5 stars.
+        """
+        indices = self.sampler.sample(n)
+        blocks = n // 10
+        if with_pity and blocks:
+            rarities = self.operator_rarities[indices[:blocks * 10]]
+            no_five_star = (rarities.reshape(blocks, 10)[:, :9] < 5).all(1)
+            pity_pulls = np.flatnonzero(no_five_star) * 10 + 9
+            indices[pity_pulls] = self.pity_sampler.sample(len(pity_pulls))
+        if as_dicts:
+            return PullView(self.operators, indices)
+        return indices
+
+    def pull_with_counter(
+        self,
+        n: int,
+        pity: int = 0,
+        with_pity: bool = False,
+    ) -> tuple[np.ndarray, int]:
+        """Pull ``n`` times under the six-star pity counter
+
+        ``pity`` is the number of pulls since the last six-star. The six-star
+        rate follows ``six_star_rate(pity)`` and the remaining rarities keep
+        their relative rates, by mixing two precompiled tables instead of
+        rebuilding the tree. Returns operator indices and the new counter.
+        """
+        rng = ProbabilityNode.rng
+        u = rng.random(n)
+        six = self.six_star_sampler.sample(n)
+        other = self.non_six_star_sampler.sample(n)
+        five = self.five_star_sampler.sample(n // 10)
+        # the rate only changes with the counter, so between six-stars it is
+        # known ahead and each run of pulls is decided in one comparison
+        six_star = np.zeros(n, dtype=bool)
+        start = 0
+        while start < n:
+            ahead = np.arange(min(n - start, self.SIX_STAR_WINDOW))
+            rates = self.six_star_rates(pity + ahead)
+            hits = u[start:start + len(ahead)] < rates
+            if not hits.any():
+                start += len(ahead)
+                pity += len(ahead)
+                continue
+            start += int(hits.argmax())
+            six_star[start] = True
+            start += 1
+            pity = 0
+        indices = np.where(six_star, six, other)
+        blocks = n // 10
+        if with_pity and blocks:
+            rarities = self.operator_rarities[indices[:blocks * 10]]
+            no_five_star = ((rarities.reshape(blocks, 10)[:, :9] < 5).all(1)
+                            & ~six_star[9:blocks * 10:10])
+            pity_blocks = np.flatnonzero(no_five_star)
+            indices[pity_blocks * 10 + 9] = five[pity_blocks]
+        return indices, pity
+
+    @classmethod
+    def six_star_rate(cls, pity: int) -> float:
+        """Six-star rate after ``pity`` pulls without a six-star"""
+        bonus = max(0, pity - cls.SIX_STAR_PITY_START + 1)
+        return min(1.0, cls.SIX_STAR_RATE + cls.SIX_STAR_PITY_STEP * bonus)
+
+    @classmethod
+    def six_star_rates(cls, pity: np.ndarray) -> np.ndarray:
+        """``six_star_rate`` of every counter in ``pity``"""
+        bonus = np.maximum(0, pity - cls.SIX_STAR_PITY_START + 1)
+        return np.minimum(1.0,
+                          cls.SIX_STAR_RATE + cls.SIX_STAR_PITY_STEP * bonus)
+
+    @property
+    def sampler(self) -> BannerSampler:
+        table = self.rng.compile()
+        if self._sampler is None or self._sampler.table is not table:
+            self._sampler = BannerSampler(table, self.operators_index)
+        return self._sampler
+
+    def _load_banner(
+        self,
+        update: bool = False,
+        dataset: Optional[GachaDataset] = None,
+    ) -> None:
         if update:
-            save_operators_info(less=True)
-            save_banners_info()
-        path = Path(self.OPERATORS_INFO_FILEPATH)
-        with path.open("r", encoding="utf-8") as f:
-            self.operators = json.loads(f.read())
-        self.operators_dict = {op["cn_name"]: op for op in self.operators}
-        path = Path(self.BANNERS_FILEPATH)
-        with path.open("r", encoding="utf-8") as f:
-            self.banners = json.loads(f.read())
+            dataset = reload_dataset(update=True)
+        self.dataset = dataset or get_dataset()
+        self.operators = self.dataset.operators
+        self.operators_dict = self.dataset.operators_dict
+        self.operators_index = self.dataset.operators_index
+        self.catalog = self.dataset.catalog
+        self.operator_rarities = self.catalog.rarities
+        self.banners = self.dataset.banners
 
         self.set_banner(self.name)
 
     def set_banner(self, banner_name: str, default: bool = True) -> bool:
-        banner_ = None
         ret = 0
-        for banner in self.banners:
-            if banner["name"] == banner_name:
-                banner_ = banner
+        banner_ = self.dataset.banners_dict.get(banner_name)
 
         if not banner_:
             if default:
@@ -129,14 +271,18 @@ class ArknightsBanner(GachaBanner):
         return ret
 
     def _load_available_operators(self) -> None:
-        filter_ = partial(
-            self._filter,
-            rarity=">0",
-            approach="标准寻访",
-            before_date=self.banner["time"],
-        )
-
-        self.available_operators = list(filter(filter_, self.operators))
+        self.available_pools = {
+            i: self.catalog.pool(
+                i,
+                approach="标准寻访",
+                before_date=self.banner["time"],
+            )
+            for i in range(1, 7)
+        }
+        self.available_operators = [
+            self.operators[j] for i in range(1, 7)
+            for j in self.available_pools[i]
+        ]
         self.available_operators_dict = {
             op["cn_name"]: op
             for op in self.available_operators
@@ -154,9 +300,11 @@ class ArknightsBanner(GachaBanner):
 
     def _load_probability_tree(self) -> None:
         self.N_STARS_POOL = {
-            i: list(
-                filter(partial(self._filter, rarity=i),
-                       self.available_operators))
+            i: [
+                self.operators[j] for j in self.available_pools[i]
+                if self.operators[j]["cn_name"] in
+                self.available_operators_dict
+            ]
             for i in range(3, 7)
         }
         self.N_STARS_RATE = {
@@ -188,22 +336,24 @@ class ArknightsBanner(GachaBanner):
                 value=self.N_STARS_POOL[k],
             )
 
-    def _filter(
-        self,
-        op: dict,
-        rarity: Union[str, int] = ">0",
-        approach: str = "标准寻访",
-        before_date: Optional[str] = None,
-    ) -> bool:
-        rarity_condition = None
-        if not before_date: before_date = "99991230"
-        try:
-            rarity_condition = eval(f"op['rarity']{rarity}")
-        except SyntaxError:
-            rarity_condition = op["rarity"] == int(rarity)
-
-        return rarity_condition and approach in op["approach"] and arrow.get(
-            before_date) >= arrow.get(op["release_time"])
+        self._compile_samplers()
+
+    def _compile_samplers(self) -> None:
+        self.rng.set_children_probabilities(self.PITY_PROBABILITIES)
+        self.pity_sampler = BannerSampler(self.rng.compile(),
+                                          self.operators_index)
+        self.rng.reset_children_recursive()
+        self._sampler = BannerSampler(self.rng.compile(),
+                                      self.operators_index)
+        rarities = self._sampler.rarities
+        # a banner without one of these rarities draws from the tables it
+        # has, as pull_many would
+        self.six_star_sampler = (self._sampler.subset(rarities == 6)
+                                 or self._sampler)
+        self.five_star_sampler = (self._sampler.subset(rarities == 5)
+                                  or self.pity_sampler)
+        self.non_six_star_sampler = (self._sampler.subset(rarities != 6)
+                                     or self._sampler)
 
 
 def format_gacha_result(pulls: list) -> str:
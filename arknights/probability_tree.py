@@ -1,13 +1,79 @@
 from __future__ import annotations
 
 from decimal import Decimal
-from typing import Any, List, Optional, Union
+from typing import Any, List, Optional, Sequence, Union
 
-from numpy.random import default_rng
+import numpy as np
+from numpy.random import Generator, default_rng
 
 Number = Union[Decimal, int, float]
 
 
+class AliasTable:
+    """Walker/Vose alias table: O(1) sampling from a fixed discrete distribution"""
+    def __init__(
+        self,
+        weights: Sequence[Number],
+        values: Optional[list[Any]] = None,
+        leaves: Optional[list[ProbabilityNode]] = None,
+        rng: Optional[Generator] = None,
+    ) -> None:
+        w = np.asarray([float(i) for i in weights], dtype=np.float64)
+        total = w.sum()
+        if not len(w) or total <= 0:
+            raise ValueError("Cannot build an alias table without weights")
+        n = len(w)
+        self.n = n
+        self.probabilities = w / total
+        self.values = values if values is not None else list(range(n))
+        self.leaves = leaves
+        self.rng = rng
+
+        scaled = self.probabilities * n
+        prob = np.ones(n, dtype=np.float64)
+        alias = np.arange(n, dtype=np.intp)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+        self.prob = prob
+        self.alias = alias
+        self._prob = prob.tolist()
+        self._alias = alias.tolist()
+
+    def sample(
+        self,
+        size: Optional[int] = None,
+        rng: Optional[Generator] = None,
+    ) -> Any:
+        rng = rng or self.rng or ProbabilityNode.rng
+        if size is None:
+            x = rng.random() * self.n
+            i = int(x)
+            return i if x - i < self._prob[i] else self._alias[i]
+        x = rng.random(size) * self.n
+        i = x.astype(np.intp)
+        return np.where(x - i < self.prob[i], i, self.alias[i])
+
+    def subset(self, mask: np.ndarray) -> AliasTable:
+        """Table conditioned on the outcomes selected by ``mask``"""
+        keep = np.flatnonzero(mask).tolist()
+        return AliasTable(
+            self.probabilities[keep],
+            [self.values[i] for i in keep],
+            [self.leaves[i] for i in keep] if self.leaves else None,
+            self.rng,
+        )
+
+    def __len__(self) -> int:
+        return self.n
+
+
 class ProbabilityNode:
     ROUND_TO = 2
 
@@ -28,6 +94,8 @@ class ProbabilityNode:
         if not children:
             children = []
         self.children = children
+        self.parent: Optional[ProbabilityNode] = None
+        self._compiled: Optional[AliasTable] = None
         for child in self.children:
             child.parent = self
 
@@ -46,6 +114,40 @@ class ProbabilityNode:
         else:
             return result
 
+    def compile(self) -> AliasTable:
+        """Flatten the tree into an alias table over every leaf item
+
+        Leaves whose value is a list spread their probability evenly over its
+        items, like ``random.choice(leaf.value)`` does after
+        ``choice_recursive``. The table is cached until the weights change.
+        """
+        if self._compiled is None:
+            weights, values, leaves = [], [], []
+            for leaf, p in self._iter_leaves(1.0):
+                items = leaf.value if isinstance(leaf.value,
+                                                 (list, tuple)) else [leaf.value]
+                for item in items:
+                    weights.append(p / len(items))
+                    values.append(item)
+                    leaves.append(leaf)
+            self._compiled = AliasTable(weights, values, leaves)
+        return self._compiled
+
+    def _iter_leaves(self, probability: float):
+        if not self.children:
+            yield self, probability
+            return
+        for child in self.children:
+            if child.probability:
+                yield from child._iter_leaves(
+                    probability * float(child.probability))
+
+    def _invalidate(self) -> None:
+        node = self
+        while node is not None:
+            node._compiled = None
+            node = node.parent
+
     def get_child_by_name(
         self,
         name: str,
@@ -64,6 +166,7 @@ class ProbabilityNode:
         if not child: child = ProbabilityNode(**kwargs)
         self.children.append(child)
         child.parent = self
+        self._invalidate()
 
     def set_children_probabilities(
         self,
@@ -75,16 +178,19 @@ class ProbabilityNode:
         if isinstance(probabilities, dict):
             for k, v in probabilities.items():
                 self.get_child_by_name(k)._probability = self._decimalize(v)
+        self._invalidate()
 
     def reset_children(self) -> None:
         for child in self.children:
             child._reset()
+        self._invalidate()
 
     def reset_children_recursive(self) -> None:
         for child in self.children:
             if child.children:
                 child.reset_children_recursive()
             child._reset()
+        self._invalidate()
 
     @property
     def probability(self) -> Number:
@@ -102,6 +208,7 @@ class ProbabilityNode:
             sibling._probability -= diff * (sibling.probability /
                                             (1 - self._probability))
         self._probability = value
+        self._invalidate()
 
     def _get_siblings(self) -> Optional[List[ProbabilityNode]]:
         return [child for child in self.parent.children if child is not self]
@@ -125,6 +232,7 @@ if __name__ == "__main__":
     root.add_child(ProbabilityNode(name="d", probability=0.02))
     print(root.children)
     print(root.choice_recursive())
+    print(root.compile().values[root.compile().sample()])
     a = root.get_child_by_name("a")
     a.probability = 1
     print(root.children)
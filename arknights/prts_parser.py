@@ -0,0 +1,85 @@
+from html.parser import HTMLParser
+from typing import Callable, Iterable, Iterator, Optional, TypeVar, Union
+
+T = TypeVar("T")
+Chunks = Union[str, Iterable[str]]
+
+
+class SMWDataParser(HTMLParser):
+    """Emits the attributes of every ``.smwdata`` element as it streams by"""
+    def __init__(self, callback: Callable[[dict[str, str]], None]) -> None:
+        super().__init__()
+        self.callback = callback
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        attrs_ = dict(attrs)
+        if "smwdata" in (attrs_.get("class") or "").split():
+            del attrs_["class"]
+            self.callback(attrs_)
+
+
+class TableRowParser(HTMLParser):
+    """Emits each ``<tr>`` as a list of ``(text, first link title)`` cells"""
+    def __init__(
+        self,
+        callback: Callable[[list[tuple[str, Optional[str]]]], None],
+    ) -> None:
+        super().__init__()
+        self.callback = callback
+        self._row: Optional[list[tuple[str, Optional[str]]]] = None
+        self._cell: Optional[list[str]] = None
+        self._title: Optional[str] = None
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+            self._title = None
+        elif tag == "a" and self._cell is not None and self._title is None:
+            self._title = dict(attrs).get("title")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in ("td", "th") and self._cell is not None:
+            assert self._row is not None
+            self._row.append(("".join(self._cell).strip(), self._title))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self.callback(self._row)
+            self._row = None
+
+    def handle_data(self, data: str) -> None:
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def iter_chunks(text: str, size: int = 1 << 16) -> Iterator[str]:
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def iter_parsed(
+    parser_class: Callable[[Callable[[T], None]], HTMLParser],
+    chunks: Chunks,
+) -> Iterator[T]:
+    """Feed ``chunks`` through a callback parser, yielding records as they
+    are completed so only one chunk of HTML is held at a time"""
+    if isinstance(chunks, str):
+        chunks = iter_chunks(chunks)
+    records: list[T] = []
+    parser = parser_class(records.append)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from records
+        records.clear()
+    parser.close()
+    yield from records
+
+
+def iter_smwdata(chunks: Chunks) -> Iterator[dict[str, str]]:
+    return iter_parsed(SMWDataParser, chunks)
+
+
+def iter_table_rows(
+        chunks: Chunks) -> Iterator[list[tuple[str, Optional[str]]]]:
+    return iter_parsed(TableRowParser, chunks)
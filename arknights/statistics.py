@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from numpy.random import SeedSequence, default_rng
+
+from .gacha import ArknightsBanner
+
+
+class UnknownOperator(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class PullOdds:
+    """Per-pull odds of a target operator, indexed by the six-star pity counter
+
+    ``hit[k]`` is the chance to pull the target and ``six_star[k]`` the chance
+    to pull any other six-star (which resets the counter) at pity ``k``.
+    """
+    hit: np.ndarray
+    six_star: np.ndarray
+
+
+@dataclass(frozen=True)
+class SimulationResult:
+    pulls: np.ndarray
+    max_pulls: int
+
+    @property
+    def mean(self) -> float:
+        return float(self.pulls.mean())
+
+    def probability_within(self, n: int) -> float:
+        return float((self.pulls <= n).mean())
+
+
+class BannerStatistics:
+    """Pity-aware odds of pulling a given operator on a banner
+
+    Rates are read from the banner's compiled sampler, so they follow the same
+    rarity rates and rateup lists as ``ArknightsBanner.pull``.
+    """
+    def __init__(
+        self,
+        banner: ArknightsBanner,
+        soft_pity: bool = True,
+    ) -> None:
+        self.banner = banner
+        self.soft_pity = soft_pity
+
+    def pull_odds(self, name: str) -> PullOdds:
+        index = self.banner.operators_index.get(name)
+        sampler = self.banner.sampler
+        probabilities = sampler.table.probabilities
+        if index is None or index not in sampler.operator_indices:
+            raise UnknownOperator(name)
+
+        rarity = self.banner.operators[index]["rarity"]
+        target = probabilities[sampler.operator_indices == index].sum()
+        base_six = probabilities[sampler.rarities == 6].sum()
+
+        six_rates = [base_six]
+        if self.soft_pity:
+            while six_rates[-1] < 1:
+                six_rates.append(self.banner.six_star_rate(len(six_rates)))
+        six = np.array(six_rates)
+
+        if rarity == 6:
+            hit = six * (target / base_six)
+            six_star = six - hit
+        else:
+            hit = (1 - six) * (target / (1 - base_six))
+            six_star = six
+        return PullOdds(hit=hit, six_star=six_star)
+
+    def expected_pulls(self, name: str, pity: int = 0) -> float:
+        """Expected number of pulls to get ``name`` starting at ``pity``"""
+        return expected_pulls(self.pull_odds(name), pity)
+
+    def probability_within(
+        self,
+        name: str,
+        n: int,
+        pity: int = 0,
+    ) -> np.ndarray:
+        """Chance of having pulled ``name`` after 1..``n`` pulls"""
+        return probability_within(self.pull_odds(name), n, pity)
+
+    def simulate(
+        self,
+        name: str,
+        trials: int = 100000,
+        max_pulls: int = 10000,
+        workers: Optional[int] = None,
+        seed: Optional[int] = None,
+        executor: Optional[ProcessPoolExecutor] = None,
+    ) -> SimulationResult:
+        """Monte Carlo estimate of pulls needed, batched across processes
+
+        Trials that never hit within ``max_pulls`` are reported as
+        ``max_pulls + 1``.
+        """
+        odds = self.pull_odds(name)
+        own_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(workers)
+        n_chunks = workers or os.cpu_count() or 1
+        seeds = SeedSequence(seed).spawn(n_chunks)
+        sizes = [
+            len(c) for c in np.array_split(np.arange(trials), n_chunks)
+        ]
+        try:
+            chunks = executor.map(
+                simulate_chunk,
+                [odds] * n_chunks,
+                sizes,
+                [max_pulls] * n_chunks,
+                seeds,
+            )
+            pulls = np.concatenate(list(chunks))
+        finally:
+            if own_executor:
+                executor.shutdown()
+        return SimulationResult(pulls=pulls, max_pulls=max_pulls)
+
+
+def transitions(odds: PullOdds) -> np.ndarray:
+    """Transition matrix of the pity counter until the target is pulled"""
+    n = len(odds.hit)
+    q = np.zeros((n, n))
+    q[:, 0] += odds.six_star
+    stay = 1 - odds.hit - odds.six_star
+    q[np.arange(n - 1), np.arange(1, n)] += stay[:-1]
+    q[n - 1, n - 1] += stay[-1]
+    return q
+
+
+def expected_pulls(odds: PullOdds, pity: int = 0) -> float:
+    q = transitions(odds)
+    steps = np.linalg.solve(np.eye(len(q)) - q, np.ones(len(q)))
+    return float(steps[min(pity, len(q) - 1)])
+
+
+def probability_within(odds: PullOdds, n: int, pity: int = 0) -> np.ndarray:
+    q = transitions(odds)
+    state = np.zeros(len(q))
+    state[min(pity, len(q) - 1)] = 1
+    cdf = np.empty(n)
+    for i in range(n):
+        state = state @ q
+        cdf[i] = 1 - state.sum()
+    return cdf
+
+
+def simulate_chunk(
+    odds: PullOdds,
+    trials: int,
+    max_pulls: int,
+    seed: SeedSequence,
+) -> np.ndarray:
+    """Simulate ``trials`` independent players pulling until they hit"""
+    rng = default_rng(seed)
+    last = len(odds.hit) - 1
+    pity = np.zeros(trials, dtype=np.intp)
+    pulls = np.full(trials, max_pulls + 1, dtype=np.int64)
+    active = np.arange(trials)
+    for i in range(1, max_pulls + 1):
+        if not len(active):
+            break
+        k = pity[active]
+        u = rng.random(len(active))
+        hit = u < odds.hit[k]
+        six = ~hit & (u < odds.hit[k] + odds.six_star[k])
+        pulls[active[hit]] = i
+        pity[active] = np.where(six, 0, np.minimum(k + 1, last))
+        active = active[~hit]
+    return pulls
@@ -1,19 +1,26 @@
-from typing import List
+from typing import List, Optional
 from functools import partial
 
 import arrow
-import requests
 import json
 import os
 from bs4 import BeautifulSoup
 from pathlib import Path
 
+from .fetch import fetch_pages_sync
+from .prts_parser import Chunks, iter_smwdata, iter_table_rows
+
 BeautifulSoup = partial(BeautifulSoup, features="html.parser")
-os.chdir(Path(__file__).parent)
 
-PRTS_OPS_URL = "http://prts.wiki/w/%E5%B9%B2%E5%91%98%E4%B8%80%E8%A7%88"
-PRTS_TIMES_URL = "http://prts.wiki/w/%E5%B9%B2%E5%91%98%E4%B8%8A%E7%BA%BF%E6%97%B6%E9%97%B4%E4%B8%80%E8%A7%88"
-PRTS_BANNERS_URL = "http://prts.wiki/w/%E5%8D%A1%E6%B1%A0%E4%B8%80%E8%A7%88/%E9%99%90%E6%97%B6%E5%AF%BB%E8%AE%BF"
+PRTS_BASE_URL = os.getenv("PRTS_BASE_URL", "http://prts.wiki")
+PRTS_OPS_URL = f"{PRTS_BASE_URL}/w/%E5%B9%B2%E5%91%98%E4%B8%80%E8%A7%88"
+PRTS_TIMES_URL = f"{PRTS_BASE_URL}/w/%E5%B9%B2%E5%91%98%E4%B8%8A%E7%BA%BF%E6%97%B6%E9%97%B4%E4%B8%80%E8%A7%88"
+PRTS_BANNERS_URL = f"{PRTS_BASE_URL}/w/%E5%8D%A1%E6%B1%A0%E4%B8%80%E8%A7%88/%E9%99%90%E6%97%B6%E5%AF%BB%E8%AE%BF"
+PRTS_URLS = (PRTS_OPS_URL, PRTS_TIMES_URL, PRTS_BANNERS_URL)
+
+ASSETS_DIR = Path(__file__).parent.parent / "assets" / "arknights"
+OPERATORS_LESS_PATH = ASSETS_DIR / "operators_less.json"
+BANNERS_PATH = ASSETS_DIR / "banners.json"
 
 
 def remove_prefix(prefix, string):
@@ -40,9 +47,10 @@ def remove_suffix(string, suffix):
         return string
 
 
-def get_banners_info():
-    res = requests.get(PRTS_BANNERS_URL)
-    soup = BeautifulSoup(res.text)
+def get_banners_info(html: Optional[str] = None):
+    if html is None:
+        html, = (page.text for page in fetch_pages_sync([PRTS_BANNERS_URL]))
+    soup = BeautifulSoup(html)
 
     result = []
     for tr in soup.find_all("tr"):
@@ -68,18 +76,31 @@ def get_banners_info():
     return result
 
 
-def save_banners_info() -> None:
-    path = Path("../assets/arknights/banners.json")
-    with path.open("w", encoding="utf-8") as f:
-        f.write(json.dumps(
-            get_banners_info(),
-            ensure_ascii=False,
-            indent=4,
-        ))
+def write_atomic(path: Path, text: str) -> None:
+    temp = path.with_name(f".{path.name}.tmp")
+    with temp.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def dump_banners_info(html: Optional[str] = None) -> str:
+    return json.dumps(
+        get_banners_info(html),
+        ensure_ascii=False,
+        indent=4,
+    )
+
+
+def save_banners_info(html: Optional[str] = None) -> None:
+    write_atomic(BANNERS_PATH, dump_banners_info(html))
 
 
 def get_operators_info(
     *args,
+    ops_html: Optional[Chunks] = None,
+    times_html: Optional[Chunks] = None,
     **kwargs,
 ) -> List[dict]:
     filters = kwargs.get("filters")
@@ -99,32 +120,33 @@ def get_operators_info(
         filter_ = lambda *_: True
         rename_map = None
 
-    res = requests.get(PRTS_OPS_URL)
-    soup = BeautifulSoup(res.text)
+    if ops_html is None:
+        ops_html, times_html = (page.iter_chunks()
+                                for page in fetch_pages_sync(
+                                    [PRTS_OPS_URL, PRTS_TIMES_URL]))
 
     result = []
     temp_operators = dict()
-    for op in soup.find_all(class_="smwdata"):
-        del op.attrs["class"]
+    for attrs in iter_smwdata(ops_html):
         temp = {
             rename_map[remove_prefix("data-", k)]
             if rename_map else remove_prefix("data-", k): v
-            for k, v in op.attrs.items()
+            for k, v in attrs.items()
             if filter_((remove_prefix("data-", k)))
         }
         result.append(temp)
         if all_ or "time" in rename_map:
-            temp_operators[op["data-cn"]] = temp
+            temp_operators[attrs["data-cn"]] = temp
 
     if temp_operators:
-        res = requests.get(PRTS_TIMES_URL)
-        soup = BeautifulSoup(res.text)
-        for tag in soup.find_all("tr")[1:]:
-            children = tuple(
-                filter(lambda i: not isinstance(i, str), tag.contents))
-
-            name = children[0].a["title"]
-            time = arrow.get(children[2].string,
+        if times_html is None:
+            times_html, = (page.iter_chunks()
+                           for page in fetch_pages_sync([PRTS_TIMES_URL]))
+        rows = iter_table_rows(times_html)
+        next(rows, None)
+        for cells in rows:
+            name = cells[0][1]
+            time = arrow.get(cells[2][0],
                              "YYYY-M-DTHH:mm:ss").format("YYYYMMDD")
             if temp_operators.get(name):
                 temp_operators[name][
@@ -138,29 +160,56 @@ def get_operators_info(
     return result
 
 
-def save_operators_info(less: bool = True) -> None:
-    path = f"../assets/arknights/operators{'_less' if less else ''}.json"
-    path = Path(path)
-
-    if less:
-        with path.open("w", encoding="utf-8") as f:
-            f.write(
-                json.dumps(
-                    get_operators_info(
-                        "approach",
-                        "class",
-                        "rarity",
-                        cn="cn_name",
-                        en="en_name",
-                        time="release_time",
-                        filters={
-                            "rarity": lambda i: int(i) + 1,
-                        },
-                        all=not less,
-                    ),
-                    ensure_ascii=False,
-                    indent=4,
-                ))
+def dump_operators_info(
+    less: bool = True,
+    ops_html: Optional[Chunks] = None,
+    times_html: Optional[Chunks] = None,
+) -> str:
+    return json.dumps(
+        get_operators_info(
+            "approach",
+            "class",
+            "rarity",
+            cn="cn_name",
+            en="en_name",
+            time="release_time",
+            filters={
+                "rarity": lambda i: int(i) + 1,
+            },
+            all=not less,
+            ops_html=ops_html,
+            times_html=times_html,
+        ),
+        ensure_ascii=False,
+        indent=4,
+    )
+
+
+def save_operators_info(
+    less: bool = True,
+    ops_html: Optional[Chunks] = None,
+    times_html: Optional[Chunks] = None,
+) -> None:
+    path = ASSETS_DIR / f"operators{'_less' if less else ''}.json"
+    write_atomic(path, dump_operators_info(less, ops_html, times_html))
+
+
+def update_assets(force: bool = False) -> bool:
+    """Fetch all PRTS pages concurrently and rewrite the assets
+
+    Returns False without touching the assets if none of the pages changed
+    since the last fetch.
+    """
+    ops, times, banners = fetch_pages_sync(PRTS_URLS)
+    if not force and not any(page.modified for page in (ops, times, banners)):
+        return False
+    # Parse everything before touching the assets, then swap both files in
+    operators_info = dump_operators_info(True, ops.iter_chunks(),
+                                         times.iter_chunks())
+    banners_info = dump_banners_info(banners.text)
+    write_atomic(OPERATORS_LESS_PATH, operators_info)
+    write_atomic(BANNERS_PATH, banners_info)
+    return True
 
 
 if __name__ == "__main__":
@@ -177,5 +226,4 @@ if __name__ == "__main__":
     #         cn="cn_name",
     #     ))
     # pprint(get_banners_info())
-    save_operators_info()
-    save_banners_info()
+    update_assets(force=True)
@@ -0,0 +1,144 @@
+"""Local stand-in for the Telegram Bot API
+
+Answers ``POST /bot<token>/<method>`` with JSON shaped like the real API,
+records every call and enforces the same rate limits as Telegram with 429
+responses, so the outbound queue can be exercised without the network.
+
+Usage:
+    python -m benchmarks.fake_bot_api --port 8081 --latency 0.05
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+
+class FakeBotAPI:
+    """Fake Bot API server running on a background thread"""
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        global_limit: int = 30,
+        private_chat_limit: int = 1,
+        group_chat_limit: int = 20,
+    ) -> None:
+        self.latency = latency
+        self.limits = {
+            "global": (global_limit, 1.0),
+            "private": (private_chat_limit, 1.0),
+            "group": (group_chat_limit, 60.0),
+        }
+        self.calls: list[tuple[float, str, dict[str, Any]]] = []
+        self.rejected = 0
+        self._sent: dict[Any, deque[float]] = defaultdict(deque)
+        self._message_ids: dict[Any, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                params = json.loads(self.rfile.read(length) or b"{}")
+                method = self.path.rsplit("/", 1)[-1]
+                body = json.dumps(api.handle(method, params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://{}:{}".format(*self.server.server_address)
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+
+    def __enter__(self) -> "FakeBotAPI":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _retry_after(self, key: Any, kind: str, now: float) -> Optional[int]:
+        limit, window = self.limits[kind]
+        sent = self._sent[key]
+        while sent and sent[0] <= now - window:
+            sent.popleft()
+        if len(sent) >= limit:
+            return max(1, round(sent[0] + window - now))
+        return None
+
+    def handle(self, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        if self.latency:
+            time.sleep(self.latency)
+        chat_id = params.get("chat_id")
+        now = time.monotonic()
+        with self._lock:
+            if method == "sendMessage":
+                kind = ("private" if isinstance(chat_id, int) and chat_id > 0
+                        else "group")
+                retry_after = (self._retry_after("global", "global", now)
+                               or self._retry_after(chat_id, kind, now))
+                if retry_after is not None:
+                    self.rejected += 1
+                    return {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": "Too Many Requests: retry after "
+                        f"{retry_after}",
+                        "parameters": {
+                            "retry_after": retry_after
+                        },
+                    }
+                self._sent["global"].append(now)
+                self._sent[chat_id].append(now)
+            self.calls.append((now, method, params))
+            if method != "sendMessage":
+                return {"ok": True, "result": True}
+            self._message_ids[chat_id] += 1
+            return {
+                "ok": True,
+                "result": {
+                    "message_id": self._message_ids[chat_id],
+                    "chat": {
+                        "id": chat_id
+                    },
+                    "date": int(time.time()),
+                    "text": params.get("text", ""),
+                },
+            }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    api = FakeBotAPI(args.host, args.port, args.latency)
+    print(f"Fake Bot API listening on {api.url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
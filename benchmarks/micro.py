@@ -0,0 +1,92 @@
+"""Micro-benchmarks of the hot paths behind the busiest commands
+
+Usage:
+    python -m benchmarks.micro
+    python -m benchmarks.micro dice bobing --min-time 1
+
+Reports the mean time per call of each case, taking the best of
+``--repeat`` runs of at least ``--min-time`` seconds each.
+"""
+import argparse
+import timeit
+from typing import Callable, Iterator
+
+import numpy as np
+
+Case = tuple[str, Callable[[], object]]
+
+
+def gacha_cases() -> Iterator[Case]:
+    from arknights.dataset import get_dataset
+
+    dataset = get_dataset()
+    banner = dataset.get_banner(dataset.banners[-1]["name"])
+    yield "ArknightsBanner.pull", banner.pull
+    yield "ArknightsBanner.pull10", lambda: banner.pull10(False)
+    yield "ArknightsBanner.pull10 (pity)", lambda: banner.pull10(True)
+    yield "ArknightsBanner.pull_many(1000)", lambda: banner.pull_many(1000)
+
+
+def dice_cases() -> Iterator[Case]:
+    from exusiai_bot.dice import Dice
+
+    dice = Dice(max_repeats=10, max_throws=100, max_sides=1000)
+    for code in ("1d100", "4d6kh3+2", "3#30d100*5+2", "1d100<=65"):
+        result = dice.roll(code)
+        yield f"Dice.roll({code})", lambda code=code: dice.roll(code)
+        yield f"RollResult.get_message({code})", result.get_message
+    yield ("Dice.distribution(100d1000) (cached)",
+           lambda: dice.distribution("100d1000"))
+    big = Dice(max_repeats=50, max_throws=100000, max_dice=5 * 10**6)
+    for code in ("10000d6", "50#1000d20", "100000d6kh3"):
+        yield (f"Dice.roll({code}).get_message",
+               lambda code=code: big.roll(code).get_message())
+
+
+def bobing_cases() -> Iterator[Case]:
+    from exusiai_bot.bobing import get_bobing_result, score_rolls
+
+    rng = np.random.default_rng(0)
+    rolls = rng.integers(1, 6, size=(4096, 6), endpoint=True)
+    sorted_rolls = [sorted(roll) for roll in rolls.tolist()]
+    state = {"i": 0}
+
+    def one() -> object:
+        state["i"] = (state["i"] + 1) & 4095
+        return get_bobing_result(sorted_rolls[state["i"]])
+
+    yield "get_bobing_result", one
+    yield "score_rolls (4096 rolls)", lambda: score_rolls(rolls)
+
+
+GROUPS = {"gacha": gacha_cases, "dice": dice_cases, "bobing": bobing_cases}
+
+
+def measure(fn: Callable[[], object], min_time: float, repeat: int) -> float:
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("groups",
+                        nargs="*",
+                        metavar="GROUP",
+                        help=f"any of {', '.join(GROUPS)}; all by default")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    unknown = set(args.groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+
+    for group in args.groups or GROUPS:
+        for name, fn in GROUPS[group]():
+            seconds = measure(fn, args.min_time, args.repeat)
+            print(f"{name:<40} {seconds * 1e6:>12.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Compare BeautifulSoup and streaming extraction of the PRTS operator pages
+
+Usage:
+    python -m benchmarks.parse_operators
+    python -m benchmarks.parse_operators OPS_HTML TIMES_HTML
+    python -m benchmarks.parse_operators --synthetic 20000
+
+Without arguments the saved PRTS pages in tests/fixtures/prts are parsed.
+
+Each mode runs in a fresh subprocess so peak RSS is measured in isolation.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+FIXTURES = Path(__file__).parent.parent / "tests" / "fixtures" / "prts"
+SAVED_PAGES = (str(FIXTURES / "operators.html"), str(FIXTURES / "times.html"))
+
+
+def soup_extract(ops_path: str, times_path: str) -> int:
+    """The previous BeautifulSoup-based extraction, kept for comparison"""
+    from bs4 import BeautifulSoup
+
+    with open(ops_path, encoding="utf-8") as f:
+        soup = BeautifulSoup(f.read(), features="html.parser")
+    operators = {
+        op["data-cn"]: dict(op.attrs)
+        for op in soup.find_all(class_="smwdata")
+    }
+    with open(times_path, encoding="utf-8") as f:
+        soup = BeautifulSoup(f.read(), features="html.parser")
+    for tag in soup.find_all("tr")[1:]:
+        children = tuple(
+            filter(lambda i: not isinstance(i, str), tag.contents))
+        name = children[0].a["title"]
+        if name in operators:
+            operators[name]["time"] = children[2].string
+    return len(operators)
+
+
+def stream_extract(ops_path: str, times_path: str) -> int:
+    from arknights.fetch import Page
+    from arknights.prts_parser import iter_smwdata, iter_table_rows
+
+    operators = {
+        op["data-cn"]: op
+        for op in iter_smwdata(Page("", Path(ops_path), False).iter_chunks())
+    }
+    rows = iter_table_rows(Page("", Path(times_path), False).iter_chunks())
+    next(rows, None)
+    for cells in rows:
+        if cells[0][1] in operators:
+            operators[cells[0][1]]["time"] = cells[2][0]
+    return len(operators)
+
+
+MODES = {"soup": soup_extract, "stream": stream_extract}
+
+
+def write_synthetic_pages(directory: str, n: int) -> tuple[str, str]:
+    ops_path = Path(directory) / "ops.html"
+    times_path = Path(directory) / "times.html"
+    with ops_path.open("w", encoding="utf-8") as f:
+        f.write("<html><body><div id='filter-data'>")
+        for i in range(n):
+            f.write(f'<div class="smwdata" data-cn="干员{i}" data-en="Op{i}" '
+                    f'data-rarity="{i % 6}" data-class="术师" '
+                    f'data-approach="公开招募, 标准寻访" data-skill="{"x" * 200}">'
+                    "</div>")
+        f.write("</div></body></html>")
+    with times_path.open("w", encoding="utf-8") as f:
+        f.write("<table><tr><th>干员</th><th>职业</th><th>上线时间</th></tr>")
+        for i in range(n):
+            f.write(f'<tr><td><a href="/w/{i}" title="干员{i}">干员{i}</a></td>'
+                    f"<td>术师</td><td>2020-1-1T10:00:00</td></tr>")
+        f.write("</table>")
+    return str(ops_path), str(times_path)
+
+
+def run_one(mode: str, ops_path: str, times_path: str) -> None:
+    start = time.perf_counter()
+    count = MODES[mode](ops_path, times_path)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"count": count, "seconds": elapsed, "peak_kb": peak_kb}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*")
+    parser.add_argument("--synthetic", type=int, default=0)
+    parser.add_argument("--mode", choices=MODES)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_one(args.mode, *args.pages)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.synthetic:
+            pages = write_synthetic_pages(directory, args.synthetic)
+        elif len(args.pages) == 2:
+            pages = args.pages
+        elif not args.pages:
+            pages = SAVED_PAGES
+        else:
+            parser.error("pass OPS_HTML TIMES_HTML, --synthetic N or nothing")
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.parse_operators",
+                 "--mode", mode, *pages],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(out)
+            print(f"{mode:>6}: {result['count']} operators, "
+                  f"{result['seconds']:.3f}s, "
+                  f"peak RSS {result['peak_kb'] / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Replay synthetic updates through the bot's handlers
+
+Usage:
+    python -m benchmarks.replay --updates 5000 --chats 200 --threads 8
+
+Updates mixing ``.r``, ``.十连``, ``.博饼`` and ``.jrrp`` across many chats
+go through the registered ``DotCommandDispatcher`` exactly as in
+production, with replies sent through the outbox to a local fake Bot API.
+Each chat's updates are handled in order by one thread, as the webhook
+server does. Reports handler latency percentiles, updates per second, how
+long the outbox took to drain and peak memory.
+"""
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import numpy as np
+
+MIX = {
+    ".r 3d6": 3,
+    ".r1d20 侦查": 2,
+    ".r 4#4d6kh3": 1,
+    ".十连": 2,
+    ".博饼": 2,
+    ".jrrp": 1,
+}
+UNLIMITED = (1e9, 10**9)
+
+
+def synthetic_updates(
+    n: int,
+    chats: int,
+    users: int,
+    seed: int = 0,
+) -> list[dict[str, Any]]:
+    rng = random.Random(seed)
+    texts = rng.choices(list(MIX), weights=list(MIX.values()), k=n)
+    now = int(time.time())
+    updates = []
+    for i, text in enumerate(texts):
+        chat_id = -1000000 - rng.randrange(chats)
+        user_id = rng.randrange(1, users + 1)
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "text": text,
+                "chat": {
+                    "id": chat_id,
+                    "type": "group",
+                    "title": f"chat{chat_id}",
+                },
+                "from": {
+                    "id": user_id,
+                    "is_bot": False,
+                    "first_name": f"user{user_id}",
+                    "username": f"user{user_id}",
+                },
+            },
+        })
+    return updates
+
+
+def replay(args: argparse.Namespace) -> dict[str, Any]:
+    from telegram import Bot, Update
+    from telegram.ext import Updater
+
+    from benchmarks.fake_bot_api import FakeBotAPI
+    from exusiai_bot.outbox import start_outbox, stop_outbox
+    from exusiai_bot.storage import close_stores
+    from main import register_commands
+
+    token = "123456:BENCHMARK"
+    with FakeBotAPI(latency=args.api_latency,
+                    global_limit=10**9,
+                    private_chat_limit=10**9,
+                    group_chat_limit=10**9) as api:
+        bot = Bot(token, base_url=f"{api.url}/bot")
+        updater = Updater(bot=bot, use_context=True, workers=0)
+        dispatcher = updater.dispatcher
+        register_commands(dispatcher)
+        start_outbox(token,
+                     base_url=api.url,
+                     coalesce_window=0,
+                     global_rate=UNLIMITED,
+                     private_chat_rate=UNLIMITED,
+                     group_chat_rate=UNLIMITED,
+                     connections=args.connections)
+
+        updates = [
+            Update.de_json(data, bot) for data in synthetic_updates(
+                args.updates, args.chats, args.users, args.seed)
+        ]
+        by_thread: list[list[Update]] = [[] for _ in range(args.threads)]
+        for update in updates:
+            by_thread[update.effective_chat.id % args.threads].append(update)
+
+        def run(batch: list[Update]) -> list[float]:
+            latencies = []
+            for update in batch:
+                start = time.perf_counter()
+                dispatcher.process_update(update)
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            latencies = np.concatenate(
+                [np.array(r) for r in executor.map(run, by_thread)])
+        handled = time.perf_counter() - start
+        stop_outbox()
+        drained = time.perf_counter() - start
+        traced_peak = (tracemalloc.get_traced_memory()[1]
+                       if args.tracemalloc else None)
+        close_stores()
+        sent = len(api.calls)
+
+    return {
+        "updates": len(updates),
+        "messages sent": sent,
+        "p50 latency (ms)": np.percentile(latencies, 50) * 1000,
+        "p99 latency (ms)": np.percentile(latencies, 99) * 1000,
+        "max latency (ms)": latencies.max() * 1000,
+        "updates/s (handled)": len(updates) / handled,
+        "updates/s (sent)": len(updates) / drained,
+        "peak RSS (MiB)":
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "traced peak (MiB)":
+        None if traced_peak is None else traced_peak / 2**20,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # handlers persist state on import, so point them at a scratch file
+        os.environ["DATABASE_PATH"] = os.path.join(directory, "bench.sqlite3")
+        results = replay(args)
+    for name, value in results.items():
+        if value is not None:
+            print(f"{name:>20}: {value:.2f}"
+                  if isinstance(value, float) else f"{name:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import html
+import logging
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import arrow
+from telegram import ParseMode, Update
+from telegram.ext import CallbackContext
+
+from .dot_command import FilterReturns
+from .outbox import send_message
+from .profiler import Profile, get_profiler, start_profiler, stop_profiler
+
+# comma separated Telegram user ids allowed to run admin commands
+ADMIN_USER_IDS = frozenset(
+    int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",")
+    if user_id.strip())
+PROFILE_DIR = os.getenv("PROFILE_DIR", tempfile.gettempdir())
+TOP_FUNCTIONS = 15
+
+
+def admin_only(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str, str],
+) -> FilterReturns:
+    """Command filter that silently drops calls from non-admins"""
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_USER_IDS:
+        logging.warning("user %s is not allowed to run %s",
+                        user and user.id, argv[0])
+        return None
+    return update, context, argv
+
+
+def format_profile(profile: Profile, path: Optional[str]) -> str:
+    lines = [
+        f"<b>采样结束</b>: {profile.duration:.1f} 秒, "
+        f"{profile.samples} 个样本 ({profile.ticks} 次采样)",
+        f"调用栈已保存到 <code>{html.escape(path)}</code>"
+        if path is not None else "调用栈保存失败, 详见日志",
+    ]
+    if profile.samples:
+        lines.append("<b>热点函数</b> (自身 / 含子调用):")
+        lines += [
+            f"{own / profile.samples:6.1%} / {total / profile.samples:6.1%}"
+            f"  <code>{html.escape(function)}</code>"
+            for function, own, total in profile.top_functions(TOP_FUNCTIONS)
+        ]
+    return "\n".join(lines)
+
+
+def save_profile(profile: Profile) -> Optional[str]:
+    """Write ``profile`` in collapsed stack format to ``PROFILE_DIR``
+
+    Returns the path written, or None if it could not be written.
+    """
+    path = os.path.join(
+        PROFILE_DIR,
+        f"exusiai-{arrow.utcnow().format('YYYYMMDD-HHmmss')}.collapsed")
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(profile.collapsed())
+    except OSError:
+        logging.exception("cannot write profile to %s", path)
+        return None
+    logging.info("profile of %.1fs written to %s", profile.duration, path)
+    return path
+
+
+def profile_handler(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str, str],
+) -> None:
+    _, args_string = argv
+    action = args_string.strip().lower()
+    if action == "start":
+        if start_profiler() is None:
+            msg = "采样已在进行中"
+        else:
+            msg = "开始采样, 使用 <b>.profile stop</b> 结束"
+    elif action == "stop":
+        profile = stop_profiler()
+        if profile is None:
+            msg = "当前没有进行中的采样"
+        else:
+            msg = format_profile(profile, save_profile(profile))
+    else:
+        profiler = get_profiler()
+        if profiler is None:
+            status = "未开始"
+        elif profiler.running:
+            status = "进行中"
+        else:
+            status = "已到时限, 使用 stop 查看结果"
+        msg = f"用法: <b>.profile</b> <i>start|stop</i> (当前{status})"
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
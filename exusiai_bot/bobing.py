@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from itertools import product
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from numpy import ndarray
+from numpy.random import Generator, default_rng
+
+PRIZES = (
+    "状元插金花",
+    "红六勃",
+    "黑六勃",
+    "红五",
+    "五子",
+    "红四",
+    "对堂",
+    "三红",
+    "四进",
+    "二举",
+    "一秀",
+)
+NO_PRIZE = len(PRIZES)
+FACES = 6
+DICE = 6
+# A roll's table index is sum(7 ** (face - 1)) over its dice, i.e. its face
+# count vector written in base 7.
+_WEIGHTS = 7**np.arange(FACES + 1, dtype=np.int64)
+_WEIGHTS[1:] = _WEIGHTS[:-1]
+_WEIGHTS[0] = 0
+
+
+def _prize_of_counts(counts: tuple[int, ...]) -> int:
+    """Highest prize for a count vector ``counts[face - 1]``"""
+    reds = counts[3]
+    most = max(counts)
+    if reds == 4 and counts[0] == 2:
+        return PRIZES.index("状元插金花")
+    if reds == 6:
+        return PRIZES.index("红六勃")
+    if most == 6:
+        return PRIZES.index("黑六勃")
+    if reds == 5:
+        return PRIZES.index("红五")
+    if most == 5:
+        return PRIZES.index("五子")
+    if reds == 4:
+        return PRIZES.index("红四")
+    if most == 1:
+        return PRIZES.index("对堂")
+    if reds == 3:
+        return PRIZES.index("三红")
+    if most == 4:
+        return PRIZES.index("四进")
+    if reds == 2:
+        return PRIZES.index("二举")
+    if reds == 1:
+        return PRIZES.index("一秀")
+    return NO_PRIZE
+
+
+def _build_table() -> ndarray:
+    table = np.full(7**FACES, -1, dtype=np.int8)
+    for counts in product(range(DICE + 1), repeat=FACES):
+        if sum(counts) == DICE:
+            index = sum(c * 7**i for i, c in enumerate(counts))
+            table[index] = _prize_of_counts(counts)
+    table.flags.writeable = False
+    return table
+
+
+PRIZE_TABLE = _build_table()
+
+
+def score_rolls(rolls: ndarray) -> ndarray:
+    """Prize indices of an ``(n, 6)`` array of rolls; NO_PRIZE for nothing"""
+    return PRIZE_TABLE[_WEIGHTS[np.asarray(rolls)].sum(axis=-1)]
+
+
+def get_bobing_result(roll: Iterable[int]) -> Optional[str]:
+    faces = [int(face) for face in roll]
+    if len(faces) != DICE or not all(1 <= face <= FACES for face in faces):
+        raise ValueError(f"not a roll of {DICE} dice: {faces}")
+    prize = PRIZE_TABLE[sum(7**(face - 1) for face in faces)]
+    return PRIZES[prize] if prize != NO_PRIZE else None
+
+
+@lru_cache(maxsize=None)
+def prize_odds() -> ndarray:
+    """Exact probability of every prize, NO_PRIZE last"""
+    rolls = np.array(list(product(range(1, FACES + 1), repeat=DICE)))
+    counts = np.bincount(score_rolls(rolls), minlength=NO_PRIZE + 1)
+    return counts / len(rolls)
+
+
+def simulate(
+    rounds: int,
+    rng: Optional[Generator] = None,
+    chunk_size: int = 1 << 20,
+) -> ndarray:
+    """Prize counts of ``rounds`` simulated rolls, NO_PRIZE last"""
+    rng = rng or default_rng()
+    counts = np.zeros(NO_PRIZE + 1, dtype=np.int64)
+    for start in range(0, rounds, chunk_size):
+        n = min(chunk_size, rounds - start)
+        rolls = rng.integers(1, FACES, size=(n, DICE), endpoint=True,
+                             dtype=np.int8)
+        counts += np.bincount(score_rolls(rolls), minlength=NO_PRIZE + 1)
+    return counts
+
+
+class BobingGame:
+    """Prize counts per player for one chat's multi-round bobing game
+
+    Counts live in one ``(players, len(PRIZES))`` int32 array that grows by
+    doubling, so recording a roll and ranking players never touch the roll
+    history. Players rank by their counts of each prize, best prize first.
+    """
+    def __init__(self, active: bool = True) -> None:
+        self.active = active
+        self.rounds = 0
+        self.user_ids: list[int] = []
+        self.usernames: list[str] = []
+        self.counts = np.zeros((8, len(PRIZES)), dtype=np.int32)
+        self._rows: dict[int, int] = {}
+
+    def record(self, user_id: int, username: str, prize: int) -> BobingGame:
+        row = self._rows.get(user_id)
+        if row is None:
+            # grow the counts before the row becomes visible to ranking()
+            row = len(self.user_ids)
+            if row == len(self.counts):
+                self.counts = np.concatenate(
+                    [self.counts, np.zeros_like(self.counts)])
+            self.usernames.append(username)
+            self.user_ids.append(user_id)
+            self._rows[user_id] = row
+        self.usernames[row] = username
+        if prize != NO_PRIZE:
+            self.counts[row, prize] += 1
+        self.rounds += 1
+        return self
+
+    def ranking(self) -> ndarray:
+        """Player rows ordered from first to last place"""
+        counts = self.counts[:len(self.user_ids)]
+        keys = tuple(-counts[:, i] for i in reversed(range(len(PRIZES))))
+        return np.lexsort(keys) if keys[0].size else np.empty(0, np.intp)
+
+    def rank_of(self, user_id: int) -> Optional[int]:
+        row = self._rows.get(user_id)
+        if row is None:
+            return None
+        return int(np.flatnonzero(self.ranking() == row)[0]) + 1
+
+    def standings(self, top: Optional[int] = None) -> list[tuple[str, dict]]:
+        return [(self.usernames[row], {
+            PRIZES[i]: int(c)
+            for i, c in enumerate(self.counts[row]) if c
+        }) for row in self.ranking()[:top]]
+
+    def to_dict(self) -> dict[str, Any]:
+        n = len(self.user_ids)
+        return {
+            "active": self.active,
+            "rounds": self.rounds,
+            "user_ids": self.user_ids,
+            "usernames": self.usernames,
+            "counts": self.counts[:n].tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> BobingGame:
+        game = cls(data["active"])
+        for user_id, username, counts in zip(data["user_ids"],
+                                             data["usernames"],
+                                             data["counts"]):
+            game.record(user_id, username, NO_PRIZE)
+            game.counts[game._rows[user_id]] = counts
+        game.rounds = data["rounds"]
+        return game
@@ -1,8 +1,18 @@
+from __future__ import annotations
+
+import html
+import operator
 import re
-from typing import Union
+import threading
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from functools import lru_cache
+from math import comb
+from typing import Callable, Iterator, Optional, Union
 
+import numpy as np
 from numpy import ndarray
-from numpy.random import default_rng
+from numpy.random import Generator, SeedSequence, default_rng
 
 
 class DiceError(Exception):
@@ -63,83 +73,868 @@ class SidesValueError(DiceError):
         super().__init__(self.message)
 
 
-class DiceNotRolledError(DiceError):
-    """Raised when get_message is called when dice is not rolled"""
+class ConstValueError(DiceError):
+    """Raised when a constant in a dice code is larger than max_const"""
     def __init__(
         self,
-        message: str = "Connot generate message before dice is rolled"
+        value: int,
+        max_const: int,
+        message: str = "constant {} is larger than {}",
     ) -> None:
-        self.message = message
+        self.value = value
+        self.max_const = max_const
+        self.message = message.format(self.value, self.max_const)
         super().__init__(self.message)
 
 
-class Dice:
-    DICE_CODE_PAT = (
-        r"(?:(?P<repeats>[0-9]+)#)?"
-        r"(?:(?P<throws>[0-9]+)?[dD](?P<sides>[0-9]+))"
-        r"(?:[\*xX](?P<multiplier>[0-9]+))?"
-        r"(?P<bonus>[\+-][0-9])?"
-    ) # yapf: disable
-    dice_code_regex = re.compile(DICE_CODE_PAT)
-    default_formatter = "{dice_code}=\n{result}"
-    rng = default_rng()
-    rolled = False
+class ResultRangeError(DiceError):
+    """Raised when a dice code's results may not fit in 64-bit integers"""
+    def __init__(
+        self,
+        dice_code: str,
+        message: str = "Results of {} may not fit in 64-bit integers",
+    ) -> None:
+        self.dice_code = dice_code
+        self.message = message.format(self.dice_code)
+        super().__init__(self.message)
+
 
+class DiceCountValueError(DiceError):
+    """Raised when a roll throws more than max_dice dice in total"""
     def __init__(
         self,
-        max_line_length: int = 47,
-        max_repeats: int = 10,
-        max_throws: int = 100,
-        max_sides: int = 1000,
-        filler: str = "...",
+        count: int,
+        max_dice: int,
+        message: str = "{} dice in total is more than {}",
     ) -> None:
-        self.max_line_length = max_line_length
-        self.max_repeats = max_repeats
-        self.max_throws = max_throws
-        self.max_sides = max_sides
-        self.filler = filler
+        self.count = count
+        self.max_dice = max_dice
+        self.message = message.format(self.count, self.max_dice)
+        super().__init__(self.message)
+
+
+class UnsupportedDistributionError(DiceError):
+    """Raised when a dice code has no exact distribution implementation"""
+    def __init__(
+        self,
+        dice_code: str,
+        message: str = "Cannot compute the distribution of {}",
+    ) -> None:
+        self.dice_code = dice_code
+        self.message = message.format(self.dice_code)
+        super().__init__(self.message)
+
+
+@dataclass(frozen=True)
+class Const:
+    value: int
+
+
+@dataclass(frozen=True)
+class DiceTerm:
+    """``throws`` dice with ``sides`` sides, e.g. ``4d6kh3`` or ``3d6!``"""
+    index: int
+    throws: int
+    sides: int
+    keep: Optional[str] = None  # one of "kh", "kl", "dh", "dl"
+    keep_n: int = 0
+    explode: bool = False
+
+
+@dataclass(frozen=True)
+class BinOp:
+    op: str
+    left: Node
+    right: Node
+
+
+@dataclass(frozen=True)
+class Compare:
+    op: str
+    left: Node
+    right: Node
+
+
+Node = Union[Const, DiceTerm, BinOp, Compare]
+
+
+@dataclass
+class DiceRolls:
+    values: ndarray  # (repeats, throws), or the first dice of a streamed term
+    kept: Optional[ndarray] = None
+    exploded: Optional[ndarray] = None
+    elided: int = 0  # dice thrown after those in values
+
+
+class DiceParser:
+    """Recursive descent parser for dice codes
+
+    roll    := [INT "#"] expr
+    expr    := sum [("<" | "<=" | ">" | ">=" | "=") sum]
+    sum     := product (("+" | "-") product)*
+    product := atom (("*" | "x") atom)*
+    atom    := INT | dice | "(" sum ")"
+    dice    := [INT] "d" (INT | "%") [("kh" | "kl" | "dh" | "dl" | "k") INT] ["!"]
+    """
+    MAX_CONST = 10**9
+    TOKEN_PAT = re.compile(r"\s*(\d+|>=|<=|kh|kl|dh|dl|[<>=#+\-*x()d%!k])")
+    COMPARE_OPS = {
+        "<": operator.lt,
+        "<=": operator.le,
+        ">": operator.gt,
+        ">=": operator.ge,
+        "=": operator.eq,
+    }
+
+    def __init__(self, dice_code: str) -> None:
+        self.dice_code = dice_code
+        self.tokens = self._tokenize(dice_code)
+        self.pos = 0
+        self.dice: list[DiceTerm] = []
 
-    def roll(self, dice_code: str):
-        matched = self.dice_code_regex.fullmatch(dice_code)
-        if not matched:
+    def parse(self) -> tuple[Optional[int], Node]:
+        repeats = None
+        if self._peek(1) == "#":
+            repeats = self._int()
+            self._expect("#")
+        node = self._sum()
+        op = self._peek()
+        if op in self.COMPARE_OPS:
+            self.pos += 1
+            node = Compare(op, node, self._sum())
+        if self.pos != len(self.tokens):
+            raise DiceCodeSyntaxError(self.dice_code)
+        return repeats, node
+
+    def _tokenize(self, dice_code: str) -> list[str]:
+        code = dice_code.lower().replace("×", "*").replace("==", "=")
+        tokens = []
+        pos = 0
+        for match in self.TOKEN_PAT.finditer(code):
+            if match.start() != pos:
+                break
+            tokens.append(match.group(1))
+            pos = match.end()
+        if code[pos:].strip():
             raise DiceCodeSyntaxError(dice_code)
+        return tokens
+
+    def _peek(self, offset: int = 0) -> Optional[str]:
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else None
+
+    def _expect(self, token: str) -> None:
+        if self._peek() != token:
+            raise DiceCodeSyntaxError(self.dice_code)
+        self.pos += 1
+
+    def _int(self) -> int:
+        token = self._peek()
+        if token is None or not token.isdigit():
+            raise DiceCodeSyntaxError(self.dice_code)
+        self.pos += 1
+        return int(token)
+
+    def _sum(self) -> Node:
+        node = self._product()
+        while self._peek() in ("+", "-"):
+            op = self.tokens[self.pos]
+            self.pos += 1
+            node = BinOp(op, node, self._product())
+        return node
+
+    def _product(self) -> Node:
+        node = self._atom()
+        while self._peek() in ("*", "x"):
+            self.pos += 1
+            node = BinOp("*", node, self._atom())
+        return node
+
+    def _atom(self) -> Node:
+        token = self._peek()
+        if token == "(":
+            self.pos += 1
+            node = self._sum()
+            self._expect(")")
+            return node
+        if token == "d" or (token is not None and token.isdigit()
+                            and self._peek(1) == "d"):
+            return self._dice()
+        value = self._int()
+        if value > self.MAX_CONST:
+            raise ConstValueError(value, self.MAX_CONST)
+        return Const(value)
+
+    def _dice(self) -> DiceTerm:
+        throws = self._int() if self._peek() != "d" else 1
+        self._expect("d")
+        if self._peek() == "%":
+            self.pos += 1
+            sides = 100
+        else:
+            sides = self._int()
+        keep, keep_n = None, 0
+        if self._peek() in ("kh", "kl", "dh", "dl", "k"):
+            keep = {"k": "kh"}.get(self.tokens[self.pos],
+                                   self.tokens[self.pos])
+            self.pos += 1
+            keep_n = self._int()
+            if keep_n > throws:
+                raise DiceCodeSyntaxError(self.dice_code)
+        explode = self._peek() == "!"
+        if explode:
+            self.pos += 1
+            if sides == 1:
+                raise DiceCodeSyntaxError(self.dice_code)
+        term = DiceTerm(len(self.dice), throws, sides, keep, keep_n, explode)
+        self.dice.append(term)
+        return term
+
+
+Evaluator = Callable[[Generator, int, list], ndarray]
+
+
+def _digits(values: ndarray) -> ndarray:
+    """Decimal digits of every positive integer in ``values``"""
+    digits = np.ones(values.shape, dtype=np.int64)
+    power, top = 10, values.max(initial=0)
+    while power <= top:
+        digits += values >= power
+        power *= 10
+    return digits
+
+
+def _take(pieces: Iterator[str], n: int) -> str:
+    """The first ``n`` characters of the concatenated ``pieces``"""
+    taken, length = [], 0
+    for piece in pieces:
+        if length >= n:
+            break
+        taken.append(piece)
+        length += len(piece)
+    return "".join(taken)[:n]
+
+
+# stands in for the dice of a streamed term that are not kept
+_ELIDED = "..."
+
+
+class DicePlan:
+    """A parsed dice code compiled into batched NumPy operations
+
+    Every dice term is one ``Generator.integers`` draw of shape
+    ``(repeats, throws)``; the arithmetic runs on whole columns of totals.
+    Terms of more than ``STREAM_BLOCK`` dice are streamed instead, see
+    ``_stream``.
+    """
+    MAX_EXPLOSIONS = 100
+    RENDER_BLOCK = 64
+    STREAM_BLOCK = 1 << 16
+    PREVIEW_DICE = 16
+    MAX_DISTRIBUTION_SUPPORT = 10**6
+    # array element updates keep_distribution may make, well under a second
+    MAX_KEEP_DISTRIBUTION_WORK = 2 * 10**8
+
+    def __init__(self, dice_code: str) -> None:
+        parser = DiceParser(dice_code)
         self.dice_code = dice_code
-        dice_options = {
-            k: int(v) if v else v
-            for k, v in matched.groupdict().items()
-        }
-        self._validate_and_set_dice_options(**dice_options)
-
-        throws = self.throws
-        sides = self.sides
-        repeats = self.repeats
-
-        self.rolls = self.rng.integers(
-            1,
-            sides,
-            size=(repeats, throws),
-            endpoint=True,
-        )
-        if repeats == 1:
-            self.rolls = self.rolls.flatten()
-
-        self.rolled = True
+        self.repeats, self.root = parser.parse()
+        self.dice = tuple(parser.dice)
+        if not self.dice:
+            raise DiceCodeSyntaxError(dice_code)
+        self.is_comparison = isinstance(self.root, Compare)
+        # largest magnitude any intermediate result can reach
+        self.max_magnitude = 0
+        self._bounds(self.root)
+        self._evaluate = self._compile(self.root)
 
-    @classmethod
-    def test_dice_code(
-        cls,
+    def evaluate(
+        self,
+        rng: Generator,
+        repeats: int = 1,
+    ) -> tuple[ndarray, list[DiceRolls]]:
+        rolls: list = [None] * len(self.dice)
+        totals = self._evaluate(rng, repeats, rolls)
+        return totals, rolls
+
+    def _bounds(self, node: Node) -> tuple[int, int]:
+        """Smallest and largest value of ``node``, as exact Python ints"""
+        if isinstance(node, Const):
+            low = high = node.value
+        elif isinstance(node, DiceTerm):
+            face = node.sides * (self.MAX_EXPLOSIONS +
+                                 1) if node.explode else node.sides
+            kept = node.throws
+            if node.keep:
+                kept = node.keep_n if node.keep in ("kh", "kl") else (
+                    node.throws - node.keep_n)
+            low, high = kept, kept * face
+        else:
+            left_low, left_high = self._bounds(node.left)
+            right_low, right_high = self._bounds(node.right)
+            if isinstance(node, Compare):
+                low, high = 0, 1
+            elif node.op == "+":
+                low, high = left_low + right_low, left_high + right_high
+            elif node.op == "-":
+                low, high = left_low - right_high, left_high - right_low
+            else:
+                products = [
+                    a * b for a in (left_low, left_high)
+                    for b in (right_low, right_high)
+                ]
+                low, high = min(products), max(products)
+        self.max_magnitude = max(self.max_magnitude, abs(low), abs(high))
+        return low, high
+
+    def distribution(self) -> Distribution:
+        """Exact distribution of a single repeat of this code"""
+        if self._support_width(self.root) > self.MAX_DISTRIBUTION_SUPPORT:
+            raise UnsupportedDistributionError(self.dice_code)
+        return self._distribution(self.root)
+
+    def _support_width(self, node: Node) -> int:
+        """Upper bound on the length of the pmf of ``node``"""
+        if isinstance(node, Const):
+            return 0
+        if isinstance(node, DiceTerm):
+            return node.throws * (node.sides - 1)
+        if isinstance(node, BinOp) and node.op == "*":
+            for factor, other in ((node.right, node.left),
+                                  (node.left, node.right)):
+                if isinstance(factor, Const):
+                    return self._support_width(other) * factor.value
+            return 0
+        return self._support_width(node.left) + self._support_width(node.right)
+
+    def _distribution(self, node: Node) -> Distribution:
+        if isinstance(node, Const):
+            return Distribution(node.value, np.ones(1))
+        if isinstance(node, DiceTerm):
+            if node.explode:
+                raise UnsupportedDistributionError(self.dice_code)
+            if not node.keep:
+                return dice_distribution(node.throws, node.sides)
+            kept = (node.keep_n if node.keep in ("kh", "kl") else
+                    node.throws - node.keep_n)
+            work = node.throws**2 * node.sides * (kept * node.sides + 1)
+            if work > self.MAX_KEEP_DISTRIBUTION_WORK:
+                raise UnsupportedDistributionError(self.dice_code)
+            return keep_distribution(node.throws, node.sides, kept,
+                                     node.keep in ("kh", "dl"))
+        if isinstance(node, BinOp) and node.op == "*":
+            if isinstance(node.right, Const):
+                return self._distribution(node.left).scale(node.right.value)
+            if isinstance(node.left, Const):
+                return self._distribution(node.right).scale(node.left.value)
+            raise UnsupportedDistributionError(self.dice_code)
+        left = self._distribution(node.left)
+        right = self._distribution(node.right)
+        if isinstance(node, BinOp):
+            return left + right if node.op == "+" else left - right
+        diff = left - right
+        success = diff.pmf[DiceParser.COMPARE_OPS[node.op](diff.support,
+                                                           0)].sum()
+        return Distribution(0, np.array([1 - success, success]))
+
+    def render(self, rolls: list[DiceRolls], row: int) -> str:
+        return self._render(self.root, rolls, row)
+
+    def render_lengths(self, rolls: list[DiceRolls]) -> ndarray:
+        """Length of ``render`` for every repeat, without rendering"""
+        return self._lengths(self.root, rolls)
+
+    def render_head(self, rolls: list[DiceRolls], row: int, n: int) -> str:
+        """The first ``n`` characters of ``render``, rendering only those"""
+        return _take(self._pieces(self.root, rolls, row, False), n)
+
+    def render_tail(self, rolls: list[DiceRolls], row: int, n: int) -> str:
+        """The last ``n`` characters of ``render``, rendering only those"""
+        return _take(self._pieces(self.root, rolls, row, True), n)[::-1]
+
+    def _compile(self, node: Node) -> Evaluator:
+        if isinstance(node, Const):
+            value = node.value
+            return lambda rng, n, rolls: np.full(n, value, dtype=np.int64)
+        if isinstance(node, DiceTerm):
+            return lambda rng, n, rolls: self._roll(node, rng, n, rolls)
+        left, right = self._compile(node.left), self._compile(node.right)
+        if isinstance(node, Compare):
+            op = DiceParser.COMPARE_OPS[node.op]
+        else:
+            op = {"+": operator.add, "-": operator.sub, "*": operator.mul}[node.op]
+        return lambda rng, n, rolls: op(left(rng, n, rolls), right(rng, n, rolls)
+                                       ).astype(np.int64)
+
+    def _roll(
+        self,
+        term: DiceTerm,
+        rng: Generator,
+        n: int,
+        rolls: list,
+    ) -> ndarray:
+        if n * term.throws > self.STREAM_BLOCK:
+            return self._stream(term, rng, n, rolls)
+        values = rng.integers(1,
+                              term.sides,
+                              size=(n, term.throws),
+                              endpoint=True,
+                              dtype=np.int64)
+        result = DiceRolls(values)
+        if term.explode:
+            result.exploded = self._explode(term, rng, values)
+        rolls[term.index] = result
+        if not term.keep:
+            return values.sum(axis=1)
+        ranks = values.argsort(axis=1, kind="stable").argsort(axis=1)
+        t, k = term.throws, term.keep_n
+        result.kept = {
+            "kh": ranks >= t - k,
+            "kl": ranks < k,
+            "dh": ranks < t - k,
+            "dl": ranks >= k,
+        }[term.keep]
+        return (values * result.kept).sum(axis=1)
+
+    def _explode(
+        self,
+        term: DiceTerm,
+        rng: Generator,
+        values: ndarray,
+    ) -> ndarray:
+        """Reroll and add every die showing its top face in place, returning
+        which dice exploded"""
+        exploded = values == term.sides
+        live = exploded.copy()
+        for _ in range(self.MAX_EXPLOSIONS):
+            count = int(live.sum())
+            if not count:
+                break
+            extra = rng.integers(1, term.sides, size=count, endpoint=True)
+            values[live] += extra
+            live[live] = extra == term.sides
+        return exploded
+
+    def _stream(
+        self,
+        term: DiceTerm,
+        rng: Generator,
+        n: int,
+        rolls: list,
+    ) -> ndarray:
+        """Roll ``term`` a block of columns at a time
+
+        Only running totals, per-face counts for keep-N and the first
+        ``PREVIEW_DICE`` dice of every repeat survive a block, so memory is
+        bounded by ``STREAM_BLOCK`` however many dice are thrown.
+        """
+        columns = max(1, self.STREAM_BLOCK // n)
+        totals = np.zeros(n, dtype=np.int64)
+        counts = np.zeros((n, term.sides), dtype=np.int64)
+        offsets = np.arange(n)[:, None]
+        for start in range(0, term.throws, columns):
+            size = min(columns, term.throws - start)
+            block = rng.integers(1,
+                                 term.sides,
+                                 size=(n, size),
+                                 endpoint=True,
+                                 dtype=np.int64)
+            exploded = (self._explode(term, rng, block)
+                        if term.explode else None)
+            if not start:
+                shown = min(size, self.PREVIEW_DICE)
+                rolls[term.index] = DiceRolls(
+                    block[:, :shown].copy(),
+                    exploded=(None if exploded is None else
+                              exploded[:, :shown].copy()),
+                    elided=term.throws - shown)
+            if not term.keep:
+                totals += block.sum(axis=1)
+                continue
+            # exploded dice can go past the last face; widen the counts
+            width = max(counts.shape[1], int(block.max()))
+            if width > counts.shape[1]:
+                counts = np.pad(counts, ((0, 0), (0, width - counts.shape[1])))
+            counts += np.bincount((block - 1 + offsets * width).ravel(),
+                                  minlength=n * width).reshape(n, width)
+        if not term.keep:
+            return totals
+        t, k = term.throws, term.keep_n
+        kept, highest = {
+            "kh": (k, True),
+            "kl": (k, False),
+            "dh": (t - k, False),
+            "dl": (t - k, True),
+        }[term.keep]
+        faces = np.arange(1, counts.shape[1] + 1)
+        if highest:
+            counts, faces = counts[:, ::-1], faces[::-1]
+        before = np.cumsum(counts, axis=1) - counts
+        return np.clip(kept - before, 0, counts) @ faces
+
+    def _pieces(
+        self,
+        node: Node,
+        rolls: list[DiceRolls],
+        row: int,
+        reverse: bool,
+    ) -> Iterator[str]:
+        """Rendered pieces of ``node``, last first if ``reverse``, with the
+        characters of every piece reversed too"""
+        if isinstance(node, Const):
+            text = str(node.value)
+            yield text[::-1] if reverse else text
+            return
+        if isinstance(node, DiceTerm):
+            yield from self._dice_pieces(node, rolls[node.index], row, reverse)
+            return
+        left, right = node.left, node.right
+        parens_left = parens_right = False
+        if isinstance(node, BinOp) and node.op == "*":
+            parens_left = self._is_compound(left)
+            parens_right = self._is_compound(right)
+        elif isinstance(node, BinOp) and node.op == "-":
+            parens_right = self._is_compound(right)
+        operands = ((left, parens_left), (right, parens_right))
+        op = node.op[::-1] if reverse else node.op
+        for i, (operand, parens) in enumerate(
+                reversed(operands) if reverse else operands):
+            if i:
+                yield op
+            if parens:
+                yield ")" if reverse else "("
+            yield from self._pieces(operand, rolls, row, reverse)
+            if parens:
+                yield "(" if reverse else ")"
+
+    def _dice_pieces(
+        self,
+        term: DiceTerm,
+        result: DiceRolls,
+        row: int,
+        reverse: bool,
+    ) -> Iterator[str]:
+        values = result.values[row]
+        exploded = (result.exploded[row]
+                    if result.exploded is not None else None)
+        suffix = f"{term.keep}{term.keep_n}" if term.keep else ""
+        separator = "," if term.keep else "+"
+        if term.keep:
+            yield suffix[::-1] + "]" if reverse else "["
+        first = True
+        if reverse and result.elided:
+            yield _ELIDED[::-1]
+            first = False
+        # convert dice to Python ints a block at a time, so a truncated line
+        # only touches the dice it shows
+        for start in range(0, len(values), self.RENDER_BLOCK):
+            block = slice(start, start + self.RENDER_BLOCK)
+            if reverse:
+                block = slice(len(values) - start - self.RENDER_BLOCK
+                              if start + self.RENDER_BLOCK < len(values) else
+                              None, len(values) - start)
+            nums = values[block].tolist()
+            marks = (exploded[block].tolist() if exploded is not None else
+                     [False] * len(nums))
+            pairs = zip(nums, marks)
+            for value, mark in (reversed(list(pairs)) if reverse else pairs):
+                if not first:
+                    yield separator
+                first = False
+                text = f"{value}!" if mark else str(value)
+                yield text[::-1] if reverse else text
+        if not reverse and result.elided:
+            yield separator
+            yield _ELIDED
+        if term.keep:
+            yield "[" if reverse else "]" + suffix
+
+    def _lengths(self, node: Node, rolls: list[DiceRolls]) -> ndarray:
+        if isinstance(node, Const):
+            return np.full(len(rolls[0].values), len(str(node.value)))
+        if isinstance(node, DiceTerm):
+            result = rolls[node.index]
+            lengths = (_digits(result.values).sum(axis=1) +
+                       result.values.shape[1] - 1)
+            if result.elided:
+                lengths += 1 + len(_ELIDED)
+            if result.exploded is not None:
+                lengths += result.exploded.sum(axis=1)
+            if node.keep:
+                lengths += 2 + len(f"{node.keep}{node.keep_n}")
+            return lengths
+        lengths = (self._lengths(node.left, rolls) +
+                   self._lengths(node.right, rolls) + len(node.op))
+        if isinstance(node, BinOp) and node.op == "*":
+            lengths += 2 * (self._is_compound(node.left) +
+                            self._is_compound(node.right))
+        elif isinstance(node, BinOp) and node.op == "-":
+            lengths += 2 * self._is_compound(node.right)
+        return lengths
+
+    def _render(self, node: Node, rolls: list[DiceRolls], row: int) -> str:
+        if isinstance(node, Const):
+            return str(node.value)
+        if isinstance(node, DiceTerm):
+            result = rolls[node.index]
+            values = result.values[row].tolist()
+            marks = (result.exploded[row].tolist()
+                     if result.exploded is not None else [False] * len(values))
+            nums = [f"{v}!" if m else str(v) for v, m in zip(values, marks)]
+            if result.elided:
+                nums.append(_ELIDED)
+            if node.keep:
+                return f"[{','.join(nums)}]{node.keep}{node.keep_n}"
+            return "+".join(nums)
+        left = self._render(node.left, rolls, row)
+        right = self._render(node.right, rolls, row)
+        if isinstance(node, BinOp) and node.op == "*":
+            left = f"({left})" if self._is_compound(node.left) else left
+            right = f"({right})" if self._is_compound(node.right) else right
+        elif isinstance(node, BinOp) and node.op == "-":
+            right = f"({right})" if self._is_compound(node.right) else right
+        return f"{left}{node.op}{right}"
+
+    def _is_compound(self, node: Node) -> bool:
+        if isinstance(node, DiceTerm):
+            return node.throws > 1 and not node.keep
+        return isinstance(node, (BinOp, Compare)) and node.op != "*"
+
+
+@dataclass(frozen=True)
+class Distribution:
+    """Exact probability mass function; ``pmf[i]`` is P(total = offset + i)"""
+    offset: int
+    pmf: ndarray
+
+    PERCENTILES = (1, 5, 10, 25, 50, 75, 90, 95, 99)
+
+    @property
+    def support(self) -> ndarray:
+        return np.arange(self.offset, self.offset + len(self.pmf))
+
+    @property
+    def min(self) -> int:
+        return self.offset
+
+    @property
+    def max(self) -> int:
+        return self.offset + len(self.pmf) - 1
+
+    @property
+    def mean(self) -> float:
+        return float(self.support @ self.pmf)
+
+    @property
+    def variance(self) -> float:
+        return float((self.support - self.mean)**2 @ self.pmf)
+
+    def percentile(self, q: float) -> int:
+        """Smallest total whose cumulative probability reaches ``q``%"""
+        cdf = np.cumsum(self.pmf)
+        return self.offset + int(np.searchsorted(cdf, q / 100 - 1e-12))
+
+    def percentiles(self, qs: tuple[float, ...] = PERCENTILES) -> dict:
+        return {q: self.percentile(q) for q in qs}
+
+    def __add__(self, other: Distribution) -> Distribution:
+        return Distribution(self.offset + other.offset,
+                            convolve(self.pmf, other.pmf))
+
+    def __neg__(self) -> Distribution:
+        return Distribution(-(self.offset + len(self.pmf) - 1), self.pmf[::-1])
+
+    def __sub__(self, other: Distribution) -> Distribution:
+        return self + -other
+
+    def scale(self, factor: int) -> Distribution:
+        if factor == 0:
+            return Distribution(0, np.ones(1))
+        pmf = np.zeros((len(self.pmf) - 1) * abs(factor) + 1)
+        pmf[::abs(factor)] = self.pmf
+        scaled = Distribution(self.offset * abs(factor), pmf)
+        return scaled if factor > 0 else -scaled
+
+
+def convolve(a: ndarray, b: ndarray) -> ndarray:
+    """Linear convolution, switching to FFT once direct convolution gets big"""
+    if min(len(a), len(b)) < 64:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    result = np.fft.irfft(np.fft.rfft(a, n) * np.fft.rfft(b, n), n)
+    return _clean_pmf(result)
+
+
+def _clean_pmf(pmf: ndarray) -> ndarray:
+    """Drop the round-off noise an FFT leaves around the true values"""
+    pmf[pmf < pmf.max() * 1e-15] = 0
+    return pmf / pmf.sum()
+
+
+@lru_cache(maxsize=256)
+def dice_distribution(throws: int, sides: int) -> Distribution:
+    """Distribution of the sum of ``throws`` dice with ``sides`` sides
+
+    The n-fold convolution of the uniform die is a single FFT power.
+    """
+    die = np.full(sides, 1 / sides)
+    if throws == 1 or sides == 1:
+        pmf = die if throws == 1 else np.ones(1)
+    else:
+        n = throws * (sides - 1) + 1
+        pmf = _clean_pmf(np.fft.irfft(np.fft.rfft(die, n)**throws, n))
+    pmf.flags.writeable = False
+    return Distribution(throws, pmf)
+
+
+@lru_cache(maxsize=256)
+def keep_distribution(
+    throws: int,
+    sides: int,
+    kept: int,
+    highest: bool,
+) -> Distribution:
+    """Distribution of the sum of the ``kept`` highest (or lowest) of
+    ``throws`` dice with ``sides`` sides
+
+    Faces are visited from the best down, dealing out the remaining dice;
+    only the first ``kept`` dealt add to the sum.
+    """
+    top = kept * sides
+    # dp[j, s]: chance the faces so far got j dice with a kept sum of s
+    dp = np.zeros((throws + 1, top + 1))
+    dp[0, 0] = 1
+    for face in (range(sides, 0, -1) if highest else range(1, sides + 1)):
+        dealt = np.zeros_like(dp)
+        for j in np.flatnonzero(dp.any(axis=1)):
+            for c in range(throws - j + 1):
+                shift = face * max(0, min(c, kept - j))
+                dealt[j + c, shift:] += (comb(throws - j, c) / sides**c *
+                                         dp[j, :top + 1 - shift])
+        dp = dealt
+    pmf = dp[throws, kept:]
+    pmf = pmf / pmf.sum()
+    pmf.flags.writeable = False
+    return Distribution(kept, pmf)
+
+
+def plan_distribution(dice_code: str) -> Distribution:
+    return compile_dice_code(dice_code).distribution()
+
+
+@lru_cache(maxsize=512)
+def _compile_normalized(dice_code: str) -> DicePlan:
+    return DicePlan(dice_code)
+
+
+def compile_dice_code(dice_code: str) -> DicePlan:
+    """Parse and compile ``dice_code``, memoized on its normalized form"""
+    normalized = re.sub(r"\s+", "", dice_code).lower()
+    try:
+        return _compile_normalized(normalized)
+    except DiceCodeSyntaxError:
+        raise DiceCodeSyntaxError(dice_code) from None
+
+
+# stands in for {break} while formatting, so the formatter is filled once and
+# braces in formatter_data are never parsed again
+_BREAK = "\ue000"
+_TAG_PAT = re.compile(r"</?\w+?>")
+
+
+class RollResult:
+    """Immutable outcome of one ``Dice.roll``, formatting itself on demand"""
+    __slots__ = (
+        "dice_code",
+        "plan",
+        "repeats",
+        "totals",
+        "dice_rolls",
+        "throws",
+        "sides",
+        "multiplier",
+        "bonus",
+        "rolls",
+        "max_line_length",
+        "filler",
+    )
+    default_formatter = "{dice_code}=\n{result}"
+    FULL_RENDER_DICE = 128
+
+    def __init__(
+        self,
         dice_code: str,
-    ) -> bool:
-        return cls.dice_code_regex.fullmatch(dice_code) is not None
+        plan: DicePlan,
+        totals: ndarray,
+        dice_rolls: list[DiceRolls],
+        multiplier: Optional[int],
+        bonus: Optional[int],
+        max_line_length: int,
+        filler: str,
+    ) -> None:
+        repeats = 1 if plan.repeats is None else plan.repeats
+        rolls = dice_rolls[0].values
+        first = plan.dice[0]
+        for name, value in (
+            ("dice_code", dice_code),
+            ("plan", plan),
+            ("repeats", repeats),
+            ("totals", totals),
+            ("dice_rolls", dice_rolls),
+            ("throws", first.throws),
+            ("sides", first.sides),
+            ("multiplier", multiplier),
+            ("bonus", bonus),
+            ("rolls", rolls.flatten() if repeats == 1 else rolls),
+            ("max_line_length", max_line_length),
+            ("filler", filler),
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}({self.dice_code!r}, "
+                f"totals={self.totals.tolist()})")
+
+    @property
+    def dice_count(self) -> int:
+        """Dice thrown over all repeats, not counting explosions"""
+        return self.repeats * sum(term.throws for term in self.plan.dice)
+
+    @property
+    def streamed(self) -> bool:
+        """Whether only the first dice of some term were kept"""
+        return any(rolls.elided for rolls in self.dice_rolls)
+
+    def get_summary(self) -> str:
+        """Aggregates over all repeats, for rolls too big to show in full"""
+        summary = f"共 {self.dice_count} 个骰子"
+        if self.repeats == 1:
+            return summary
+        totals = self.totals
+        if self.plan.is_comparison:
+            return f"{summary}, 成功 {int(totals.sum())}/{self.repeats} 次"
+        return (f"{summary}, 合计 {int(totals.sum())}, "
+                f"平均 {totals.mean():.2f}, "
+                f"最高 {int(totals.max())}, 最低 {int(totals.min())}")
 
     def get_message(
         self,
         formatter: str = default_formatter,
         formatter_data: dict[str, str] = {},
+        escape_html: bool = False,
     ) -> str:
-        if not self.rolled: raise DiceNotRolledError()
+        """Fill ``formatter`` with the roll; every line is prefixed with a
+        newline, and ``{break}`` becomes one on multi-repeat or long lines"""
         result = self._get_rolls_string()
-        break_formatter = "{break}"
+        dice_code = self.dice_code
+        if escape_html:
+            result, dice_code = html.escape(result), html.escape(dice_code)
         formatted = formatter.format(
             **{
                 "result": result,
@@ -148,98 +943,174 @@ class Dice:
                 "sides": self.sides,
                 "multiplier": self.multiplier,
                 "bonus": self.bonus,
-                "dice_code": self.dice_code,
-                "break": break_formatter,
+                "dice_code": dice_code,
+                "break": _BREAK,
             }, **formatter_data)
-        # break_ = "\n" if len(
-        #     formatted) >= self.max_line_length - len("{break}") else ""
-        res = ""
+        buffer = []
         for line in formatted.splitlines():
-            if break_formatter in line:
-                untagged_line = re.subn(r"</?\w+?>", "", line)
-                break_ = "\n" if self.repeats > 1 or len(
-                    untagged_line
-                ) >= self.max_line_length - len(break_formatter) else ""
-                res = f"{res}\n{line.format(**{'break': break_})}"
-            else:
-                res = f"{res}\n{line}"
-        formatted = res
-        # print(f"{break_=}, {len(formatted)=}")
-        return formatted
+            if _BREAK in line:
+                visible = len(_TAG_PAT.sub("", line)) - len(_BREAK)
+                break_ = "\n" if self.repeats > 1 or visible >= (
+                    self.max_line_length - len("{break}")) else ""
+                line = line.replace(_BREAK, break_)
+            buffer.append(line)
+        return "\n" + "\n".join(buffer) if buffer else ""
 
     def _get_rolls_string(self) -> str:
-        if self.repeats == 1:
-            return self._get_roll_expression(
-                nums=self.rolls,
-                multiplier=self.multiplier,
-                bonus=self.bonus,
-            )
-        else:
-            return "\n".join([
-                self._get_roll_expression(
-                    nums=roll,
-                    multiplier=self.multiplier,
-                    bonus=self.bonus,
-                ) for roll in self.rolls
-            ])
+        # rendering a few hundred dice in full is cheaper than measuring them
+        throws = sum(term.throws for term in self.plan.dice)
+        if throws <= self.FULL_RENDER_DICE:
+            return "\n".join(
+                self._get_roll_expression(row) for row in range(self.repeats))
+        lengths = self.plan.render_lengths(self.dice_rolls)
+        return "\n".join(
+            self._get_roll_expression(row, int(lengths[row]))
+            for row in range(self.repeats))
 
     def _get_roll_expression(
         self,
-        nums: ndarray,
-        multiplier: Union[int, None],
-        bonus: Union[int, None],
+        row: int,
+        length: Optional[int] = None,
     ) -> str:
-        result_exp = "+".join(map(str, nums))
-        mult_part = bonus_part = sum_part = ""
-        if multiplier is not None:
-            mult_part = f"*{multiplier}"
-            result_exp = f"({result_exp})"
-        else:
-            multiplier = 1
-        if bonus is not None:
-            bonus_part = f"+{bonus}"
-        else:
-            bonus = 1
-        if len(nums) > 1 or mult_part or bonus_part:
-            result = nums.sum() * multiplier + bonus
-            sum_part = f"={result}"
-        result_exp = f"{result_exp}{mult_part}{bonus_part}"
-        if len(f"{result_exp}{sum_part}") > self.max_line_length:
-            length = self.max_line_length - len(sum_part)
-            result_exp = (
-                f"{result_exp[:length // 2 - len(self.filler)]}"
-                f"{self.filler}{result_exp[-(length // 2 + (length & 1)):]}")
-        return f"{result_exp}{sum_part}"
-
-    def _validate_and_set_dice_options(
-            self,
-            # dice_options: dict,
-            *,
-            throws=1,
-            sides,
-            repeats,
-            multiplier,
-            bonus) -> None:
-        if not throws: throws = 1
-        # sides = dice_options["sides"]
-
-        # repeats = dice_options["repeats"]
-        # multiplier = dice_options["multiplier"]
-        # bonus = dice_options["bonus"]
+        """Expression and total of one repeat, truncated in the middle
+
+        Given the rendered ``length``, a truncated line renders only the
+        dice it shows.
+        """
+        total = int(self.totals[row])
+        result_exp = None
+        if length is None:
+            result_exp = self.plan.render(self.dice_rolls, row)
+            length = len(result_exp)
+        sum_part = ""
+        if self.plan.is_comparison:
+            sum_part = "=成功" if total else "=失败"
+        elif length != len(str(total)) or (self.plan.render(
+                self.dice_rolls, row) != str(total)):
+            sum_part = f"={total}"
+        if length + len(sum_part) <= self.max_line_length:
+            if result_exp is None:
+                result_exp = self.plan.render(self.dice_rolls, row)
+            return f"{result_exp}{sum_part}"
+        available = self.max_line_length - len(sum_part)
+        head = available // 2 - len(self.filler)
+        tail = available // 2 + (available & 1)
+        if result_exp is not None or head < 0 or tail <= 0:
+            if result_exp is None:
+                result_exp = self.plan.render(self.dice_rolls, row)
+            return (f"{result_exp[:head]}{self.filler}{result_exp[-tail:]}"
+                    f"{sum_part}")
+        return (f"{self.plan.render_head(self.dice_rolls, row, head)}"
+                f"{self.filler}"
+                f"{self.plan.render_tail(self.dice_rolls, row, tail)}"
+                f"{sum_part}")
+
+
+class Dice:
+    """Dice roller that is safe to share between threads
+
+    ``roll`` keeps no state on the instance; every thread draws from its own
+    ``Generator`` spawned from the instance's ``SeedSequence``.
+    """
+    def __init__(
+        self,
+        max_line_length: int = 47,
+        max_repeats: int = 10,
+        max_throws: int = 100,
+        max_sides: int = 1000,
+        filler: str = "...",
+        seed: Optional[int] = None,
+        max_dice: int = 10**6,
+    ) -> None:
+        self.max_line_length = max_line_length
+        self.max_repeats = max_repeats
+        self.max_throws = max_throws
+        self.max_sides = max_sides
+        self.max_dice = max_dice
+        self.filler = filler
+        self.seed_sequence = SeedSequence(seed)
+        self._local = threading.local()
+        self._spawn_lock = threading.Lock()
+
+    @property
+    def rng(self) -> Generator:
+        """Generator of the calling thread"""
+        rng = getattr(self._local, "rng", None)
+        if rng is None:
+            with self._spawn_lock:
+                seed_sequence, = self.seed_sequence.spawn(1)
+            rng = self._local.rng = default_rng(seed_sequence)
+        return rng
+
+    def roll(self, dice_code: str) -> RollResult:
+        plan = compile_dice_code(dice_code)
+        self._validate_plan(plan)
+        repeats = 1 if plan.repeats is None else plan.repeats
+        totals, dice_rolls = plan.evaluate(self.rng, repeats)
+        multiplier, bonus = self._get_simple_options(plan.root)
+        return RollResult(dice_code, plan, totals, dice_rolls, multiplier,
+                          bonus, self.max_line_length, self.filler)
+
+    def distribution(
+        self,
+        dice_code: str,
+        executor: Optional[Executor] = None,
+    ) -> Distribution:
+        """Exact distribution of one repeat of ``dice_code``, without rolling
+
+        With ``executor`` the convolutions run there, e.g. in another
+        process.
+        """
+        plan = compile_dice_code(dice_code)
+        self._validate_plan(plan)
+        if executor is None:
+            return plan.distribution()
+        return executor.submit(plan_distribution, dice_code).result()
+
+    @classmethod
+    def test_dice_code(
+        cls,
+        dice_code: str,
+    ) -> bool:
+        try:
+            compile_dice_code(dice_code)
+        except DiceCodeSyntaxError:
+            return False
+        except DiceError:
+            # well formed, but out of range; rolling it reports why
+            pass
+        return True
+
+    def _get_simple_options(
+        self,
+        node: Node,
+    ) -> tuple[Optional[int], Optional[int]]:
+        """multiplier and bonus of codes shaped like ``NdS*M+B``"""
+        multiplier = bonus = None
+        if (isinstance(node, BinOp) and node.op in "+-"
+                and isinstance(node.right, Const)):
+            bonus = node.right.value * (-1 if node.op == "-" else 1)
+            node = node.left
+        if (isinstance(node, BinOp) and node.op == "*"
+                and isinstance(node.right, Const)):
+            multiplier = node.right.value
+        return multiplier, bonus
+
+    def _validate_plan(self, plan: DicePlan) -> None:
+        repeats = plan.repeats
         if repeats is not None and (repeats <= 0
                                     or repeats > self.max_repeats):
             raise RepeatsValueError(repeats, self.max_repeats)
-        if throws <= 0 or throws > self.max_throws:
-            raise ThrowsValueError(throws, self.max_throws)
-        if sides <= 0 or sides > self.max_sides:
-            raise SidesValueError(sides, self.max_sides)
-
-        self.throws = throws
-        self.sides = sides
-
-        self.repeats = 1 if repeats is None else repeats
-        self.multiplier = multiplier
-        self.bonus = bonus
+        for term in plan.dice:
+            if term.throws <= 0 or term.throws > self.max_throws:
+                raise ThrowsValueError(term.throws, self.max_throws)
+            if term.sides <= 0 or term.sides > self.max_sides:
+                raise SidesValueError(term.sides, self.max_sides)
+        count = (repeats or 1) * sum(term.throws for term in plan.dice)
+        if count > self.max_dice:
+            raise DiceCountValueError(count, self.max_dice)
+        if plan.max_magnitude > np.iinfo(np.int64).max:
+            raise ResultRangeError(plan.dice_code)
 
 
 if __name__ == "__main__":
@@ -251,4 +1122,5 @@ if __name__ == "__main__":
         print(f"{e=}")
         pprint(dir(e))
 
-    print(dice.get_message())
+    for code in ("3#30d100*5+2", "1d100", "4d6kh3+2", "2d6!", "1d100<=65"):
+        print(dice.roll(code).get_message())
@@ -1,19 +1,62 @@
-import logging
-import re
-from typing import Tuple
+import html
+import json
+import math
+import time
+from typing import Optional, Tuple
 
+from numpy.random import default_rng
 from telegram import ParseMode, Update
 from telegram.ext import CallbackContext
 
+from .bobing import (NO_PRIZE, PRIZES, BobingGame, get_bobing_result,
+                     prize_odds, simulate)
 from .dice import *
-from .dot_command import FilterReturns
+from .metrics import Counter, Histogram
+from .outbox import TokenBucket, send_message
+from .sessions import LRUSessionStore
+from .storage import get_store
+from .workers import get_process_pool, run_cpu_bound
 
 dice = Dice(
     max_line_length=47,
-    max_repeats=10,
-    max_throws=100,
+    max_repeats=50,
+    max_throws=100000,
     max_sides=1000,
+    max_dice=5 * 10**6,
 )
+# milliseconds of CPU time a chat may spend rolling per second, and in a burst
+DICE_CPU_BUDGET = (50.0, 1000)
+dice_budgets: LRUSessionStore[TokenBucket] = LRUSessionStore(
+    lambda: TokenBucket(*DICE_CPU_BUDGET), idle_timeout=3600)
+bobing_games = get_store(
+    "bobing_games",
+    encode=lambda game: json.dumps(game.to_dict()),
+    decode=lambda data: BobingGame.from_dict(json.loads(data)),
+)
+LEADERBOARD_SIZE = 10
+
+ROLL_SECONDS = Histogram("dice_roll_seconds", "Time to roll a dice code")
+RENDER_SECONDS = Histogram("dice_render_seconds",
+                           "Time to format a roll into a message")
+THROTTLED_ROLLS = Counter("dice_throttled_total",
+                          "Rolls refused for exceeding the chat's CPU budget")
+
+
+def get_dice_error_message(e: DiceError) -> str:
+    if isinstance(e, RepeatsValueError):
+        return "wdnmd不扔骰子就滚" if e.repeats == 0 else "？想累死我"
+    if isinstance(e, ThrowsValueError):
+        return "wdnmd不扔骰子就滚" if e.throws == 0 else "这么多骰子你怎么不出钱买？"
+    if isinstance(e, DiceCountValueError):
+        return "这么多骰子你怎么不出钱买？"
+    if isinstance(e, (ConstValueError, ResultRangeError)):
+        return "数字这么大, 算盘都要打烂了"
+    if isinstance(e, SidesValueError):
+        return "你倒是整个0面骰子出来啊kora" if e.sides == 0 else "这是骰子？这tm是个球！"
+    if isinstance(e, UnsupportedDistributionError):
+        return ("这个骰子的分布我算不出来 "
+                "(不支持爆炸骰、骰子相乘和太大的范围)")
+    return "骰子代码不对哦"
 
 
 def dice_handler(
@@ -21,13 +64,17 @@ def dice_handler(
     context: CallbackContext,
     argv: tuple[str, str],
 ) -> None:
-    print(f"dice argv: {argv}")
     _, args_string = argv
     args = args_string.split()
 
     usage_tip = ("Roll 命令 用法:\n"
                  "<b>.r</b> <i>(重复次数#)投掷次数[dD]骰子面数"
-                 "([xX*]骰子倍率)([+-]骰子补偿)</i>")
+                 "([xX*]骰子倍率)([+-]骰子补偿)</i>\n"
+                 "多个骰子/常数可用 <i>+ - * ()</i> 组合, 如 <i>2d6+1d4+3</i>\n"
+                 "<i>kh</i>/<i>kl</i>/<i>dh</i>/<i>dl</i>N: 保留最高/最低、"
+                 "去掉最高/最低N个, 如 <i>4d6kh3</i>\n"
+                 "<i>!</i>: 爆炸骰, 如 <i>3d6!</i>\n"
+                 "<i>&lt; &lt;= &gt; &gt;= =</i>: 检定, 如 <i>1d100&lt;=65</i>")
     send_tip = False
     dice_code = purpose = None
 
@@ -47,42 +94,88 @@ def dice_handler(
         send_tip = True
 
     if send_tip:
-        context.bot.send_message(chat_id=update.effective_chat.id,
-                                 text=usage_tip,
-                                 parse_mode=ParseMode.HTML)
+        send_message(context.bot,
+                     chat_id=update.effective_chat.id,
+                     text=usage_tip,
+                     parse_mode=ParseMode.HTML)
         return
     assert dice_code is not None
-    msg = None
+    budget = dice_budgets.get(update.effective_chat.id)
+    wait = budget.delay()
+    if wait:
+        THROTTLED_ROLLS.inc()
+        msg = f"骰子扔得太快, 烫手了, {math.ceil(wait)} 秒后再试"
+    else:
+        started = time.thread_time()
+        msg = roll_message(dice_code, update.effective_user.username, purpose)
+        budget.take(cost=(time.thread_time() - started) * 1000)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 coalesce=True,
+                 parse_mode=ParseMode.HTML)
+
+
+def roll_message(
+    dice_code: str,
+    username: str,
+    purpose: Optional[str],
+) -> str:
     try:
-        dice.roll(dice_code)
-    except RepeatsValueError as e:
-        if e.repeats == 0:
-            msg = "wdnmd不扔骰子就滚"
-        else:
-            msg = "？想累死我"
-    except ThrowsValueError as e:
-        if e.throws == 0:
-            msg = "wdnmd不扔骰子就滚"
-        else:
-            msg = "这么多骰子你怎么不出钱买？"
-    except SidesValueError as e:
-        if e.sides == 0:
-            msg = "你倒是整个0面骰子出来啊kora"
+        with ROLL_SECONDS.time():
+            result = dice.roll(dice_code)
+    except DiceError as e:
+        return get_dice_error_message(e)
+    formatter = ("<b>@{username}</b> 掷骰<i>{purpose}</i>: "
+                 "{dice_code}={break}{result}")
+    with RENDER_SECONDS.time():
+        msg = result.get_message(formatter=formatter,
+                                 formatter_data={
+                                     "username": username,
+                                     "purpose": html.escape(purpose or "")
+                                 },
+                                 escape_html=True)
+    if result.streamed:
+        msg += f"\n<i>{result.get_summary()}</i>"
+    return msg
+
+
+def dice_stat_handler(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str, str],
+) -> None:
+    _, args_string = argv
+    dice_code = args_string.strip()
+    if not Dice.test_dice_code(dice_code):
+        msg = "Rstat 命令 用法:\n<b>.rstat</b> <i>骰子代码</i>, 如 <i>30d100*5+2</i>"
+    else:
+        try:
+            dist = dice.distribution(dice_code, get_process_pool())
+        except DiceError as e:
+            msg = get_dice_error_message(e)
         else:
-            msg = "这是骰子？这tm是个球！"
+            msg = format_distribution(dice_code, dist)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
+
+
+def format_distribution(dice_code: str, dist: Distribution) -> str:
+    plan = compile_dice_code(dice_code)
+    lines = [f"<b>{html.escape(dice_code)}</b> 的分布"
+             f"{' (单次)' if plan.repeats else ''}:"]
+    if plan.is_comparison:
+        lines.append(f"成功概率: {dist.pmf[1]:.2%}")
     else:
-        username = update.effective_user.username
-        purpose = purpose if purpose else ''
-        formatter = ("<b>@{username}</b> 掷骰<i>{purpose}</i>: "
-                     "{dice_code}={break}{result}")
-        msg = dice.get_message(formatter=formatter,
-                               formatter_data={
-                                   "username": username,
-                                   "purpose": purpose
-                               })
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text=msg,
-                             parse_mode=ParseMode.HTML)
+        lines += [
+            f"范围: {dist.min} ~ {dist.max}",
+            f"期望: {dist.mean:.2f}  标准差: {dist.variance**0.5:.2f}",
+            "百分位:",
+            *(f"  {q}%: {v}" for q, v in dist.percentiles().items()),
+        ]
+    return "\n".join(lines)
 
 
 def dot_rd_handler(
@@ -94,42 +187,13 @@ def dot_rd_handler(
     dice_handler(update, context, (cmd, args_string + " 1D100"))
 
 
-def get_bobing_result(roll: str):
-    prizes = [
-        "状元插金花",
-        "红六勃",
-        "黑六勃",
-        "红五",
-        "五子",
-        "红四",
-        "对堂",
-        "三红",
-        "四进",
-        "二举",
-        "一秀",
-        "无",
-    ]
-
-    pat = (
-        r"(?P<{0}>114444)|"                  # 状元插金花
-        r"(?P<{1}>444444)|"                  # 红六勃
-        r"(?P<{2}>(?P<t1>\d)(?P=t1){{5}})|"  # 黑六勃
-        r"(?P<{3}>44444)|"                   # 红五
-        r"(?P<{4}>(?P<t2>\d)(?P=t2){{4}})|"  # 五子
-        r"(?P<{5}>4444)|"                    # 红四
-        r"(?P<{6}>123456)|"                  # 对堂
-        r"(?P<{7}>444)|"                     # 三红
-        r"(?P<{8}>(?P<t3>\d)(?P=t3){{3}})|"  # 四进
-        r"(?P<{9}>44)|"                      # 二举
-        r"(?P<{10}>4)").format(*prizes)      # 一秀 yapf: disable
-
-    roll = "".join(map(str, sorted(roll)))
-
-    match = re.search(pat, roll)
-    if re.match(r"[1-6]{6}", roll) and match:
-        res, = [k for k, v in match.groupdict().items() if v and k[0] != "t"]
-        return res
-    return
+def format_standings(game: BobingGame, top: Optional[int] = None) -> str:
+    lines = []
+    for rank, (username, prizes) in enumerate(game.standings(top), 1):
+        prizes_str = ", ".join(f"{name}×{count}"
+                               for name, count in prizes.items())
+        lines.append(f"{rank}. @{html.escape(username)}: {prizes_str or '无'}")
+    return "\n".join(lines) or "还没有人博饼"
 
 
 def bobing(
@@ -137,41 +201,121 @@ def bobing(
     context: CallbackContext,
     argv: Tuple[str],
 ) -> None:
-    dice.roll("6d6")
-    result = get_bobing_result(sorted(dice.rolls))
-    username = update.effective_user.username
+    roll = dice.roll("6d6")
+    result = get_bobing_result(sorted(roll.rolls))
+    user = update.effective_user
+    username = user.username or user.full_name
 
-    msg = f"<b>@{username}</b> 的博饼结果:"
+    msg = f"<b>@{html.escape(username)}</b> 的博饼结果:"
     if result:
-        msg += dice.get_message(f"{{result}}: {result}")
+        msg += roll.get_message(f"{{result}}: {result}")
     else:
-        msg += dice.get_message(f"{{result}}: 什么都没有")
+        msg += roll.get_message(f"{{result}}: 什么都没有")
+
+    standing = ""
+
+    def record(game: Optional[BobingGame]) -> Optional[BobingGame]:
+        nonlocal standing
+        if game is None or not game.active:
+            return None
+        prize = PRIZES.index(result) if result else NO_PRIZE
+        game.record(user.id, username, prize)
+        leader, _ = game.standings(1)[0]
+        standing = (f"\n第 {game.rounds} 轮, 当前排名第 {game.rank_of(user.id)}"
+                    f", 领先: @{html.escape(leader)}")
+        return game
 
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text=msg,
-                             parse_mode=ParseMode.HTML)
+    bobing_games.update(update.effective_chat.id, record)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg + standing,
+                 coalesce=True,
+                 parse_mode=ParseMode.HTML)
 
 
-def dot_command_filter(
+def bobing_start(
     update: Update,
     context: CallbackContext,
-    argv: Tuple[str, str],
-) -> FilterReturns:
-    command, args_string = argv
-    match = re.match(r"(rd?)(.*)", command)
-    logging.info(
-        f"filter received command: {command=}。 {args_string=}, {match=}")
-    if match:
-        command_, arg = match.groups()
-        if command_ == "r" and Dice.test_dice_code(arg):
-            return update, context, (command_, f"{arg} {args_string}")
-        elif command_ == "rd":
-            return update, context, (command_, arg)
+    argv: Tuple[str],
+) -> None:
+    bobing_games.set(update.effective_chat.id, BobingGame())
+    send_message(
+        context.bot,
+        chat_id=update.effective_chat.id,
+        text="博饼开始! 使用 <b>.博饼</b> 掷骰, <b>.博饼排行</b> 查看排名",
+        parse_mode=ParseMode.HTML)
 
-    return update, context, argv
+
+def bobing_end(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str],
+) -> None:
+    msg = "当前没有进行中的博饼"
+
+    def end(game: Optional[BobingGame]) -> Optional[BobingGame]:
+        nonlocal msg
+        if game is None or not game.active:
+            return None
+        game.active = False
+        msg = (f"<b>博饼结束</b>, 共 {game.rounds} 轮, 最终排名:\n" +
+               format_standings(game))
+        return game
+
+    bobing_games.update(update.effective_chat.id, end)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
+
+
+def bobing_leaderboard(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str],
+) -> None:
+    msg = "还没有开始过博饼, 使用 <b>.博饼开始</b> 开始"
+
+    def leaderboard(game: Optional[BobingGame]) -> None:
+        nonlocal msg
+        if game is not None:
+            status = "进行中" if game.active else "已结束"
+            msg = (f"<b>博饼排行</b> ({status}, 共 {game.rounds} 轮):\n" +
+                   format_standings(game, LEADERBOARD_SIZE))
+
+    # a read, but under the store's lock so no roll is half recorded
+    bobing_games.update(update.effective_chat.id, leaderboard)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
+
+
+def bobing_stats(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str, str],
+) -> None:
+    _, args_string = argv
+    args = args_string.split()
+    if args and not (args[0].isdecimal() and 0 < int(args[0]) <= 10**7):
+        msg = "用法: <b>.博饼统计</b> <i>(模拟次数, 不超过10000000)</i>"
+    else:
+        rounds = int(args[0]) if args else 10**6
+        rng = default_rng(dice.rng.integers(1 << 63))
+        counts = run_cpu_bound(simulate, rounds, rng)
+        odds = prize_odds()
+        names = [*PRIZES, "无"]
+        lines = [f"<b>博饼 {rounds} 次模拟</b> (模拟 / 理论):"]
+        for i in range(NO_PRIZE + 1):
+            lines.append(f"{names[i]}: {counts[i] / rounds:.4%} / {odds[i]:.4%}")
+        msg = "\n".join(lines)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
 
 
 if __name__ == "__main__":
     dice = Dice()
-    dice.roll("5#30d100*5+2")
-    print(dice.get_message())
+    print(dice.roll("5#30d100*5+2").get_message())
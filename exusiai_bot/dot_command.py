@@ -1,19 +1,111 @@
 import logging
+import re
+from dataclasses import dataclass, field
 from typing import Any, Callable, Iterable, Optional, Union
 
 from telegram import Update
 from telegram.ext import CallbackContext, Dispatcher, Filters, MessageHandler
 
+from .metrics import Counter, Histogram
+
 CommandCallback = Callable[[Update, CallbackContext, tuple[str]], None]
 FilterReturns = Optional[tuple[Update, CallbackContext, tuple[str, str, str,
                                                               str]]]
 FilterCallback = Callable[[Update, CallbackContext, tuple[str]], FilterReturns]
+# what may be glued to a command name, as in ``.r1d20``: True for anything,
+# a regular expression the rest must fully match, or a predicate
+GluedSchema = Union[bool, str, Callable[[str], bool]]
+
+COMMANDS = Counter("dot_commands_total", "Dot commands routed to a command",
+                   ("command", ))
+UNKNOWN_COMMANDS = Counter("dot_commands_unknown_total",
+                           "Dot commands that matched no command")
+COMMAND_ERRORS = Counter("dot_command_errors_total",
+                         "Dot command callbacks that raised", ("command", ))
+COMMAND_SECONDS = Histogram("dot_command_seconds",
+                            "Time spent in dot command callbacks",
+                            ("command", ))
 
 
 class DotCommandError(Exception):
     """Base class for all DotCommand errors"""
 
 
+class UnknownCommandError(DotCommandError):
+    """Raised when a filter is added to a command that is not registered"""
+
+
+@dataclass
+class _Command:
+    name: str  # the first name it was registered under, for metrics
+    callback: CommandCallback
+    glued: Optional[Callable[[str], bool]] = None
+    filters: list[FilterCallback] = field(default_factory=list)
+
+
+def _compile_glued(glued: GluedSchema) -> Optional[Callable[[str], bool]]:
+    if glued is True:
+        return lambda rest: True
+    if not glued:
+        return None
+    if isinstance(glued, str):
+        pattern = re.compile(glued)
+        return lambda rest: pattern.fullmatch(rest) is not None
+    return glued
+
+
+class CommandTrie:
+    """Prefix trie over command names
+
+    ``resolve`` walks a command token once, so its cost depends on the
+    token's length but not on how many commands are registered.
+    """
+    def __init__(self) -> None:
+        self._root: dict[str, Any] = {}
+
+    def __setitem__(self, name: str, command: Optional[_Command]) -> None:
+        node = self._root
+        for char in name:
+            node = node.setdefault(char, {})
+        node[None] = command
+
+    def __getitem__(self, name: str) -> _Command:
+        node = self._root
+        for char in name:
+            node = node[char]
+        if node.get(None) is None:
+            raise KeyError(name)
+        return node[None]
+
+    def __delitem__(self, name: str) -> None:
+        self[name]
+        self[name] = None
+
+    def resolve(self, token: str) -> Optional[tuple[_Command, str, str]]:
+        """The command ``token`` invokes, its name and the argument glued
+        to it
+
+        An exact name wins; otherwise the longest registered prefix whose
+        glued schema accepts the rest of the token.
+        """
+        prefixes = []
+        node = self._root
+        for i, char in enumerate(token):
+            node = node.get(char)
+            if node is None:
+                break
+            if node.get(None) is not None:
+                prefixes.append((node[None], i + 1))
+        else:
+            if prefixes and prefixes[-1][1] == len(token):
+                return prefixes[-1][0], token, ""
+        for command, end in reversed(prefixes):
+            rest = token[end:]
+            if command.glued is not None and command.glued(rest):
+                return command, token[:end], rest
+        return None
+
+
 class DotCommandDispatcher:
     def __init__(
         self,
@@ -21,7 +113,7 @@ class DotCommandDispatcher:
         default: Optional[CommandCallback] = None,
     ) -> None:
         self._default = default
-        self._commands = dict()
+        self._commands = CommandTrie()
 
         def _default(
             update: Update,
@@ -29,8 +121,8 @@ class DotCommandDispatcher:
             argv: tuple[str, str],
         ) -> None:
             command, args_string = argv
-            logging.info(
-                f"received Unknown dot command {command=}, {args_string=}")
+            logging.info("received unknown dot command %r, %r", command,
+                         args_string)
             # msg = (f"Unknown dot command: "
             #        f"<b>.{command}</b> <i>{args_string}</i>\n"
             #        "Usage: <b>[.。](command)</b> <i>(arguments)*</i>")
@@ -43,30 +135,13 @@ class DotCommandDispatcher:
         if not self._default:
             self._default = _default
 
-        self._filter = None
-        self._command_filters = dict()
+        self._filter: Optional[FilterCallback] = None
 
         def dot_command_handler(update: Update, context: CallbackContext):
             matches = context.matches
             assert isinstance(matches, list)
             command, args_string = matches[0].groups()
-            print(f"received dot command: {command} {args_string}")
-            filtered = None
-            if self._filter:
-                filtered = self._filter(update,
-                                        context,
-                                        argv=(command, args_string))
-            if filtered:
-                update, command, argv = filtered
-                command, args_string = argv
-            else:
-                return
-            command_handler = self._commands.get(command)
-            if command_handler:
-                command_handler(update, context, argv=(command, args_string))
-            else:
-                print(f"argv: {command=}, {args_string=}")
-                self._default(update, context, argv=(command, args_string))
+            self.dispatch(update, context, command, args_string)
 
         self._dot_command_pattern = (r"(?:^[\.。](?P<command>\S+)\s?)"
                                      r"(?:(?P<args>.*)\s*)")
@@ -74,22 +149,67 @@ class DotCommandDispatcher:
             MessageHandler(Filters.regex(self._dot_command_pattern),
                            dot_command_handler))
 
+    def dispatch(
+        self,
+        update: Update,
+        context: CallbackContext,
+        command: str,
+        args_string: str,
+    ) -> None:
+        logging.debug("received dot command %s %s", command, args_string)
+        argv = (command, args_string)
+        if self._filter:
+            filtered = self._filter(update, context, argv)
+            if not filtered:
+                return
+            update, context, argv = filtered
+            command, args_string = argv
+
+        resolved = self._commands.resolve(command)
+        if resolved is None:
+            UNKNOWN_COMMANDS.inc()
+            self._default(update, context, argv)
+            return
+        command_, name, glued = resolved
+        if glued:
+            args_string = f"{glued} {args_string}" if args_string else glued
+        argv = (name, args_string)
+        for command_filter in command_.filters:
+            filtered = command_filter(update, context, argv)
+            if not filtered:
+                return
+            update, context, argv = filtered
+        COMMANDS.inc(command_.name)
+        try:
+            with COMMAND_SECONDS.time(command_.name):
+                command_.callback(update, context, argv)
+        except Exception:
+            COMMAND_ERRORS.inc(command_.name)
+            raise
+
     def add_command(
         self,
         name: Union[str, Iterable],
         command_callback: Callable[[Update, CallbackContext, tuple[str]],
                                    None],
+        glued: GluedSchema = False,
     ) -> None:
-        if isinstance(name, str):
-            self._commands[name] = command_callback
-        elif isinstance(name, Iterable):
-            for _name in name:
-                self._commands[_name] = command_callback
+        """Register a command under one or more names
+
+        ``glued`` decides what may directly follow the name in the same
+        token, e.g. ``.r1d20``; it is compiled once here. Whatever is glued
+        is passed to the callback in front of the other arguments.
+        """
+        names = [name] if isinstance(name, str) else list(name)
+        command = _Command(names[0], command_callback, _compile_glued(glued))
+        for name_ in names:
+            self._commands[name_] = command
 
     def remove_command(self, name: str) -> None:
         del self._commands[name]
 
     def set_filter(self, callback: FilterCallback) -> None:
+        """Filter every dot command before it is routed"""
         self._filter = callback
 
     def add_command_filter(
@@ -97,5 +217,8 @@ class DotCommandDispatcher:
         command: str,
         callback: FilterCallback,
     ) -> None:
-        # TODO
-        raise NotImplementedError
+        """Filter calls of one command and its aliases, after routing"""
+        try:
+            self._commands[command].filters.append(callback)
+        except KeyError:
+            raise UnknownCommandError(command) from None
@@ -1,21 +1,132 @@
-from typing import Any, Tuple
+import html
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+from threading import Lock
+from typing import Any, Optional, Tuple
 
 from telegram import ParseMode, Update
-from telegram.ext import CallbackContext
+from telegram.ext import CallbackContext, JobQueue
 
-from arknights.gacha import ArknightsBanner
+from arknights.dataset import get_dataset, refresh_dataset
+from arknights.gacha import ArknightsBanner, PullView
+from arknights.statistics import (BannerStatistics, UnknownOperator,
+                                  expected_pulls, probability_within)
+
+from .metrics import Histogram
+from .outbox import send_message
+from .sessions import LRUSessionStore
+from .storage import get_store
+from .workers import run_cpu_bound
+
+DEFAULT_BANNER = "default"
+# probability_within steps the pity chain once per pull
+MAX_ODDS_PULLS = 10000
+
+PULL_SECONDS = Histogram("gacha_pull_seconds",
+                         "Time to draw a batch of pulls", ("pulls", ))
+ODDS_SECONDS = Histogram("gacha_odds_seconds",
+                         "Time to compute the odds of a pull target")
+REFRESH_SECONDS = Histogram("gacha_refresh_seconds",
+                            "Time to scrape and rebuild the banner dataset",
+                            buckets=(1, 5, 10, 30, 60, 120, 300))
+
+
+@dataclass
+class GachaSession:
+    banner_name: str = DEFAULT_BANNER
+    with_pity: bool = True
+
+
+sessions: LRUSessionStore[GachaSession] = LRUSessionStore(
+    GachaSession,
+    max_size=4096,
+    idle_timeout=30 * 24 * 3600,
+)
+
+
+def get_banner(name: str) -> ArknightsBanner:
+    return get_dataset().get_banner(name)
+
+
+def get_session(update: Update) -> GachaSession:
+    return sessions.get(update.effective_chat.id)
+
+
+def get_chat_banner(update: Update) -> tuple[ArknightsBanner, bool]:
+    session = get_session(update)
+    return get_banner(session.banner_name), session.with_pity
+
+
+user_states = get_store("gacha_users")
+HISTORY_SIZE = 10
 
-banner = ArknightsBanner("default")
-with_pity = True
 stars = ["", "☆", "☆", "☆", "☆", "★", "⭐"]
 
 
+def pull_for_user(
+    update: Update,
+    n: int,
+) -> tuple[PullView, dict[str, Any]]:
+    """Pull under the user's persistent six-star pity counter
+
+    The pulls are drawn outside the store's lock from the counter read
+    beforehand; if another pull of the same user got in first, they are
+    drawn again from the new counter.
+    """
+    banner, with_pity = get_chat_banner(update)
+    user_id = update.effective_user.id
+    while True:
+        state = (user_states.get(user_id)
+                 or {"pity": 0, "pulls": 0, "history": []})
+        with PULL_SECONDS.time(str(n)):
+            indices, pity = banner.pull_with_counter(n, state["pity"],
+                                                     with_pity)
+        pulls = PullView(banner.operators, indices)
+        history = state["history"] + [[pull["cn_name"], state["pulls"] + i + 1]
+                                      for i, pull in enumerate(pulls)
+                                      if pull["rarity"] == 6]
+        new_state = {
+            "pity": pity,
+            "pulls": state["pulls"] + n,
+            "history": history[-HISTORY_SIZE:],
+        }
+
+        def merge(
+                current: Optional[dict[str, Any]]) -> Optional[dict[str, Any]]:
+            pulls_before = current["pulls"] if current else 0
+            return new_state if pulls_before == state["pulls"] else None
+
+        if user_states.update(user_id, merge) is not None:
+            return pulls, new_state
+
+
+def format_pity(state: dict[str, Any]) -> str:
+    return f"已连续 {state['pity']} 次寻访未获得六星干员"
+
+
 def format_gacha_result(pulls: list[Any]) -> str:
     return "\n".join(
         f"{ stars[pull['rarity']] * pull['rarity']} {pull['class']} {pull['cn_name']}"
         for pull in pulls)
 
 
+def format_gacha_summary(pulls: list[Any]) -> str:
+    rarities = Counter(pull["rarity"] for pull in pulls)
+    lines = [
+        f"{stars[i] * i}: {rarities[i]}" for i in range(6, 2, -1)
+        if rarities[i]
+    ]
+    for i in (6, 5):
+        names = Counter(pull["cn_name"] for pull in pulls
+                        if pull["rarity"] == i)
+        if names:
+            lines.append(f"{stars[i] * i} " +
+                         ", ".join(f"{k}×{v}" for k, v in names.most_common()))
+    return "\n".join(lines)
+
+
 def pull10(
     update: Update,
     context: CallbackContext,
@@ -23,12 +134,67 @@ def pull10(
 ) -> None:
     _ = argv
     #_, args_string = argv
-    pulls = banner.pull10(with_pity)
+    pulls, state = pull_for_user(update, 10)
     username = update.effective_user.username
-    msg = f"<b>@{username}</b> 的十连寻访结果: \n{format_gacha_result(pulls)}"
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text=msg,
-                             parse_mode=ParseMode.HTML)
+    msg = (f"<b>@{username}</b> 的十连寻访结果: \n{format_gacha_result(pulls)}"
+           f"\n<i>{format_pity(state)}</i>")
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
+
+
+def _pull_many(
+    update: Update,
+    context: CallbackContext,
+    n: int,
+    title: str,
+) -> None:
+    pulls, state = pull_for_user(update, n)
+    username = update.effective_user.username
+    msg = (f"<b>@{username}</b> 的{title}结果: \n{format_gacha_summary(pulls)}"
+           f"\n<i>{format_pity(state)}</i>")
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
+
+
+def pull100(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str],
+) -> None:
+    _pull_many(update, context, 100, "百连寻访")
+
+
+def pull1000(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str],
+) -> None:
+    _pull_many(update, context, 1000, "千连寻访")
+
+
+def pull_history(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str],
+) -> None:
+    state = user_states.get(update.effective_user.id)
+    username = update.effective_user.username
+    if not state:
+        msg = f"<b>@{username}</b> 还没有寻访记录"
+    else:
+        sixes = "\n".join(f"第 {n} 抽: {name}"
+                          for name, n in reversed(state["history"]))
+        msg = (f"<b>@{username}</b> 累计寻访 {state['pulls']} 次\n"
+               f"{format_pity(state)}\n"
+               f"最近的六星干员:\n{sixes or '无'}")
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
 
 
 def set_banner(
@@ -36,16 +202,20 @@ def set_banner(
     context: CallbackContext,
     argv: list[str],
 ) -> None:
-    success = banner.set_banner(argv[1])
-    msg = {0: f"卡池已设置为<b>{argv[1]}</b>", -1: "卡池设置失败"}[success]
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text=msg,
-                             parse_mode=ParseMode.HTML)
+    name = argv[1].strip()
+    if name in get_dataset().banners_dict:
+        get_session(update).banner_name = name
+        msg = f"卡池已设置为<b>{html.escape(name)}</b>"
+    else:
+        msg = "卡池设置失败"
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
 
 
-def set_pity(val: bool, *args) -> None:
-    global with_pity
-    with_pity = val
+def set_pity(update: Update, val: bool) -> None:
+    get_session(update).with_pity = val
 
 
 def pity_on(
@@ -53,10 +223,11 @@ def pity_on(
     context: CallbackContext,
     argv: list[str],
 ) -> None:
-    set_pity(True)
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text="已开启保底",
-                             parse_mode=ParseMode.HTML)
+    set_pity(update, True)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text="已开启保底",
+                 parse_mode=ParseMode.HTML)
 
 
 def pity_off(
@@ -64,10 +235,11 @@ def pity_off(
     context: CallbackContext,
     argv: list[str],
 ) -> None:
-    set_pity(False)
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text="已关闭保底",
-                             parse_mode=ParseMode.HTML)
+    set_pity(update, False)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text="已关闭保底",
+                 parse_mode=ParseMode.HTML)
 
 
 def show_banners(
@@ -75,10 +247,12 @@ def show_banners(
     context: CallbackContext,
     argv: list[str],
 ) -> None:
-    msg = "<b>可选卡池列表: </b>\n" + "\n".join(b["name"] for b in banner.banners)
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text=msg,
-                             parse_mode=ParseMode.HTML)
+    banners = get_dataset().banners
+    msg = "<b>可选卡池列表: </b>\n" + "\n".join(b["name"] for b in banners)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
 
 
 def update_banner(
@@ -86,11 +260,61 @@ def update_banner(
     context: CallbackContext,
     argv: list[str],
 ) -> None:
-    global banner
-    banner = ArknightsBanner(name=banner.name, update=True)
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text="卡池数据已更新",
-                             parse_mode=ParseMode.HTML)
+    if refresh_lock.locked():
+        msg = "卡池数据正在更新中，请稍候"
+    else:
+        context.job_queue.run_once(refresh_banner_data,
+                                   0,
+                                   context=update.effective_chat.id)
+        msg = "已开始更新卡池数据，完成后会通知"
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
+
+
+refresh_lock = Lock()
+
+
+def refresh_banner_data(context: CallbackContext) -> None:
+    """Job callback: scrape PRTS and swap in the new dataset
+
+    Runs on the job queue's thread so handlers never wait on the network.
+    The job context is the chat id to notify, or None for scheduled runs.
+    """
+    chat_id: Optional[int] = context.job.context
+    if not refresh_lock.acquire(blocking=False):
+        msg = "卡池数据正在更新中，请稍候"
+    else:
+        try:
+            with REFRESH_SECONDS.time():
+                dataset = refresh_dataset()
+        except Exception:
+            logging.exception("banner data refresh failed")
+            msg = "卡池数据更新失败"
+        else:
+            if dataset is None:
+                msg = "卡池数据已是最新"
+            else:
+                msg = f"卡池数据已更新 (v{dataset.version})"
+        finally:
+            refresh_lock.release()
+    logging.info("banner data refresh: %s", msg)
+    if chat_id is not None:
+        send_message(context.bot,
+                     chat_id=chat_id,
+                     text=msg,
+                     parse_mode=ParseMode.HTML)
+
+
+def schedule_banner_refresh(
+    job_queue: JobQueue,
+    interval: timedelta = timedelta(hours=12),
+) -> None:
+    job_queue.run_repeating(refresh_banner_data,
+                            interval=interval,
+                            first=interval,
+                            context=None)
 
 
 def banner_info(
@@ -98,11 +322,47 @@ def banner_info(
     context: CallbackContext,
     argv: list[str],
 ) -> None:
+    banner, _ = get_chat_banner(update)
     rateups = banner.banner["rateups"]
     if not rateups:
         msg = "当前卡池没有概率UP干员。"
     else:
         msg = f"当前概率UP干员：{', '.join(rateups)}"
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text=msg,
-                             parse_mode=ParseMode.HTML)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
+
+
+def gacha_odds(
+    update: Update,
+    context: CallbackContext,
+    argv: list[str],
+) -> None:
+    args = argv[1].split()
+    usage_tip = ("用法: <b>.寻访期望</b> <i>干员名 (寻访次数, "
+                 f"不超过{MAX_ODDS_PULLS})</i>")
+    if not args or len(args) > 2 or (len(args) == 2 and not (
+            args[1].isdecimal() and int(args[1]) <= MAX_ODDS_PULLS)):
+        msg = usage_tip
+    else:
+        name = html.escape(args[0])
+        n = int(args[1]) if len(args) == 2 else 100
+        banner, _ = get_chat_banner(update)
+        stats = BannerStatistics(banner, soft_pity=True)
+        try:
+            odds = stats.pull_odds(args[0])
+        except UnknownOperator:
+            msg = f"当前卡池无法寻访到<b>{name}</b>"
+        else:
+            with ODDS_SECONDS.time():
+                # one small linear solve, cheaper than a pool round trip
+                expected = expected_pulls(odds)
+                within = (run_cpu_bound(probability_within, odds, n)[-1]
+                          if n else 0)
+            msg = (f"<b>{name}</b> 期望寻访次数: {expected:.1f}\n"
+                   f"{n} 次寻访内获得的概率: {within:.2%}")
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
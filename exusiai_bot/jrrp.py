@@ -0,0 +1,105 @@
+"""Daily 人品 (jrrp) values
+
+A user's value for a day is a keyed BLAKE2b hash of the day and the user's
+id, so it is stable for the whole day, differs between deployments with
+different keys and needs no random generator. Values are memoized per day,
+together with who asked in which chat, so a chat's ranking is answered from
+memory; everything is dropped when the day rolls over.
+"""
+import hashlib
+from collections import OrderedDict
+from datetime import date
+from threading import Lock
+from typing import Callable, Optional
+
+import arrow
+
+MAX_JRRP = 100
+
+
+def jrrp_value(key: bytes, day: date, user_id: int) -> int:
+    """Value in [0, MAX_JRRP] of ``user_id`` on ``day``"""
+    digest = hashlib.blake2b(f"{day.isoformat()}:{user_id}".encode(),
+                             digest_size=8,
+                             key=key).digest()
+    return int.from_bytes(digest, "little") % (MAX_JRRP + 1)
+
+
+class JrrpService:
+    """Memoized daily values and per-chat rankings
+
+    Both caches are LRU-bounded and emptied on the first call of a new day
+    in ``timezone``.
+    """
+    def __init__(
+        self,
+        key: bytes,
+        timezone: str = "Asia/Shanghai",
+        max_users: int = 65536,
+        max_chats: int = 4096,
+        clock: Callable[[], arrow.Arrow] = arrow.utcnow,
+    ) -> None:
+        # BLAKE2b takes keys of at most 64 bytes
+        self.key = key if len(key) <= 64 else hashlib.blake2b(key).digest()
+        self.timezone = timezone
+        self.max_users = max_users
+        self.max_chats = max_chats
+        self.clock = clock
+        self._day: Optional[date] = None
+        self._expires: Optional[arrow.Arrow] = None
+        self._values: OrderedDict[int, int] = OrderedDict()
+        self._chats: OrderedDict[int, dict[int, str]] = OrderedDict()
+        self._lock = Lock()
+
+    def today(self) -> date:
+        return self.clock().to(self.timezone).date()
+
+    def get(
+        self,
+        user_id: int,
+        username: str,
+        chat_id: Optional[int] = None,
+    ) -> int:
+        """Today's value of ``user_id``, entering them in ``chat_id``'s
+        ranking"""
+        with self._lock:
+            self._roll_over()
+            value = self._value(user_id)
+            if chat_id is not None:
+                members = self._chats.pop(chat_id, None) or {}
+                members[user_id] = username
+                self._chats[chat_id] = members
+                while len(self._chats) > self.max_chats:
+                    self._chats.popitem(last=False)
+            return value
+
+    def ranking(self, chat_id: int) -> list[tuple[str, int]]:
+        """Usernames and values of today's users in ``chat_id``, best
+        first"""
+        with self._lock:
+            self._roll_over()
+            members = self._chats.get(chat_id, {})
+            ranking = [(username, self._value(user_id))
+                       for user_id, username in members.items()]
+        ranking.sort(key=lambda entry: -entry[1])
+        return ranking
+
+    def _roll_over(self) -> None:
+        now = self.clock()
+        if self._expires is not None and now < self._expires:
+            return
+        local = now.to(self.timezone)
+        self._day = local.date()
+        self._expires = local.shift(days=1).floor("day")
+        self._values.clear()
+        self._chats.clear()
+
+    def _value(self, user_id: int) -> int:
+        value = self._values.pop(user_id, None)
+        if value is None:
+            assert self._day is not None
+            value = jrrp_value(self.key, self._day, user_id)
+        self._values[user_id] = value
+        while len(self._values) > self.max_users:
+            self._values.popitem(last=False)
+        return value
@@ -0,0 +1,83 @@
+import html
+import logging
+import os
+import secrets
+from threading import Lock
+from typing import Optional, Tuple
+
+from telegram import ParseMode, Update
+from telegram.ext import CallbackContext
+
+from .jrrp import JrrpService
+from .outbox import send_message
+from .storage import get_store
+
+
+def jrrp_key() -> bytes:
+    """``JRRP_KEY``, or a random key generated once and kept in the store
+
+    Without a key the values could be predicted from user ids.
+    """
+    key = os.getenv("JRRP_KEY")
+    if key:
+        return key.encode()
+    logging.warning("JRRP_KEY is not set, using the stored jrrp key")
+    settings = get_store("jrrp")
+    stored = settings.update("key", lambda key: key or secrets.token_hex(32))
+    # a key lost before the first flush would reshuffle today's values
+    settings.flush()
+    return bytes.fromhex(stored)
+
+
+RANKING_SIZE = 10
+
+_jrrp: Optional[JrrpService] = None
+_jrrp_lock = Lock()
+
+
+def get_jrrp() -> JrrpService:
+    """The bot's JrrpService, created on first use so that importing this
+    module never touches the key store"""
+    global _jrrp
+    with _jrrp_lock:
+        if _jrrp is None:
+            _jrrp = JrrpService(
+                key=jrrp_key(),
+                timezone=os.getenv("JRRP_TIMEZONE", "Asia/Shanghai"),
+            )
+        return _jrrp
+
+
+def jrrp_handler(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str],
+) -> None:
+    user = update.effective_user
+    username = user.username or user.full_name
+    rp = get_jrrp().get(user.id, username, update.effective_chat.id)
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=f"@{html.escape(username)} 今天的人品值是：<b>{rp}</b>。",
+                 parse_mode=ParseMode.HTML)
+
+
+def jrrp_ranking_handler(
+    update: Update,
+    context: CallbackContext,
+    argv: Tuple[str],
+) -> None:
+    ranking = get_jrrp().ranking(update.effective_chat.id)
+    if ranking:
+        lines = [f"<b>今日人品排行</b> (共 {len(ranking)} 人):"]
+        lines += [
+            f"{rank}. @{html.escape(username)}: {rp}"
+            for rank, (username, rp) in enumerate(ranking[:RANKING_SIZE], 1)
+        ]
+        msg = "\n".join(lines)
+    else:
+        msg = "今天还没有人测过人品, 使用 <b>.jrrp</b> 测一测"
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text=msg,
+                 parse_mode=ParseMode.HTML)
@@ -0,0 +1,378 @@
+"""Rate-limited outbound queue for Bot API calls
+
+Handlers enqueue messages and return immediately. A single scheduler thread
+releases them under a global token bucket and one bucket per chat, keeps at
+most one request in flight per chat so replies stay ordered, and hands the
+HTTP round-trips to a small pool of threads sharing one pooled
+``requests.Session``.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from telegram import Bot
+
+from .metrics import Counter, Histogram
+
+ChatId = Union[int, str]
+
+BOT_API_URL = "https://api.telegram.org"
+MAX_MESSAGE_LENGTH = 4096
+COALESCE_SEPARATOR = "\n\n"
+
+# Telegram allows about 30 messages per second overall, one per second in a
+# private chat and 20 per minute in a group. A bucket of capacity C refilled
+# at rate r lets through at most C + r * T messages in any window T, so the
+# rates below stay inside those limits rather than merely averaging to them.
+GLOBAL_RATE = (25.0, 5)
+PRIVATE_CHAT_RATE = (1.0, 1)
+GROUP_CHAT_RATE = (0.25, 5)
+
+API_SECONDS = Histogram("bot_api_request_seconds",
+                        "Round-trip time of Bot API requests", ("method", ))
+API_ERRORS = Counter("bot_api_errors_total",
+                     "Bot API requests that failed, including retried ones",
+                     ("method", ))
+QUEUE_SECONDS = Histogram(
+    "outbox_queue_seconds",
+    "Time calls waited for rate limits after they were ready to send")
+
+
+class BotAPIError(Exception):
+    """Raised when the Bot API answers a call with ``ok: false``"""
+    def __init__(
+        self,
+        description: str,
+        error_code: int,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        self.description = description
+        self.error_code = error_code
+        self.retry_after = retry_after
+        super().__init__(f"{error_code}: {description}")
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float,
+        capacity: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Seconds until a token is available"""
+        self._refill(self.clock() if now is None else now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self, now: Optional[float] = None, cost: float = 1) -> None:
+        """Spend ``cost`` tokens, going into debt if there are not enough"""
+        self._refill(self.clock() if now is None else now)
+        self.tokens -= cost
+
+    def is_full(self, now: Optional[float] = None) -> bool:
+        self._refill(self.clock() if now is None else now)
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class _Outgoing:
+    method: str
+    params: dict[str, Any]
+    not_before: float
+    coalesce: bool = False
+    rate_limited: bool = True
+    futures: list[Future] = field(default_factory=list)
+    attempts: int = 0
+
+
+@dataclass
+class _ChatState:
+    bucket: TokenBucket
+    queue: deque[_Outgoing] = field(default_factory=deque)
+    in_flight: bool = False
+    retry_at: float = 0.0
+
+
+class Outbox:
+    """Queue of Bot API calls, sent in order per chat within rate limits
+
+    ``send`` returns a ``Future`` of the call's ``result``, e.g. the sent
+    message with its ``message_id``. Calls with ``rate_limited=False``, such
+    as deletions, keep their place in the chat's order but take no tokens.
+    Messages queued with ``coalesce=True``
+    wait ``coalesce_window`` seconds and absorb later coalescible messages
+    to the same chat, as long as the joined text fits in one message; all
+    of their futures resolve to the single message that gets sent.
+    """
+    def __init__(
+        self,
+        token: str,
+        base_url: str = BOT_API_URL,
+        coalesce_window: float = 0.3,
+        global_rate: tuple[float, int] = GLOBAL_RATE,
+        private_chat_rate: tuple[float, int] = PRIVATE_CHAT_RATE,
+        group_chat_rate: tuple[float, int] = GROUP_CHAT_RATE,
+        connections: int = 4,
+        timeout: float = 10.0,
+        retries: int = 3,
+        proxies: Optional[dict[str, str]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.url = f"{base_url.rstrip('/')}/bot{token}/"
+        self.coalesce_window = coalesce_window
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.timeout = timeout
+        self.retries = retries
+        self.clock = clock
+        self.global_bucket = TokenBucket(*global_rate, clock=clock)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if proxies:
+            self.session.proxies.update(proxies)
+        self._executor = ThreadPoolExecutor(connections,
+                                            thread_name_prefix="outbox")
+
+        self._chats: dict[ChatId, _ChatState] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="outbox-scheduler",
+                                        daemon=True)
+        self._thread.start()
+
+    def send(
+        self,
+        method: str,
+        chat_id: ChatId,
+        coalesce: bool = False,
+        rate_limited: bool = True,
+        **params: Any,
+    ) -> Future:
+        future: Future = Future()
+        now = self.clock()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("outbox is closed")
+            state = self._chats.get(chat_id)
+            if state is None:
+                state = self._chats[chat_id] = _ChatState(
+                    TokenBucket(*self._chat_rate(chat_id), clock=self.clock))
+            if coalesce and state.queue and self._merge(
+                    state.queue[-1], method, params):
+                state.queue[-1].futures.append(future)
+                return future
+            not_before = now + self.coalesce_window if coalesce else now
+            state.queue.append(
+                _Outgoing(method, {
+                    "chat_id": chat_id,
+                    **params
+                }, not_before, coalesce, rate_limited, [future]))
+            self._cond.notify()
+        return future
+
+    def send_message(
+        self,
+        chat_id: ChatId,
+        text: str,
+        coalesce: bool = False,
+        **params: Any,
+    ) -> Future:
+        return self.send("sendMessage",
+                         chat_id,
+                         coalesce=coalesce,
+                         text=text,
+                         **params)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting calls, then send everything already queued"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._executor.shutdown()
+        self.session.close()
+
+    def _chat_rate(self, chat_id: ChatId) -> tuple[float, int]:
+        is_group = not isinstance(chat_id, int) or chat_id < 0
+        return self.group_chat_rate if is_group else self.private_chat_rate
+
+    @staticmethod
+    def _merge(
+        tail: _Outgoing,
+        method: str,
+        params: dict[str, Any],
+    ) -> bool:
+        if not tail.coalesce or method != "sendMessage":
+            return False
+        tail_params = {k: v for k, v in tail.params.items() if k != "text"}
+        other_params = {k: v for k, v in params.items() if k != "text"}
+        other_params["chat_id"] = tail.params["chat_id"]
+        if tail_params != other_params:
+            return False
+        text = f"{tail.params['text']}{COALESCE_SEPARATOR}{params['text']}"
+        if len(text) > MAX_MESSAGE_LENGTH:
+            return False
+        tail.params["text"] = text
+        return True
+
+    def _run(self) -> None:
+        with self._cond:
+            while True:
+                wait = self._dispatch_ready()
+                if self._closed and not self._chats:
+                    return
+                self._cond.wait(wait)
+
+    def _dispatch_ready(self) -> Optional[float]:
+        """Send every chat's head message that may go out now
+
+        Returns the seconds until the next one may, or None to wait for new
+        messages. Must be called with ``_cond`` held.
+        """
+        now = self.clock()
+        wait = None
+        for chat_id, state in list(self._chats.items()):
+            if state.in_flight:
+                continue
+            if not state.queue:
+                if self._closed or state.bucket.is_full(now):
+                    del self._chats[chat_id]
+                else:
+                    # keep the bucket until it has refilled
+                    wait = _min(wait, state.bucket.delay(now) + 1)
+                continue
+            outgoing = state.queue[0]
+            not_before = outgoing.not_before
+            if self._closed:
+                not_before = now
+            delay = max(not_before - now, state.retry_at - now)
+            if outgoing.rate_limited:
+                delay = max(delay, state.bucket.delay(now),
+                            self.global_bucket.delay(now))
+            if delay > 0:
+                wait = _min(wait, delay)
+                continue
+            state.queue.popleft()
+            if not outgoing.attempts:
+                QUEUE_SECONDS.observe(now - outgoing.not_before)
+            if outgoing.rate_limited:
+                state.bucket.take(now)
+                self.global_bucket.take(now)
+            state.in_flight = True
+            self._executor.submit(self._post, state, outgoing)
+        return wait
+
+    def _post(self, state: _ChatState, outgoing: _Outgoing) -> None:
+        outgoing.attempts += 1
+        result, error, retry_after = None, None, None
+        try:
+            with API_SECONDS.time(outgoing.method):
+                response = self.session.post(self.url + outgoing.method,
+                                             json=outgoing.params,
+                                             timeout=self.timeout)
+                data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            error = e
+            retry_after = min(2**outgoing.attempts, 30)
+        else:
+            if data.get("ok"):
+                result = data.get("result")
+            else:
+                retry_after = data.get("parameters", {}).get("retry_after")
+                error = BotAPIError(data.get("description", ""),
+                                    data.get("error_code", 0), retry_after)
+                if retry_after is None and data.get("error_code", 0) >= 500:
+                    retry_after = min(2**outgoing.attempts, 30)
+
+        retry = (error is not None and retry_after is not None
+                 and outgoing.attempts <= self.retries)
+        if error is not None:
+            API_ERRORS.inc(outgoing.method)
+            logging.warning("%s to %s failed (attempt %d): %s",
+                            outgoing.method, outgoing.params["chat_id"],
+                            outgoing.attempts, error)
+        with self._cond:
+            state.in_flight = False
+            if retry:
+                state.retry_at = self.clock() + retry_after
+                state.queue.appendleft(outgoing)
+            self._cond.notify()
+        if retry:
+            return
+        for future in outgoing.futures:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+def _min(a: Optional[float], b: float) -> float:
+    return b if a is None else min(a, b)
+
+
+_outbox: Optional[Outbox] = None
+
+
+def get_outbox() -> Optional[Outbox]:
+    return _outbox
+
+
+def start_outbox(token: str, **kwargs: Any) -> Outbox:
+    global _outbox
+    _outbox = Outbox(token, **kwargs)
+    return _outbox
+
+
+def stop_outbox() -> None:
+    global _outbox
+    if _outbox is not None:
+        _outbox.close()
+        _outbox = None
+
+
+def send_message(
+    bot: Bot,
+    chat_id: ChatId,
+    text: str,
+    coalesce: bool = False,
+    **params: Any,
+) -> Future:
+    """Queue a message through the running outbox, or send it with ``bot``
+
+    The future resolves to the sent message as a dict.
+    """
+    if _outbox is not None:
+        return _outbox.send_message(chat_id, text, coalesce, **params)
+    future: Future = Future()
+    try:
+        with API_SECONDS.time("sendMessage"):
+            message = bot.send_message(chat_id=chat_id, text=text, **params)
+    except Exception as e:
+        API_ERRORS.inc("sendMessage")
+        future.set_exception(e)
+    else:
+        future.set_result(message.to_dict())
+    return future
@@ -0,0 +1,159 @@
+"""Sampling profiler for the running bot
+
+A background thread wakes every ``interval`` seconds and records the stack
+of every other thread from ``sys._current_frames``. Nothing is hooked into
+the interpreter, so handlers run at full speed between samples and there
+is no cost at all while the profiler is stopped. Stacks whose innermost
+frame is a thread pool or event loop waiting for work are dropped as idle.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from types import CodeType, FrameType
+from typing import Optional
+
+# files whose frames at the top of a stack mean the thread is waiting
+IDLE_FILES = (
+    os.path.join("concurrent", "futures", "thread.py"),
+    "threading.py",
+    "queue.py",
+    "selectors.py",
+    os.path.join("asyncio", "base_events.py"),
+)
+MAX_DEPTH = 128
+
+Stack = tuple[str, ...]
+
+
+@dataclass
+class Profile:
+    stacks: Counter  # root-first stack -> samples
+    ticks: int
+    duration: float
+    interval: float
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format read by flamegraph.pl and
+        speedscope"""
+        return "".join(f"{';'.join(stack)} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+    def top_functions(self, n: int = 10) -> list[tuple[str, int, int]]:
+        """Functions with the most samples at the top of the stack, with
+        their own and their inclusive sample counts"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        return [(function, count, total[function])
+                for function, count in own.most_common(n)]
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        interval: float = 0.005,
+        max_duration: float = 600.0,
+        include_idle: bool = False,
+    ) -> None:
+        self.interval = interval
+        self.max_duration = max_duration
+        self.include_idle = include_idle
+        self._stacks: Counter = Counter()
+        self._ticks = 0
+        self._labels: dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._started = 0.0
+        self._stopped: Optional[float] = None
+        self._thread = threading.Thread(target=self._run,
+                                        name="profiler",
+                                        daemon=True)
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        self._thread.start()
+
+    def stop(self) -> Profile:
+        self._stop.set()
+        self._thread.join()
+        return Profile(Counter(self._stacks), self._ticks,
+                       (self._stopped or time.monotonic()) - self._started,
+                       self.interval)
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        deadline = self._started + self.max_duration
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            frames.pop(me, None)
+            for frame in frames.values():
+                stack = self._stack(frame)
+                if stack:
+                    self._stacks[stack] += 1
+            # frames keep every local of every thread alive
+            frames = frame = None
+            self._ticks += 1
+            if time.monotonic() >= deadline:
+                break
+        self._stopped = time.monotonic()
+
+    def _stack(self, frame: Optional[FrameType]) -> Optional[Stack]:
+        if (not self.include_idle and frame is not None
+                and frame.f_code.co_filename.endswith(IDLE_FILES)):
+            return None
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                name = getattr(code, "co_qualname", code.co_name)
+                label = self._labels[code] = (
+                    f"{name} ({os.path.basename(code.co_filename)}"
+                    f":{code.co_firstlineno})")
+            labels.append(label)
+            frame = frame.f_back
+        return tuple(reversed(labels))
+
+
+_profiler: Optional[SamplingProfiler] = None
+_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[SamplingProfiler]:
+    return _profiler
+
+
+def start_profiler(**kwargs) -> Optional[SamplingProfiler]:
+    """Start profiling, or return None if a profiler is already running
+
+    A profiler that stopped itself after ``max_duration`` does not count as
+    running and is replaced, dropping its samples.
+    """
+    global _profiler
+    with _lock:
+        if _profiler is not None and _profiler.running:
+            return None
+        _profiler = SamplingProfiler(**kwargs)
+        _profiler.start()
+        return _profiler
+
+
+def stop_profiler() -> Optional[Profile]:
+    """Stop profiling and return what was sampled, or None if not running"""
+    global _profiler
+    with _lock:
+        profiler, _profiler = _profiler, None
+    return profiler.stop() if profiler is not None else None
@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LRUSessionStore(Generic[T]):
+    """Bounded per-key session store with LRU and idle-time eviction
+
+    ``get`` creates missing sessions with ``factory``. Entries are kept in
+    last-access order, so idle entries are always at the front and are swept
+    on every access in time proportional to the number evicted.
+    """
+    def __init__(
+        self,
+        factory: Callable[[], T],
+        max_size: int = 1024,
+        idle_timeout: Optional[float] = 7 * 24 * 3600,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._sessions: OrderedDict[Hashable, tuple[float, T]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> T:
+        with self._lock:
+            now = self.clock()
+            self._evict_idle(now)
+            entry = self._sessions.pop(key, None)
+            session = entry[1] if entry else self.factory()
+            self._sessions[key] = (now, session)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+            return session
+
+    def pop(self, key: Hashable) -> Optional[T]:
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+
+    def _evict_idle(self, now: float) -> None:
+        if self.idle_timeout is None:
+            return
+        while self._sessions:
+            last_access, _ = next(iter(self._sessions.values()))
+            if now - last_access < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
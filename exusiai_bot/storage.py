@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+from threading import Condition, Lock, Thread
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+DATABASE_PATH = os.getenv(
+    "DATABASE_PATH",
+    str(Path(__file__).parent.parent / "exusiai_bot.sqlite3"),
+)
+
+
+class WriteBehindStore:
+    """In-memory key-value store with coalesced write-behind to SQLite
+
+    Reads are served from memory (loading from SQLite on a miss). Writes only
+    mark a key dirty; a background thread flushes every dirty key in one
+    transaction after ``flush_interval`` seconds or once ``batch_size`` keys
+    are dirty, so a burst of updates to one key costs a single row write.
+    Values are stored with ``encode``/``decode``, JSON by default; values
+    are encoded at flush time, so mutable objects must only be changed
+    through ``update``. At most ``max_cached`` values are kept in memory;
+    the least recently used clean ones are dropped and reloaded on demand.
+    The database is opened and the flusher started on first use, so merely
+    importing a module that creates a store, as process pool workers do,
+    costs nothing.
+    """
+    def __init__(
+        self,
+        namespace: str,
+        path: str = DATABASE_PATH,
+        flush_interval: float = 5.0,
+        batch_size: int = 256,
+        encode: Callable[[Any], str] = json.dumps,
+        decode: Callable[[str], Any] = json.loads,
+        max_cached: int = 4096,
+    ) -> None:
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_cached = max_cached
+        self._cache: OrderedDict[str, Any] = OrderedDict()
+        self._dirty: set[str] = set()
+        # keys being written by a flush, which must stay cached in case the
+        # write fails and they are marked dirty again
+        self._flushing: set[str] = set()
+        self._deleted: set[str] = set()
+        self._cond = Condition()
+        self._closed = False
+
+        self._db_lock = Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._flusher: Optional[Thread] = None
+
+    def open(self) -> None:
+        """Open the database and start the flusher if not done yet"""
+        with self._db_lock:
+            if self._db is not None:
+                return
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            with db:
+                db.execute("CREATE TABLE IF NOT EXISTS kv ("
+                           "namespace TEXT NOT NULL, "
+                           "key TEXT NOT NULL, "
+                           "value TEXT NOT NULL, "
+                           "PRIMARY KEY (namespace, key))")
+            self._db = db
+            self._flusher = Thread(target=self._run,
+                                   name=f"{self.namespace}-flusher",
+                                   daemon=True)
+            self._flusher.start()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self.open()
+        with self._cond:
+            value = self._load(str(key), default)
+            self._evict()
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.open()
+        with self._cond:
+            self._cache[str(key)] = value
+            self._cache.move_to_end(str(key))
+            self._mark_dirty(str(key))
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        key = str(key)
+        self.open()
+        with self._cond:
+            self._cache.pop(key, None)
+            self._dirty.discard(key)
+            self._deleted.add(key)
+            if len(self._deleted) >= self.batch_size:
+                self._cond.notify()
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        """Every stored key and value, reading through to SQLite"""
+        self.open()
+        assert self._db is not None
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT key, value FROM kv WHERE namespace = ?",
+                (self.namespace, ),
+            ).fetchall()
+        with self._cond:
+            for key, value in rows:
+                if key not in self._cache and key not in self._deleted:
+                    self._cache[key] = self.decode(value)
+            items = list(self._cache.items())
+            self._evict()
+        return iter(items)
+
+    def update(self, key: str, fn: Callable[[Any], T], default: Any = None) -> T:
+        """Atomically replace the value of ``key`` with ``fn(value)``
+
+        If ``fn`` returns None the key is left as it was.
+        """
+        key = str(key)
+        self.open()
+        with self._cond:
+            value = fn(self._load(key, default))
+            if value is not None:
+                self._cache[key] = value
+                self._cache.move_to_end(key)
+                self._mark_dirty(key)
+            self._evict()
+            return value
+
+    def flush(self) -> None:
+        with self._cond:
+            rows, failed = [], set()
+            for key in self._dirty:
+                try:
+                    rows.append(
+                        (self.namespace, key, self.encode(self._cache[key])))
+                except Exception:
+                    logging.exception("cannot encode %s key %s",
+                                      self.namespace, key)
+                    failed.add(key)
+            keys = [key for _, key, _ in rows]
+            deleted = list(self._deleted)
+            # keys that failed to encode stay dirty for the next flush
+            self._dirty = failed
+            self._deleted.clear()
+            self._flushing = set(keys)
+        if not rows and not deleted:
+            return
+        assert self._db is not None
+        try:
+            with self._db_lock, self._db:
+                self._db.executemany(
+                    "DELETE FROM kv WHERE namespace = ? AND key = ?",
+                    [(self.namespace, key) for key in deleted])
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO kv (namespace, key, value) "
+                    "VALUES (?, ?, ?)", rows)
+        except sqlite3.Error:
+            with self._cond:
+                self._dirty.update(keys)
+                self._deleted.update(key for key in deleted
+                                     if key not in self._cache)
+                self._flushing = set()
+            raise
+        with self._cond:
+            self._flushing = set()
+            self._evict()
+        logging.debug("flushed %d %s rows, deleted %d", len(rows),
+                      self.namespace, len(deleted))
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._flusher is None:
+            return
+        self._flusher.join()
+        self.flush()
+        assert self._db is not None
+        self._db.close()
+
+    def _load(self, key: str, default: Any) -> Any:
+        if key in self._deleted:
+            return default
+        if key not in self._cache:
+            assert self._db is not None
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value FROM kv WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+            if row is None:
+                return default
+            self._cache[key] = self.decode(row[0])
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    def _evict(self) -> None:
+        if len(self._cache) <= self.max_cached:
+            return
+        for key in list(self._cache):
+            if key not in self._dirty and key not in self._flushing:
+                del self._cache[key]
+                if len(self._cache) <= self.max_cached:
+                    return
+
+    def _mark_dirty(self, key: str) -> None:
+        self._deleted.discard(key)
+        self._dirty.add(key)
+        if len(self._dirty) >= self.batch_size:
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._dirty) + len(
+                        self._deleted) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("flushing %s failed", self.namespace)
+
+
+_stores: dict[str, WriteBehindStore] = {}
+
+
+def get_store(namespace: str, **kwargs: Any) -> WriteBehindStore:
+    if namespace not in _stores:
+        _stores[namespace] = WriteBehindStore(namespace, **kwargs)
+    return _stores[namespace]
+
+
+def close_stores() -> None:
+    for store in _stores.values():
+        store.close()
+    _stores.clear()
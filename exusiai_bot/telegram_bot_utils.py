@@ -1,28 +1,206 @@
-from functools import partial
-from threading import Timer
-from typing import TypedDict, Union
+import heapq
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+from itertools import count
+from typing import Any, Callable, Optional, Union
 
 from telegram import Bot
-from telegram.message import Message
 
+from .outbox import get_outbox, send_message
+from .storage import WriteBehindStore, get_store
 
-class TimedMessage(TypedDict):
-    timer: Timer
-    message: Message
+ChatId = Union[int, str]
+Deleter = Callable[[ChatId, list[int]], None]
+
+MAX_DELETE_BATCH = 100
+
+
+def delete_messages(bot: Bot) -> Deleter:
+    """Deleter that removes a batch of one chat's messages in one call"""
+    def delete(chat_id: ChatId, message_ids: list[int]) -> None:
+        outbox = get_outbox()
+        if outbox is not None:
+            outbox.send("deleteMessages",
+                        chat_id,
+                        rate_limited=False,
+                        message_ids=message_ids)
+            return
+        for message_id in message_ids:
+            bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+    return delete
+
+
+class DeletionScheduler:
+    """Deletes messages once they expire, all from a single thread
+
+    Entries sit in one heap keyed by due time; cancelled or rescheduled
+    entries are dropped lazily when they reach the top. Due times are
+    rounded up to ``tick`` seconds, and the entries of one chat that fall
+    in the same tick are deleted with one call. Pending deletions are
+    journaled in ``journal`` so they survive a restart.
+    """
+    def __init__(
+        self,
+        delete: Deleter,
+        tick: float = 0.5,
+        journal: Optional[WriteBehindStore] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.delete = delete
+        self.tick = tick
+        self.journal = journal
+        self.clock = clock
+        self._heap: list[list] = []
+        self._entries: dict[tuple[ChatId, int], list] = {}
+        self._counter = count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        if journal is not None:
+            for key, due in journal.items():
+                chat_id, message_id = key.rsplit(":", 1)
+                self._push(_parse_chat_id(chat_id), int(message_id), due)
+        self._thread = threading.Thread(target=self._run,
+                                        name="deletion-scheduler",
+                                        daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, chat_id: ChatId, message_id: int, delay: float) -> None:
+        """Delete a message after ``delay`` seconds, replacing any earlier
+        schedule for it"""
+        due = self.clock() + delay
+        with self._cond:
+            self._discard(chat_id, message_id)
+            self._push(chat_id, message_id, due)
+            if self.journal is not None:
+                self.journal.set(f"{chat_id}:{message_id}", due)
+            self._cond.notify()
+
+    reschedule = schedule
+
+    def cancel(self, chat_id: ChatId, message_id: int) -> bool:
+        with self._cond:
+            if not self._discard(chat_id, message_id):
+                return False
+            if self.journal is not None:
+                self.journal.delete(f"{chat_id}:{message_id}")
+            return True
+
+    def close(self) -> None:
+        """Stop the thread; pending deletions stay in the journal"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _push(self, chat_id: ChatId, message_id: int, due: float) -> None:
+        due = math.ceil(due / self.tick) * self.tick
+        entry = [due, next(self._counter), chat_id, message_id, True]
+        self._entries[chat_id, message_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _discard(self, chat_id: ChatId, message_id: int) -> bool:
+        entry = self._entries.pop((chat_id, message_id), None)
+        if entry is None:
+            return False
+        entry[-1] = False
+        return True
+
+    def _pop_due(self, now: float) -> dict[ChatId, list[int]]:
+        batches: dict[ChatId, list[int]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, _, chat_id, message_id, valid = heapq.heappop(self._heap)
+            if not valid:
+                continue
+            del self._entries[chat_id, message_id]
+            batches.setdefault(chat_id, []).append(message_id)
+            if self.journal is not None:
+                self.journal.delete(f"{chat_id}:{message_id}")
+        return batches
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    while self._heap and not self._heap[0][-1]:
+                        heapq.heappop(self._heap)
+                    now = self.clock()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(self._heap[0][0] -
+                                    now if self._heap else None)
+                if self._closed:
+                    return
+                batches = self._pop_due(self.clock())
+            for chat_id, message_ids in batches.items():
+                for i in range(0, len(message_ids), MAX_DELETE_BATCH):
+                    try:
+                        self.delete(chat_id,
+                                    message_ids[i:i + MAX_DELETE_BATCH])
+                    except Exception:
+                        logging.exception("deleting messages in %s failed",
+                                          chat_id)
+
+
+def _parse_chat_id(chat_id: str) -> ChatId:
+    try:
+        return int(chat_id)
+    except ValueError:
+        return chat_id
+
+
+_scheduler: Optional[DeletionScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_deletion_scheduler() -> Optional[DeletionScheduler]:
+    return _scheduler
+
+
+def start_deletion_scheduler(bot: Bot, **kwargs: Any) -> DeletionScheduler:
+    """Start the deletion scheduler, or return the one already running"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            kwargs.setdefault(
+                "journal", get_store("pending_deletions", flush_interval=1.0))
+            _scheduler = DeletionScheduler(delete_messages(bot), **kwargs)
+        return _scheduler
+
+
+def stop_deletion_scheduler() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        scheduler, _scheduler = _scheduler, None
+    if scheduler is not None:
+        scheduler.close()
 
 
 def send_timed_message(
     bot: Bot,
-    chat_id: Union[int, str],
+    chat_id: ChatId,
     text: str,
     timeout: int = 5000,
-) -> TimedMessage:
-    msg = bot.send_message(chat_id=chat_id, text=text)
-    assert isinstance(msg, Message)
-    del_msg = partial(bot.delete_message,
-                      chat_id=chat_id,
-                      message_id=msg.message_id)
-    timer = Timer(timeout / 1000, del_msg)
-    timer.start()
-
-    return {"timer": timer, "message": msg}
+) -> Future:
+    """Send a message that deletes itself after ``timeout`` milliseconds
+
+    The future resolves to the sent message; pass its ``message_id`` to the
+    scheduler's ``cancel`` or ``reschedule`` to keep it longer.
+    """
+    scheduler = start_deletion_scheduler(bot)
+
+    def schedule_deletion(future: Future) -> None:
+        if future.exception() is None:
+            scheduler.schedule(chat_id, future.result()["message_id"],
+                               timeout / 1000)
+
+    future = send_message(bot, chat_id, text)
+    future.add_done_callback(schedule_deletion)
+    return future
@@ -0,0 +1,114 @@
+"""Webhook server on aiohttp that processes updates concurrently
+
+Each POST is validated, decoded and acknowledged right away. Updates of
+different chats are handled concurrently on a thread pool, while updates of
+the same chat go through one queue so they are handled in arrival order.
+Metrics are not served here, since this server faces the internet; see
+``start_metrics_server``.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, Union
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from .metrics import Counter, Histogram
+
+ChatKey = Union[int, str]
+
+UPDATES = Counter("webhook_updates_total", "Webhook requests by response",
+                  ("status", ))
+UPDATE_SECONDS = Histogram("webhook_update_seconds",
+                           "Time from receiving an update to handling it")
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        url_path: str,
+        workers: int = 32,
+        secret_token: Optional[str] = None,
+    ) -> None:
+        self.dispatcher = dispatcher
+        self.url_path = url_path.strip("/")
+        self.secret_token = secret_token
+        self._executor = ThreadPoolExecutor(workers,
+                                            thread_name_prefix="webhook")
+        self._queues: dict[ChatKey, deque[tuple[Update, float]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+        self.app = web.Application()
+        self.app.router.add_post(f"/{self.url_path}", self.handle)
+        self.app.on_shutdown.append(self._on_shutdown)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        response = await self._handle(request)
+        UPDATES.inc(str(response.status))
+        return response
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if (self.secret_token is not None
+                and request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+                != self.secret_token):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return web.Response(status=400, text="invalid JSON")
+        if not isinstance(data, dict) or not isinstance(
+                data.get("update_id"), int):
+            return web.Response(status=400, text="not an update")
+        try:
+            update = Update.de_json(data, self.dispatcher.bot)
+        except Exception:
+            logging.exception("cannot decode update %s", data["update_id"])
+            return web.Response(status=400, text="not an update")
+        self.enqueue(update)
+        return web.Response()
+
+    def enqueue(self, update: Update) -> None:
+        chat = update.effective_chat
+        key = chat.id if chat is not None else f"update:{update.update_id}"
+        entry = (update, time.perf_counter())
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(entry)
+            return
+        self._queues[key] = deque([entry])
+        task = asyncio.ensure_future(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key: ChatKey) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self._queues[key]
+        try:
+            while queue:
+                update, received = queue[0]
+                try:
+                    await loop.run_in_executor(self._executor,
+                                               self.dispatcher.process_update,
+                                               update)
+                except Exception:
+                    logging.exception("processing update %s failed",
+                                      update.update_id)
+                UPDATE_SECONDS.observe(time.perf_counter() - received)
+                queue.popleft()
+        finally:
+            del self._queues[key]
+
+    async def _on_shutdown(self, app: web.Application) -> None:
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+        self._executor.shutdown()
+
+    def run(self, host: str = "0.0.0.0", port: int = 8443, **kwargs: Any):
+        """Serve until interrupted"""
+        web.run_app(self.app, host=host, port=port, **kwargs)
@@ -0,0 +1,46 @@
+"""Process pool for CPU-bound handler work
+
+Handlers run on threads, so heavy numpy work in one of them holds the GIL
+and stalls every other chat. ``run_cpu_bound`` moves such work to a shared
+process pool when one is running and runs it inline otherwise. Submitted
+functions must be module-level and free of bot state so they can be
+pickled.
+
+Workers are started from a forkserver where available (spawned elsewhere)
+rather than forked, since forking a process whose other threads hold locks
+can deadlock the child.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def start_process_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        method = ("forkserver" if "forkserver"
+                  in multiprocessing.get_all_start_methods() else "spawn")
+        _pool = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def stop_process_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    return _pool
+
+
+def run_cpu_bound(fn: Callable[..., T], *args: Any) -> T:
+    if _pool is None:
+        return fn(*args)
+    return _pool.submit(fn, *args).result()
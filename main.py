@@ -1,19 +1,27 @@
-import hashlib
 import logging
 import os
-import sys
-from typing import Tuple, cast
+from typing import cast
 
-import arrow
-from numpy.random import SeedSequence, default_rng
-from telegram import ParseMode, Update
-from telegram.ext import CallbackContext, CommandHandler, Updater
+from telegram import Update
+from telegram.ext import CallbackContext, CommandHandler, Dispatcher, Updater
 
-from exusiai_bot.dice_commands import (dice_handler, dot_command_filter,
-                                       dot_rd_handler, bobing)
+from exusiai_bot.admin_commands import admin_only, profile_handler
+from exusiai_bot.dice import Dice
+from exusiai_bot.dice_commands import (dice_handler, dice_stat_handler,
+                                       dot_rd_handler,
+                                       bobing, bobing_end, bobing_leaderboard,
+                                       bobing_start, bobing_stats)
 from exusiai_bot.dot_command import DotCommandDispatcher
-from exusiai_bot.telegram_bot_utils import send_timed_message
-from exusiai_bot.gacha_commands import banner_info, pull10, set_banner, pity_on, pity_off, show_banners, update_banner
+from exusiai_bot.jrrp_commands import jrrp_handler, jrrp_ranking_handler
+from exusiai_bot.metrics import start_metrics_server, stop_metrics_server
+from exusiai_bot.outbox import send_message, start_outbox, stop_outbox
+from exusiai_bot.storage import close_stores
+from exusiai_bot.telegram_bot_utils import (send_timed_message,
+                                            start_deletion_scheduler,
+                                            stop_deletion_scheduler)
+from exusiai_bot.webhook import WebhookServer
+from exusiai_bot.workers import start_process_pool, stop_process_pool
+from exusiai_bot.gacha_commands import banner_info, gacha_odds, pull10, pull100, pull1000, set_banner, pity_on, pity_off, pull_history, show_banners, update_banner, schedule_banner_refresh
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -22,31 +30,26 @@ logging.basicConfig(
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 PRODUCTION = os.getenv("PRODUCTION", 'False').lower() in ['true', '1']
 
-if TELEGRAM_BOT_TOKEN is None:
-    raise Exception("Cannot find token in environment variable")
 PROXY_URL = "http://127.0.0.1:7890"
 PORT = int(os.getenv("PORT", 5000))
-
-request_kwargs = {"proxy_url": PROXY_URL}
-
-updater = Updater(
-    token=TELEGRAM_BOT_TOKEN,
-    use_context=True,
-    request_kwargs={} if PRODUCTION else request_kwargs,
-)
-dispatcher = updater.dispatcher
-assert dispatcher is not None
-
+# /metrics is served apart from the public webhook, on localhost by default
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org")
+WORKERS = int(os.getenv("WORKERS", 8))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 32))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", os.cpu_count() or 1))
 
 def start(update: Update, context: CallbackContext):
-    print("command: /start")
-    context.bot.send_message(chat_id=update.effective_chat.id, text="Hi!")
+    logging.debug("command: /start")
+    send_message(context.bot, chat_id=update.effective_chat.id, text="Hi!")
 
 
 def test(update: Update, context: CallbackContext):
-    print('command: /test')
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text="I'm a bot, please talk to me!")
+    logging.debug("command: /test")
+    send_message(context.bot,
+                 chat_id=update.effective_chat.id,
+                 text="I'm a bot, please talk to me!")
     send_timed_message(bot=context.bot,
                        chat_id=update.effective_chat.id,
                        text="test",
@@ -55,54 +58,94 @@ def test(update: Update, context: CallbackContext):
 
 def error_handler(update: Update, context: CallbackContext):
     error = cast(str, context.error)
-    logging.error(f'{error=}')
+    logging.error("error=%r", error)
     raise Exception(error)
 
 
-def dot_jrrp_handler(
-    update: Update,
-    context: CallbackContext,
-    argv: Tuple[str],
-) -> None:
-    username = update.effective_user.username
-    temp = f"{username}{arrow.utcnow().to('utf-8').isocalendar()}"
-    hash_ = int(hashlib.md5(temp.encode()).hexdigest(), 16) % sys.maxsize
-    # logging.info(f"in jrrp_handler: {temp=}, {hash_=}")
-    rp = default_rng(SeedSequence(hash_)).integers(0, 100, endpoint=True)
-    chat_id = update.effective_chat.id
-    msg = f"@{username} 今天的人品值是：**{rp}**。"
-    context.bot.send_message(chat_id, text=msg, parse_mode=ParseMode.MARKDOWN)
-
-
-dispatcher.add_handler(CommandHandler('start', start))
-dispatcher.add_handler(CommandHandler('test', test))
-dispatcher.add_error_handler(error_handler)
-dot_dispatcher = DotCommandDispatcher(dispatcher=dispatcher)
-dot_dispatcher.add_command("jrrp", dot_jrrp_handler)
-dot_dispatcher.add_command("r", dice_handler)
-dot_dispatcher.add_command("rd", dot_rd_handler)
-dot_dispatcher.add_command("博饼", bobing)
-dot_dispatcher.set_filter(dot_command_filter)
-
-dot_dispatcher.add_command(["十连寻访", "十连"], pull10)
-dot_dispatcher.add_command("设置卡池", set_banner)
-dot_dispatcher.add_command("开启保底", pity_on)
-dot_dispatcher.add_command("关闭保底", pity_off)
-dot_dispatcher.add_command("卡池列表", show_banners)
-dot_dispatcher.add_command("更新卡池", update_banner)
-dot_dispatcher.add_command("卡池信息", banner_info)
-
-if PRODUCTION:
-    updater.start_webhook(
-        listen="0.0.0.0",
-        port=PORT,
-        url_path=TELEGRAM_BOT_TOKEN,
+def register_commands(dispatcher: Dispatcher) -> DotCommandDispatcher:
+    dispatcher.add_handler(CommandHandler('start', start))
+    dispatcher.add_handler(CommandHandler('test', test))
+    dispatcher.add_error_handler(error_handler)
+    dot_dispatcher = DotCommandDispatcher(dispatcher=dispatcher)
+    dot_dispatcher.add_command("jrrp", jrrp_handler)
+    dot_dispatcher.add_command(["jrrp排行", "人品排行"], jrrp_ranking_handler)
+    dot_dispatcher.add_command("r", dice_handler, glued=Dice.test_dice_code)
+    dot_dispatcher.add_command("rd", dot_rd_handler, glued=True)
+    dot_dispatcher.add_command("rstat", dice_stat_handler)
+    dot_dispatcher.add_command("博饼", bobing)
+    dot_dispatcher.add_command("博饼统计", bobing_stats)
+    dot_dispatcher.add_command("博饼开始", bobing_start)
+    dot_dispatcher.add_command("博饼结束", bobing_end)
+    dot_dispatcher.add_command("博饼排行", bobing_leaderboard)
+
+    dot_dispatcher.add_command(["十连寻访", "十连"], pull10)
+    dot_dispatcher.add_command(["百连寻访", "百连"], pull100)
+    dot_dispatcher.add_command(["千连寻访", "千连"], pull1000)
+    dot_dispatcher.add_command("设置卡池", set_banner)
+    dot_dispatcher.add_command("开启保底", pity_on)
+    dot_dispatcher.add_command("关闭保底", pity_off)
+    dot_dispatcher.add_command("卡池列表", show_banners)
+    dot_dispatcher.add_command("更新卡池", update_banner)
+    dot_dispatcher.add_command("卡池信息", banner_info)
+    dot_dispatcher.add_command("寻访期望", gacha_odds)
+    dot_dispatcher.add_command("寻访记录", pull_history)
+
+    dot_dispatcher.add_command("profile", profile_handler)
+    dot_dispatcher.add_command_filter("profile", admin_only)
+    return dot_dispatcher
+
+
+def main() -> None:
+    if TELEGRAM_BOT_TOKEN is None:
+        raise Exception("Cannot find token in environment variable")
+    request_kwargs = {"con_pool_size": WORKERS + 4}
+    if not PRODUCTION:
+        request_kwargs["proxy_url"] = PROXY_URL
+
+    start_process_pool(CPU_WORKERS)
+
+    updater = Updater(
+        token=TELEGRAM_BOT_TOKEN,
+        use_context=True,
+        workers=WORKERS,
+        request_kwargs=request_kwargs,
+    )
+    dispatcher = updater.dispatcher
+    assert dispatcher is not None
+    register_commands(dispatcher)
+    start_outbox(
+        TELEGRAM_BOT_TOKEN,
+        base_url=BOT_API_URL,
+        proxies=None if PRODUCTION else {
+            "http": PROXY_URL,
+            "https": PROXY_URL
+        },
     )
-    updater.bot.setWebhook(
-        f"https://exusiai-bot.herokuapp.com/{TELEGRAM_BOT_TOKEN}")
-else:
-    updater.start_polling()
-
-logging.info("Exusiai Bot started")
-logging.info("アップルパイ！🥧")
-updater.idle()
+    start_deletion_scheduler(updater.bot)
+    schedule_banner_refresh(updater.job_queue)
+    start_metrics_server(METRICS_PORT, METRICS_HOST)
+
+    if PRODUCTION:
+        updater.job_queue.start()
+        updater.bot.setWebhook(
+            f"https://exusiai-bot.herokuapp.com/{TELEGRAM_BOT_TOKEN}")
+        logging.info("Exusiai Bot started")
+        logging.info("アップルパイ！🥧")
+        WebhookServer(dispatcher, TELEGRAM_BOT_TOKEN,
+                      workers=WEBHOOK_WORKERS).run(port=PORT)
+        updater.job_queue.stop()
+    else:
+        updater.start_polling()
+        logging.info("Exusiai Bot started")
+        logging.info("アップルパイ！🥧")
+        updater.idle()
+
+    stop_metrics_server()
+    stop_process_pool()
+    stop_deletion_scheduler()
+    stop_outbox()
+    close_stores()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Bobing scoring against the original regex rules"""
+import re
+from functools import lru_cache
+from itertools import product
+from typing import Any
+
+import numpy as np
+import pytest
+
+from exusiai_bot.bobing import (NO_PRIZE, PRIZES, get_bobing_result,
+                                prize_odds, score_rolls)
+
+# the patterns the regex scorer matched sorted rolls against, best first
+PATTERNS = (
+    r"114444",
+    r"444444",
+    r"(\d)\1{5}",
+    r"44444",
+    r"(\d)\1{4}",
+    r"4444",
+    r"123456",
+    r"444",
+    r"(\d)\1{3}",
+    r"44",
+    r"4",
+)
+# the regex scorer took the leftmost match of all patterns at once
+LEFTMOST = re.compile("|".join(
+    f"(?P<p{i}>{pattern})".replace("(\\d)\\1", f"(?P<d{i}>\\d)(?P=d{i})")
+    for i, pattern in enumerate(PATTERNS)))
+# sorted rolls where the leftmost match is a lower prize than the best
+# pattern that matches; the table deliberately scores these by the best
+LEFTMOST_DIFFERENCES = {
+    "145555": ("一秀", "四进"),
+    "146666": ("一秀", "四进"),
+    "245555": ("一秀", "四进"),
+    "246666": ("一秀", "四进"),
+    "345555": ("一秀", "四进"),
+    "346666": ("一秀", "四进"),
+    "445555": ("二举", "四进"),
+    "446666": ("二举", "四进"),
+    "455555": ("一秀", "五子"),
+    "455556": ("一秀", "四进"),
+    "456666": ("一秀", "四进"),
+    "466666": ("一秀", "五子"),
+}
+
+
+@lru_cache(maxsize=None)
+def best_prize(roll: str) -> int:
+    """Best prize any pattern matches, wherever it matches"""
+    for prize, pattern in enumerate(PATTERNS):
+        if re.search(pattern, roll):
+            return prize
+    return NO_PRIZE
+
+
+@lru_cache(maxsize=None)
+def leftmost_prize(roll: str) -> int:
+    match = LEFTMOST.search(roll)
+    if match is None:
+        return NO_PRIZE
+    return int(match.lastgroup[1:])
+
+
+def test_every_roll_scores_its_best_pattern() -> None:
+    rolls = np.array(list(product(range(1, 7), repeat=6)))
+    differences = {}
+    for roll, score in zip(rolls.tolist(), score_rolls(rolls).tolist()):
+        key = "".join(map(str, sorted(roll)))
+        assert score == best_prize(key), key
+        if leftmost_prize(key) != score:
+            differences[key] = (PRIZES[leftmost_prize(key)], PRIZES[score])
+    assert differences == LEFTMOST_DIFFERENCES
+
+
+def test_prize_names() -> None:
+    assert get_bobing_result([4, 1, 4, 4, 1, 4]) == "状元插金花"
+    assert get_bobing_result((3, ) * 6) == "黑六勃"
+    assert get_bobing_result([6, 5, 4, 3, 2, 1]) == "对堂"
+    assert get_bobing_result("123446") == "二举"
+    assert get_bobing_result([1, 2, 2, 3, 5, 6]) is None
+
+
+def test_odds_sum_to_one() -> None:
+    odds = prize_odds()
+    assert odds.shape == (NO_PRIZE + 1, )
+    assert odds.sum() == pytest.approx(1)
+    assert odds[PRIZES.index("红六勃")] == pytest.approx(1 / 6**6)
+
+
+@pytest.mark.parametrize("roll", [
+    [],
+    [1, 2, 3, 4, 5],
+    [1, 2, 3, 4, 5, 6, 1],
+    [0, 1, 2, 3, 4, 5],
+    [1, 2, 3, 4, 5, 7],
+    [-4, 4, 4, 4, 4, 4],
+    "12345a",
+])
+def test_malformed_rolls(roll: Any) -> None:
+    with pytest.raises(ValueError):
+        get_bobing_result(roll)
@@ -0,0 +1,62 @@
+"""Swapping dataset versions while the assets are being updated"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from arknights import dataset as dataset_module
+from arknights.dataset import get_dataset, refresh_dataset, reload_dataset
+
+
+class SlowUpdate:
+    """``update_assets`` that blocks until released"""
+    def __init__(self) -> None:
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, force: bool = False) -> bool:
+        self.started.set()
+        assert self.released.wait(5)
+        return True
+
+
+@pytest.fixture
+def slow_update(monkeypatch: pytest.MonkeyPatch) -> SlowUpdate:
+    slow_update = SlowUpdate()
+    monkeypatch.setattr(dataset_module, "update_assets", slow_update)
+    monkeypatch.setattr(dataset_module, "_dataset", None)
+    return slow_update
+
+
+@pytest.mark.parametrize("update", [
+    lambda: reload_dataset(update=True),
+    refresh_dataset,
+])
+def test_readers_do_not_wait_for_the_fetch(slow_update: SlowUpdate,
+                                           update) -> None:
+    with ThreadPoolExecutor(2) as executor:
+        future = executor.submit(update)
+        assert slow_update.started.wait(5)
+        # nothing is loaded yet and the fetch is in flight, yet the first
+        # reader loads what is on disk right away
+        reader = executor.submit(get_dataset)
+        try:
+            current = reader.result(2)
+        finally:
+            slow_update.released.set()
+        assert get_dataset() is current
+        new = future.result(5)
+    assert new is not current and new.version > current.version
+    assert get_dataset() is new
+
+
+def test_reload_without_update(monkeypatch: pytest.MonkeyPatch) -> None:
+    def update_assets(force: bool = False) -> bool:
+        raise AssertionError("must not fetch")
+
+    monkeypatch.setattr(dataset_module, "update_assets", update_assets)
+    monkeypatch.setattr(dataset_module, "_dataset", None)
+    current = get_dataset()
+    new = reload_dataset()
+    assert new is not current and get_dataset() is new
+    assert len(new.operators) == len(current.operators)
@@ -0,0 +1,199 @@
+"""Dice code parsing, compiled plans and rolling"""
+from typing import Any, Optional
+
+import numpy as np
+import pytest
+from numpy.random import default_rng
+
+from exusiai_bot.dice import (BinOp, Compare, ConstValueError, Const, Dice,
+                              DiceCodeSyntaxError, DicePlan, DiceTerm,
+                              ResultRangeError, compile_dice_code)
+
+
+class TopFaceRng:
+    """Generator stand-in that rolls the top face every time"""
+    def integers(
+        self,
+        low: int,
+        high: int,
+        size: Any = None,
+        endpoint: bool = False,
+        dtype: Any = np.int64,
+    ) -> Any:
+        top = high if endpoint else high - 1
+        return top if size is None else np.full(size, top, dtype=dtype)
+
+
+@pytest.mark.parametrize("code, term", [
+    ("d20", DiceTerm(0, 1, 20)),
+    ("1d%", DiceTerm(0, 1, 100)),
+    ("4d6kh3", DiceTerm(0, 4, 6, "kh", 3)),
+    ("4d6k3", DiceTerm(0, 4, 6, "kh", 3)),
+    ("2d20kl1", DiceTerm(0, 2, 20, "kl", 1)),
+    ("4d6dl1", DiceTerm(0, 4, 6, "dl", 1)),
+    ("3d6!", DiceTerm(0, 3, 6, explode=True)),
+    ("4d6kh3!", DiceTerm(0, 4, 6, "kh", 3, True)),
+    ("4D6KH3", DiceTerm(0, 4, 6, "kh", 3)),
+])
+def test_dice_terms(code: str, term: DiceTerm) -> None:
+    plan = DicePlan(code)
+    assert plan.root == term
+    assert plan.dice == (term, )
+
+
+def test_expressions() -> None:
+    plan = DicePlan("3#2d6 + 1d4*2 - 3")
+    assert plan.repeats == 3
+    two_d6, one_d4 = plan.dice
+    assert plan.root == BinOp(
+        "-", BinOp("+", two_d6, BinOp("*", one_d4, Const(2))), Const(3))
+    assert DicePlan("2×(1d6+1)").root == DicePlan("2x(1d6+1)").root
+    assert DicePlan("1d100 == 50").root == Compare("=", DiceTerm(0, 1, 100),
+                                                   Const(50))
+    assert DicePlan("1d20>=2d6").is_comparison
+
+
+@pytest.mark.parametrize("code", [
+    "",
+    "d",
+    "3d",
+    "abc",
+    "1d6+",
+    "(1d6",
+    "1d6)",
+    "3#",
+    "3#3",
+    "1d6 <",
+    "1d6<2<3",
+    "4d6!kh3",  # keep has to come before explode
+    "4d6kh",
+    "4d6kh5",
+    "3d1!",
+    "1d6!!",
+    "1d6 + 2d",
+    "1.5d6",
+])
+def test_syntax_errors(code: str) -> None:
+    with pytest.raises(DiceCodeSyntaxError):
+        compile_dice_code(code)
+    assert not Dice.test_dice_code(code)
+
+
+def test_compiled_plans_are_memoized() -> None:
+    assert compile_dice_code("1d100") is compile_dice_code(" 1D100 ")
+
+
+def test_constants_are_bounded() -> None:
+    DicePlan("1d6+1000000000")
+    with pytest.raises(ConstValueError):
+        DicePlan("1d6+1000000001")
+    # well formed, so it is not a syntax error
+    assert Dice.test_dice_code("1d6+1000000001")
+
+
+def test_results_must_fit_int64() -> None:
+    dice = Dice()
+    dice.roll("1d6*1000000000*1000000000")
+    with pytest.raises(ResultRangeError):
+        dice.roll("1d6*1000000000*1000000000*2")
+    with pytest.raises(ResultRangeError):
+        dice.roll("1d6*1000000000*1000000000+1d6*1000000000*1000000000")
+    assert Dice.test_dice_code("1d6*1000000000*1000000000*2")
+
+
+def test_bounds_cover_exploding_dice() -> None:
+    plan = DicePlan("3d6!*1000")
+    assert plan.max_magnitude == 3 * 6 * (plan.MAX_EXPLOSIONS + 1) * 1000
+
+
+@pytest.mark.parametrize("code, keep", [
+    ("4d6kh3", lambda values: np.sort(values)[:, 1:]),
+    ("4d6kl3", lambda values: np.sort(values)[:, :3]),
+    ("4d6dh1", lambda values: np.sort(values)[:, :3]),
+    ("4d6dl1", lambda values: np.sort(values)[:, 1:]),
+])
+def test_keep(code: str, keep: Any) -> None:
+    plan = DicePlan(code)
+    totals, rolls = plan.evaluate(default_rng(1), 1000)
+    values = rolls[0].values
+    assert (totals == keep(values).sum(axis=1)).all()
+    assert (rolls[0].kept.sum(axis=1) == 3).all()
+
+
+def test_explosions_are_capped() -> None:
+    plan = DicePlan("3d6!")
+    totals, rolls = plan.evaluate(TopFaceRng(), 2)
+    cap = 6 * (plan.MAX_EXPLOSIONS + 1)
+    assert (rolls[0].values == cap).all()
+    assert rolls[0].exploded.all()
+    assert (totals == 3 * cap).all()
+
+
+def test_keep_applies_to_exploded_dice() -> None:
+    plan = DicePlan("6d6kl2!")
+    totals, rolls = plan.evaluate(default_rng(2), 1000)
+    values = rolls[0].values
+    assert (values[rolls[0].exploded] > 6).all()
+    assert (totals == np.sort(values)[:, :2].sum(axis=1)).all()
+
+
+def test_comparisons() -> None:
+    plan = DicePlan("1d20>=11")
+    totals, rolls = plan.evaluate(default_rng(3), 1000)
+    assert set(totals.tolist()) == {0, 1}
+    assert (totals == (rolls[0].values[:, 0] >= 11)).all()
+
+
+def streamed_plan(code: str, block: int) -> DicePlan:
+    plan = DicePlan(code)
+    plan.STREAM_BLOCK = block
+    return plan
+
+
+@pytest.mark.parametrize(
+    "code", ["5000d6", "5000d6kh100", "5000d6kl7", "5000d6dh10", "5000d6dl10"])
+def test_streaming_matches_single_draw(code: str) -> None:
+    # one repeat draws the same dice whether in one block or many
+    whole, whole_rolls = DicePlan(code).evaluate(default_rng(4))
+    plan = streamed_plan(code, 512)
+    streamed, streamed_rolls = plan.evaluate(default_rng(4))
+    assert (whole == streamed).all()
+    assert streamed_rolls[0].elided == 5000 - plan.PREVIEW_DICE
+    preview = whole_rolls[0].values[:, :plan.PREVIEW_DICE]
+    assert (streamed_rolls[0].values == preview).all()
+
+
+@pytest.mark.parametrize("code, keep", [
+    ("3000d6", None),
+    ("3000d6kh10", lambda values: np.sort(values)[:, -10:]),
+    ("3000d6dl2990", lambda values: np.sort(values)[:, -10:]),
+    ("3000d6kl10", lambda values: np.sort(values)[:, :10]),
+])
+def test_streaming_repeats(code: str, keep: Optional[Any]) -> None:
+    repeats, block = 4, 1024
+    plan = streamed_plan(code, block)
+    totals, _ = plan.evaluate(default_rng(5), repeats)
+    # redraw the blocks _stream draws to know every die
+    rng, columns = default_rng(5), block // repeats
+    blocks = [
+        rng.integers(1, 6, size=(repeats, min(columns, 3000 - start)),
+                     endpoint=True) for start in range(0, 3000, columns)
+    ]
+    values = np.concatenate(blocks, axis=1)
+    kept = values if keep is None else keep(values)
+    assert (totals == kept.sum(axis=1)).all()
+
+
+def test_streamed_explosions_are_capped() -> None:
+    plan = streamed_plan("2000d6kh1000!", 256)
+    totals, rolls = plan.evaluate(TopFaceRng(), 3)
+    cap = 6 * (plan.MAX_EXPLOSIONS + 1)
+    assert rolls[0].elided == 2000 - plan.PREVIEW_DICE
+    assert (totals == 1000 * cap).all()
+
+
+def test_seeded_rolls_repeat() -> None:
+    first = Dice(seed=6).roll("10#4d6kh3+2").totals
+    second = Dice(seed=6).roll("10#4d6kh3+2").totals
+    assert (first == second).all()
+    assert ((first >= 5) & (first <= 20)).all()
@@ -0,0 +1,128 @@
+"""Exact dice distributions against brute-force enumeration"""
+import operator
+from collections import Counter
+from itertools import product
+from typing import Any, Optional
+
+import numpy as np
+import pytest
+
+from exusiai_bot.dice import (Dice, UnsupportedDistributionError, convolve,
+                              dice_distribution, plan_distribution)
+
+
+def enumerate_term(
+    throws: int,
+    sides: int,
+    keep: Optional[str] = None,
+    keep_n: int = 0,
+) -> Counter:
+    """Count every roll of ``throws`` dice by the sum of the dice kept"""
+    counts: Counter = Counter()
+    for roll in product(range(1, sides + 1), repeat=throws):
+        ordered = sorted(roll)
+        kept = {
+            None: ordered,
+            "kh": ordered[throws - keep_n:],
+            "kl": ordered[:keep_n],
+            "dh": ordered[:throws - keep_n],
+            "dl": ordered[keep_n:],
+        }[keep]
+        counts[sum(kept)] += 1
+    return counts
+
+
+def combine(a: Counter, b: Counter, op: Any = operator.add) -> Counter:
+    counts: Counter = Counter()
+    for x, cx in a.items():
+        for y, cy in b.items():
+            counts[op(x, y)] += cx * cy
+    return counts
+
+
+def assert_matches(code: str, counts: Counter) -> None:
+    dist = plan_distribution(code)
+    total = sum(counts.values())
+    assert dist.min == min(counts)
+    assert dist.max == max(counts)
+    for value, p in zip(dist.support.tolist(), dist.pmf.tolist()):
+        assert p == pytest.approx(counts[value] / total, abs=1e-12)
+
+
+@pytest.mark.parametrize("code, term", [
+    ("3d6", (3, 6)),
+    ("1d20", (1, 20)),
+    ("2d20kh1", (2, 20, "kh", 1)),
+    ("2d20kl1", (2, 20, "kl", 1)),
+    ("4d6kh3", (4, 6, "kh", 3)),
+    ("4d6k3", (4, 6, "kh", 3)),
+    ("4d6dl1", (4, 6, "dl", 1)),
+    ("5d4dh2", (5, 4, "dh", 2)),
+    ("3d8kl2", (3, 8, "kl", 2)),
+    ("3d8kh0", (3, 8, "kh", 0)),
+    ("3d8kh3", (3, 8, "kh", 3)),
+])
+def test_dice_terms_match_enumeration(code: str, term: tuple) -> None:
+    assert_matches(code, enumerate_term(*term))
+
+
+def test_arithmetic_matches_enumeration() -> None:
+    two_d6, one_d4 = enumerate_term(2, 6), enumerate_term(1, 4)
+    three = Counter({3: 1})
+    assert_matches("2d6+1d4-3",
+                   combine(combine(two_d6, one_d4), three, operator.sub))
+    assert_matches("1d6*3", combine(enumerate_term(1, 6), three, operator.mul))
+    assert_matches("0-2*1d6", Counter({-2 * face: 1 for face in range(1, 7)}))
+    assert_matches("10-4d6kh3",
+                   combine(Counter({10: 1}), enumerate_term(4, 6, "kh", 3),
+                           operator.sub))
+
+
+@pytest.mark.parametrize("code, left, right, op", [
+    ("2d6>=7", enumerate_term(2, 6), Counter({7: 1}), operator.ge),
+    ("1d20<2d6", enumerate_term(1, 20), enumerate_term(2, 6), operator.lt),
+    ("2d20kh1>1d20", enumerate_term(2, 20, "kh", 1), enumerate_term(1, 20),
+     operator.gt),
+    ("3d4=6", enumerate_term(3, 4), Counter({6: 1}), operator.eq),
+])
+def test_comparisons_match_enumeration(code: str, left: Counter,
+                                       right: Counter, op: Any) -> None:
+    outcomes = combine(left, right, op)
+    dist = Dice().distribution(code)
+    assert dist.support.tolist() == [0, 1]
+    assert dist.pmf[1] == pytest.approx(
+        outcomes[True] / sum(outcomes.values()), abs=1e-12)
+
+
+@pytest.mark.parametrize("throws, sides", [(7, 2), (30, 100), (100, 1000)])
+def test_fft_power_is_a_pmf(throws: int, sides: int) -> None:
+    dist = dice_distribution(throws, sides)
+    assert dist.min == throws and dist.max == throws * sides
+    assert (dist.pmf >= 0).all()
+    assert dist.pmf.sum() == pytest.approx(1, abs=1e-12)
+    assert dist.mean == pytest.approx(throws * (sides + 1) / 2)
+    assert dist.variance == pytest.approx(throws * (sides**2 - 1) / 12)
+
+
+def test_fft_convolution_matches_direct() -> None:
+    rng = np.random.default_rng(0)
+    a, b = rng.random(300), rng.random(500)
+    a, b = a / a.sum(), b / b.sum()
+    expected = np.convolve(a, b)
+    result = convolve(a, b)
+    assert (result >= 0).all()
+    assert result.sum() == pytest.approx(1, abs=1e-12)
+    assert np.allclose(result, expected, rtol=0, atol=1e-12)
+
+
+def test_large_codes_are_pmfs() -> None:
+    dist = plan_distribution("30d100*5+2-10d20kh5")
+    assert dist.min == 30 * 5 + 2 - 100 and dist.max == 15002 - 5
+    assert (dist.pmf >= 0).all()
+    assert dist.pmf.sum() == pytest.approx(1, abs=1e-12)
+
+
+@pytest.mark.parametrize("code", ["3d6!", "1d6*1d6", "1000d1000kh500"])
+def test_unsupported(code: str) -> None:
+    with pytest.raises(UnsupportedDistributionError):
+        plan_distribution(code)
@@ -0,0 +1,126 @@
+"""Dot command routing through the command trie"""
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import pytest
+
+from exusiai_bot.dice import Dice
+from exusiai_bot.dot_command import (CommandTrie, DotCommandDispatcher,
+                                     UnknownCommandError, _Command,
+                                     _compile_glued)
+
+
+def command(name: str, glued: Any = False) -> _Command:
+    return _Command(name, lambda *args: None, _compile_glued(glued))
+
+
+@pytest.fixture
+def trie() -> CommandTrie:
+    """The names main.py registers that share prefixes"""
+    trie = CommandTrie()
+    for name, glued in (
+        ("r", Dice.test_dice_code),
+        ("rd", True),
+        ("rstat", False),
+        ("博饼", False),
+        ("博饼统计", False),
+        ("博饼开始", False),
+        ("博饼结束", False),
+        ("博饼排行", False),
+        ("十连", False),
+        ("十连寻访", False),
+    ):
+        trie[name] = command(name, glued)
+    return trie
+
+
+def resolved(trie: CommandTrie,
+             token: str) -> Optional[tuple[str, str, str]]:
+    result = trie.resolve(token)
+    if result is None:
+        return None
+    command_, name, glued = result
+    return command_.name, name, glued
+
+
+@pytest.mark.parametrize("token, expected", [
+    ("r", ("r", "r", "")),
+    ("rd", ("rd", "rd", "")),
+    ("rstat", ("rstat", "rstat", "")),
+    ("博饼", ("博饼", "博饼", "")),
+    ("博饼排行", ("博饼排行", "博饼排行", "")),
+    ("博饼统计", ("博饼统计", "博饼统计", "")),
+    ("十连", ("十连", "十连", "")),
+    ("十连寻访", ("十连寻访", "十连寻访", "")),
+])
+def test_exact_names_win(trie: CommandTrie, token: str, expected: tuple) -> None:
+    assert resolved(trie, token) == expected
+
+
+@pytest.mark.parametrize("token, expected", [
+    # rd accepts anything glued, so it wins over r for anything after "rd"
+    ("rd100", ("rd", "rd", "100")),
+    ("rdx", ("rd", "rd", "x")),
+    ("r1d20", ("r", "r", "1d20")),
+    ("r4d6kh3+2", ("r", "r", "4d6kh3+2")),
+    # rstat takes nothing glued and "stats" is no dice code
+    ("rstats", None),
+    ("rsta", None),
+    # a prefix of a longer name that is not a name itself
+    ("博饼排", None),
+    ("博饼排行榜", None),
+    ("博饼统计1000", None),
+    ("十连寻", None),
+    ("x", None),
+    ("", None),
+])
+def test_longest_accepting_prefix_wins(trie: CommandTrie, token: str,
+                                       expected: Optional[tuple]) -> None:
+    assert resolved(trie, token) == expected
+
+
+def test_shorter_prefix_when_the_longer_refuses() -> None:
+    trie = CommandTrie()
+    trie["a"] = command("a", True)
+    trie["ab"] = command("ab", r"\d+")
+    trie["abc"] = command("abc")
+    assert resolved(trie, "ab12") == ("ab", "ab", "12")
+    assert resolved(trie, "abx") == ("a", "a", "bx")
+    assert resolved(trie, "abcd") == ("a", "a", "bcd")
+    assert resolved(trie, "abc") == ("abc", "abc", "")
+
+
+def test_aliases_and_removal(trie: CommandTrie) -> None:
+    pull = command("十连")
+    trie["十连"] = trie["十连寻访"] = pull
+    assert trie["十连寻访"] is pull
+    del trie["十连寻访"]
+    assert resolved(trie, "十连寻访") is None
+    assert resolved(trie, "十连") == ("十连", "十连", "")
+    with pytest.raises(KeyError):
+        trie["十连寻访"]
+    with pytest.raises(KeyError):
+        del trie["十"]
+
+
+def test_dispatch_passes_glued_arguments() -> None:
+    dot = DotCommandDispatcher(SimpleNamespace(add_handler=lambda h: None))
+    calls = []
+
+    def record(update: Any, context: Any, argv: tuple) -> None:
+        calls.append(argv)
+
+    dot.add_command("r", record, glued=Dice.test_dice_code)
+    dot.add_command(["博饼", "bb"], record)
+    dot.add_command("博饼排行", record)
+    for command_, args in (("r1d20", "+2"), ("r", "1d6"), ("博饼", ""),
+                           ("bb", ""), ("博饼排行", ""), ("博饼排", "x")):
+        dot.dispatch(None, None, command_, args)
+    assert calls == [("r", "1d20 +2"), ("r", "1d6"), ("博饼", ""),
+                     ("bb", ""), ("博饼排行", "")]
+
+    dot.add_command_filter("bb", lambda update, context, argv: None)
+    dot.dispatch(None, None, "博饼", "")
+    assert len(calls) == 5
+    with pytest.raises(UnknownCommandError):
+        dot.add_command_filter("博饼排", lambda *args: None)
@@ -0,0 +1,183 @@
+"""PRTSFetcher against a local stand-in for PRTS serving recorded pages"""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+from aiohttp import web
+
+from arknights.fetch import FetchError, Page, PRTSFetcher
+
+FIXTURES = Path(__file__).parent / "fixtures" / "prts"
+ASSETS = Path(__file__).parent.parent / "assets" / "arknights"
+LAST_MODIFIED = "Tue, 09 Mar 2021 08:00:00 GMT"
+
+
+class StandIn:
+    """Serves ``FIXTURES`` with validators, failing with queued statuses"""
+    def __init__(self) -> None:
+        self.etag = '"v1"'
+        self.failures: list[int] = []
+        self.requests: list[web.Request] = []
+        self.statuses: list[int] = []
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests.append(request)
+        res = self._respond(request)
+        self.statuses.append(res.status)
+        return res
+
+    def _respond(self, request: web.Request) -> web.StreamResponse:
+        if self.failures:
+            return web.Response(status=self.failures.pop(0))
+        path = FIXTURES / request.match_info["name"]
+        if not path.exists():
+            return web.Response(status=404)
+        if request.headers.get("If-None-Match") == self.etag:
+            return web.Response(status=304)
+        return web.Response(
+            body=path.read_bytes(),
+            content_type="text/html",
+            charset="utf-8",
+            headers={"ETag": self.etag, "Last-Modified": LAST_MODIFIED},
+        )
+
+
+@asynccontextmanager
+async def serve(stand_in: StandIn) -> AsyncIterator[str]:
+    app = web.Application()
+    app.router.add_get("/w/{name}", stand_in.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield f"http://127.0.0.1:{port}/w"
+    finally:
+        await runner.cleanup()
+
+
+async def fetch(cache_dir: Path, *urls: str) -> list[Page]:
+    async with PRTSFetcher(str(cache_dir), retries=2, backoff=0) as fetcher:
+        return await fetcher.fetch_all(urls)
+
+
+@pytest.fixture
+def stand_in() -> StandIn:
+    return StandIn()
+
+
+def test_fetch_caches_page(stand_in: StandIn, tmp_path: Path) -> None:
+    async def run() -> Page:
+        async with serve(stand_in) as url:
+            page, = await fetch(tmp_path, f"{url}/operators.html")
+            return page
+
+    page = asyncio.run(run())
+    assert page.modified
+    assert page.text == (FIXTURES / "operators.html").read_text("utf-8")
+    meta = json.loads(page.path.with_suffix(".json").read_text())
+    assert meta["etag"] == stand_in.etag
+    assert meta["last_modified"] == LAST_MODIFIED
+
+
+def test_not_modified_reads_cache(stand_in: StandIn, tmp_path: Path) -> None:
+    async def run() -> Page:
+        async with serve(stand_in) as url:
+            await fetch(tmp_path, f"{url}/times.html")
+            page, = await fetch(tmp_path, f"{url}/times.html")
+            return page
+
+    page = asyncio.run(run())
+    assert stand_in.statuses == [200, 304]
+    headers = stand_in.requests[-1].headers
+    assert headers["If-None-Match"] == stand_in.etag
+    assert headers["If-Modified-Since"] == LAST_MODIFIED
+    assert not page.modified
+    assert page.text == (FIXTURES / "times.html").read_text("utf-8")
+
+
+def test_changed_page_is_refetched(stand_in: StandIn, tmp_path: Path) -> None:
+    async def run() -> Page:
+        async with serve(stand_in) as url:
+            await fetch(tmp_path, f"{url}/banners.html")
+            stand_in.etag = '"v2"'
+            page, = await fetch(tmp_path, f"{url}/banners.html")
+            return page
+
+    page = asyncio.run(run())
+    assert stand_in.statuses == [200, 200]
+    assert page.modified
+
+
+@pytest.mark.parametrize("status", [500, 503, 429])
+def test_retries_transient_errors(
+    stand_in: StandIn,
+    tmp_path: Path,
+    status: int,
+) -> None:
+    async def run() -> Page:
+        async with serve(stand_in) as url:
+            page, = await fetch(tmp_path, f"{url}/banners.html")
+            return page
+
+    stand_in.failures = [status, status]
+    page = asyncio.run(run())
+    assert stand_in.statuses == [status, status, 200]
+    assert page.modified
+
+
+@pytest.mark.parametrize("status", [403, 404])
+def test_client_errors_are_not_retried(
+    stand_in: StandIn,
+    tmp_path: Path,
+    status: int,
+) -> None:
+    async def run() -> None:
+        async with serve(stand_in) as url:
+            await fetch(tmp_path, f"{url}/banners.html")
+
+    stand_in.failures = [status] * 3
+    with pytest.raises(FetchError):
+        asyncio.run(run())
+    assert stand_in.statuses == [status]
+
+
+def test_falls_back_to_cache(stand_in: StandIn, tmp_path: Path) -> None:
+    async def run() -> Page:
+        async with serve(stand_in) as url:
+            await fetch(tmp_path, f"{url}/operators.html")
+            stand_in.failures = [502] * 3
+            page, = await fetch(tmp_path, f"{url}/operators.html")
+            return page
+
+    page = asyncio.run(run())
+    assert stand_in.statuses == [200, 502, 502, 502]
+    assert not page.modified
+    assert page.text == (FIXTURES / "operators.html").read_text("utf-8")
+
+
+def test_connection_errors(tmp_path: Path) -> None:
+    # nothing listens on the discard port
+    with pytest.raises(FetchError):
+        asyncio.run(fetch(tmp_path, "http://127.0.0.1:9/w/operators.html"))
+
+
+def test_fetched_pages_parse(stand_in: StandIn, tmp_path: Path) -> None:
+    from arknights.utils import dump_banners_info, dump_operators_info
+
+    async def run() -> list[Page]:
+        async with serve(stand_in) as url:
+            return await fetch(tmp_path, f"{url}/operators.html",
+                               f"{url}/times.html", f"{url}/banners.html")
+
+    ops, times, banners = asyncio.run(run())
+    operators = dump_operators_info(True, ops.iter_chunks(),
+                                    times.iter_chunks())
+    assert json.loads(operators) == json.loads(
+        (ASSETS / "operators_less.json").read_text("utf-8"))
+    assert json.loads(dump_banners_info(banners.text)) == json.loads(
+        (ASSETS / "banners.json").read_text("utf-8"))
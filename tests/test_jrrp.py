@@ -0,0 +1,125 @@
+"""Daily jrrp values, their caches and the jrrp key"""
+from datetime import date
+from pathlib import Path
+from typing import Iterator
+
+import arrow
+import pytest
+
+from exusiai_bot import jrrp_commands, storage
+from exusiai_bot.jrrp import MAX_JRRP, JrrpService, jrrp_value
+from exusiai_bot.storage import WriteBehindStore
+
+KEY = b"test key"
+USERS = range(1, 201)
+
+
+class Clock:
+    def __init__(self, now: str) -> None:
+        self.now = arrow.get(now)
+
+    def __call__(self) -> arrow.Arrow:
+        return self.now
+
+
+def values(service: JrrpService) -> list[int]:
+    return [service.get(user_id, str(user_id)) for user_id in USERS]
+
+
+def test_values_are_stable_within_a_day() -> None:
+    # Asia/Shanghai days start at 16:00 UTC
+    clock = Clock("2026-10-17T16:00:00+00:00")
+    service = JrrpService(KEY, clock=clock)
+    morning = values(service)
+    assert all(0 <= value <= MAX_JRRP for value in morning)
+    assert morning == [jrrp_value(KEY, date(2026, 10, 18), u) for u in USERS]
+    clock.now = arrow.get("2026-10-18T15:59:59+00:00")
+    assert values(service) == morning
+    # a fresh service with an empty cache agrees
+    assert values(JrrpService(KEY, clock=clock)) == morning
+
+
+def test_values_change_at_the_rollover() -> None:
+    clock = Clock("2026-10-18T15:59:59+00:00")
+    service = JrrpService(KEY, clock=clock)
+    before = values(service)
+    service.get(1, "one", chat_id=-100)
+    clock.now = arrow.get("2026-10-18T16:00:00+00:00")
+    after = values(service)
+    assert after == [jrrp_value(KEY, date(2026, 10, 19), u) for u in USERS]
+    assert after != before
+    assert service.ranking(-100) == []
+
+
+def test_timezone_decides_the_day() -> None:
+    clock = Clock("2026-10-18T20:00:00+00:00")
+    utc = JrrpService(KEY, timezone="UTC", clock=clock)
+    shanghai = JrrpService(KEY, clock=clock)
+    assert utc.today() == date(2026, 10, 18)
+    assert shanghai.today() == date(2026, 10, 19)
+    assert values(utc) != values(shanghai)
+
+
+def test_values_differ_by_key() -> None:
+    clock = Clock("2026-10-18T00:00:00+00:00")
+    first = values(JrrpService(b"first", clock=clock))
+    second = values(JrrpService(b"second", clock=clock))
+    assert first != second
+    # keys longer than BLAKE2b takes are hashed down rather than rejected
+    long = JrrpService(b"x" * 100, clock=clock)
+    assert len(long.key) == 64
+    assert values(long) != values(JrrpService(b"x" * 64, clock=clock))
+
+
+def test_ranking_and_bounded_caches() -> None:
+    clock = Clock("2026-10-18T00:00:00+00:00")
+    service = JrrpService(KEY, max_users=10, max_chats=2, clock=clock)
+    for user_id in USERS:
+        service.get(user_id, f"user{user_id}", chat_id=user_id % 2)
+    assert len(service._values) == 10
+    ranking = service.ranking(1)
+    assert [value for _, value in ranking] == sorted(
+        (jrrp_value(KEY, date(2026, 10, 18), u) for u in USERS if u % 2),
+        reverse=True)
+    assert len(ranking) == 100 and ranking[0][0].startswith("user")
+    # a third chat pushes out the one used longest ago
+    service.get(1, "user1", chat_id=2)
+    assert len(service._chats) == 2
+    assert service.ranking(1) == []
+    assert len(service.ranking(0)) == 100
+    # an evicted value is recomputed, not lost
+    assert service.get(1, "user1") == jrrp_value(KEY, date(2026, 10, 18), 1)
+
+
+@pytest.fixture
+def jrrp_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    path = tmp_path / "kv.sqlite3"
+    monkeypatch.setattr(storage, "_stores", {
+        "jrrp": WriteBehindStore("jrrp", path=str(path)),
+    })
+    monkeypatch.setattr(jrrp_commands, "_jrrp", None)
+    yield path
+    storage.close_stores()
+
+
+@pytest.mark.parametrize("env", [None, ""])
+def test_missing_key_falls_back_to_the_stored_key(jrrp_store: Path,
+                                                  monkeypatch, env) -> None:
+    if env is None:
+        monkeypatch.delenv("JRRP_KEY", raising=False)
+    else:
+        monkeypatch.setenv("JRRP_KEY", env)
+    key = jrrp_commands.jrrp_key()
+    assert len(key) == 32
+    assert jrrp_commands.jrrp_key() == key
+    assert jrrp_commands.get_jrrp().key == key
+    # the key is flushed before it is used
+    reopened = WriteBehindStore("jrrp", path=str(jrrp_store))
+    assert reopened.get("key") == key.hex()
+    reopened.close()
+
+
+def test_environment_key_wins(jrrp_store: Path, monkeypatch) -> None:
+    monkeypatch.setenv("JRRP_KEY", "from env")
+    assert jrrp_commands.jrrp_key() == b"from env"
+    assert storage.get_store("jrrp").get("key") is None
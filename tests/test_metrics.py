@@ -0,0 +1,41 @@
+"""Where /metrics is served"""
+import asyncio
+from types import SimpleNamespace
+from typing import Iterator
+from urllib.request import urlopen
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from exusiai_bot.metrics import (CONTENT_TYPE, Counter, start_metrics_server,
+                                 stop_metrics_server)
+from exusiai_bot.webhook import WebhookServer
+
+REQUESTS = Counter("test_metrics_requests_total", "Requests in test_metrics")
+
+
+@pytest.fixture
+def metrics_server() -> Iterator[tuple[str, int]]:
+    server = start_metrics_server(0)
+    yield server.server_address[:2]
+    stop_metrics_server()
+
+
+def test_metrics_are_served_on_localhost(
+        metrics_server: tuple[str, int]) -> None:
+    host, port = metrics_server
+    assert host == "127.0.0.1"
+    REQUESTS.inc()
+    with urlopen(f"http://{host}:{port}/metrics", timeout=5) as response:
+        assert response.headers["Content-Type"] == CONTENT_TYPE
+        assert "test_metrics_requests_total 1" in response.read().decode()
+
+
+def test_webhook_does_not_serve_metrics() -> None:
+    async def get_metrics() -> int:
+        webhook = WebhookServer(SimpleNamespace(bot=None), "TOKEN", workers=1)
+        async with TestClient(TestServer(webhook.app)) as client:
+            response = await client.get("/metrics")
+            return response.status
+
+    assert asyncio.run(get_metrics()) in (404, 405)
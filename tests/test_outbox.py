@@ -0,0 +1,184 @@
+"""Outbox against the local fake Bot API server"""
+import time
+from types import SimpleNamespace
+from typing import Any, Iterator
+
+import pytest
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from exusiai_bot import outbox as outbox_module
+from exusiai_bot.outbox import BotAPIError, Outbox
+
+FAST = (1000.0, 1000)
+
+
+@pytest.fixture
+def api() -> Iterator[FakeBotAPI]:
+    # limits well above anything the tests send unless a test lowers them
+    with FakeBotAPI(global_limit=1000,
+                    private_chat_limit=1000,
+                    group_chat_limit=1000) as api:
+        yield api
+
+
+def make_outbox(api: FakeBotAPI, **kwargs: Any) -> Outbox:
+    kwargs = {
+        "coalesce_window": 0.2,
+        "global_rate": FAST,
+        "private_chat_rate": FAST,
+        "group_chat_rate": FAST,
+        **kwargs,
+    }
+    return Outbox("TOKEN", base_url=api.url, **kwargs)
+
+
+def sent(api: FakeBotAPI, chat_id: Any = None) -> list[tuple[float, str]]:
+    return [(at, params["text"]) for at, method, params in api.calls
+            if method == "sendMessage" and chat_id in (None,
+                                                       params["chat_id"])]
+
+
+def assert_within_rate(times: list[float], rate: tuple[float, int]) -> None:
+    """No window between two sends holds more than the bucket allows"""
+    per_second, capacity = rate
+    # the server stamps requests after a round-trip of jitter, which can
+    # bring two sends closer together than the outbox released them
+    slack = 0.02
+    for i in range(len(times)):
+        for j in range(i, len(times)):
+            window = times[j] - times[i] + slack
+            assert j - i + 1 <= capacity + per_second * window
+
+
+def test_messages_arrive_in_order_per_chat(api: FakeBotAPI) -> None:
+    outbox = make_outbox(api)
+    chats = (1, 2, -100)
+    futures = [
+        outbox.send_message(chat_id, f"{chat_id}:{i}")
+        for i in range(10)
+        for chat_id in chats
+    ]
+    for future in futures:
+        future.result(5)
+    outbox.close()
+    for chat_id in chats:
+        assert [text for _, text in sent(api, chat_id)
+                ] == [f"{chat_id}:{i}" for i in range(10)]
+    message_ids = [future.result()["message_id"] for future in futures[::3]]
+    assert message_ids == list(range(1, 11))
+
+
+def test_coalesced_messages_are_merged(api: FakeBotAPI) -> None:
+    outbox = make_outbox(api)
+    futures = [
+        outbox.send_message(1, text, coalesce=True)
+        for text in ("a", "b", "c")
+    ]
+    other = outbox.send_message(1, "d")
+    results = [future.result(5) for future in futures]
+    other.result(5)
+    outbox.close()
+    assert [text for _, text in sent(api, 1)] == ["a\n\nb\n\nc", "d"]
+    assert all(result == results[0] for result in results)
+
+
+def test_coalescing_needs_matching_params(api: FakeBotAPI) -> None:
+    outbox = make_outbox(api)
+    futures = [
+        outbox.send_message(1, "a", coalesce=True),
+        outbox.send_message(1, "b", coalesce=True, parse_mode="HTML"),
+        outbox.send_message(1, "c" * 4096, coalesce=True),
+    ]
+    for future in futures:
+        future.result(5)
+    outbox.close()
+    assert len(sent(api, 1)) == 3
+
+
+def test_group_rate_is_kept(api: FakeBotAPI) -> None:
+    rate = (10.0, 3)
+    outbox = make_outbox(api, group_chat_rate=rate)
+    futures = [outbox.send_message(-100, str(i)) for i in range(13)]
+    for future in futures:
+        future.result(5)
+    outbox.close()
+    times = [at for at, _ in sent(api, -100)]
+    assert len(times) == 13
+    assert_within_rate(times, rate)
+    # the first burst goes out at once, the rest at the refill rate
+    assert times[-1] - times[0] >= (13 - 3) / rate[0] - 0.05
+
+
+def test_global_rate_is_kept(api: FakeBotAPI) -> None:
+    rate = (20.0, 5)
+    outbox = make_outbox(api, global_rate=rate)
+    futures = [outbox.send_message(chat_id, "hi") for chat_id in range(1, 26)]
+    for future in futures:
+        future.result(5)
+    outbox.close()
+    times = [at for at, _ in sent(api)]
+    assert len(times) == 25
+    assert_within_rate(times, rate)
+
+
+def test_rate_limited_calls_are_retried(api: FakeBotAPI) -> None:
+    # the outbox allows more than the server, which answers 429 and
+    # retry_after 1 to the second message within a second
+    api.limits["private"] = (1, 1.0)
+    outbox = make_outbox(api)
+    first = outbox.send_message(1, "first")
+    second = outbox.send_message(1, "second")
+    assert first.result(5)["text"] == "first"
+    assert second.result(5)["text"] == "second"
+    outbox.close()
+    assert api.rejected >= 1
+    (sent_first, _), (sent_second, _) = sent(api, 1)
+    assert sent_second - sent_first >= 0.9
+
+
+def test_errors_without_retry_after_fail_the_future(api: FakeBotAPI) -> None:
+    api.handle = lambda method, params: {
+        "ok": False,
+        "error_code": 400,
+        "description": "Bad Request: chat not found",
+    }
+    outbox = make_outbox(api)
+    future = outbox.send_message(1, "hi")
+    with pytest.raises(BotAPIError) as e:
+        future.result(5)
+    outbox.close()
+    assert e.value.error_code == 400
+
+
+def test_close_sends_everything_queued(api: FakeBotAPI) -> None:
+    outbox = make_outbox(api, coalesce_window=60)
+    future = outbox.send_message(1, "late", coalesce=True)
+    start = time.monotonic()
+    outbox.close()
+    assert future.result(0)["text"] == "late"
+    assert time.monotonic() - start < 5
+    with pytest.raises(RuntimeError):
+        outbox.send_message(1, "closed")
+
+
+def test_send_message_falls_back_to_bot() -> None:
+    assert outbox_module.get_outbox() is None
+    calls = []
+
+    def send_message(**params: Any) -> SimpleNamespace:
+        calls.append(params)
+        return SimpleNamespace(to_dict=lambda: {"message_id": 7})
+
+    bot = SimpleNamespace(send_message=send_message)
+    future = outbox_module.send_message(bot, chat_id=1, text="hi")
+    assert future.result(0) == {"message_id": 7}
+    assert calls == [{"chat_id": 1, "text": "hi"}]
+
+    def fail(**params: Any) -> None:
+        raise ValueError("no network")
+
+    future = outbox_module.send_message(SimpleNamespace(send_message=fail),
+                                        chat_id=1,
+                                        text="hi")
+    with pytest.raises(ValueError):
+        future.result(0)
@@ -0,0 +1,127 @@
+"""Alias tables compiled from banner probability trees"""
+import numpy as np
+import pytest
+from numpy.random import default_rng
+
+from arknights.probability_tree import AliasTable, ProbabilityNode
+
+RATES = {3: 0.40, 4: 0.50, 5: 0.08, 6: 0.02}
+SAMPLES = 1_000_000
+
+
+def operators(rarity: int, n: int, prefix: str = "") -> list[dict]:
+    return [{
+        "rarity": rarity,
+        "cn_name": f"{prefix}{rarity}-{i}"
+    } for i in range(n)]
+
+
+def banner_tree() -> ProbabilityNode:
+    """Rarity nodes like ArknightsBanner's, with a rate-up on 5 and 6 stars"""
+    root = ProbabilityNode()
+    for rarity, rate in RATES.items():
+        root.add_child(name=f"{rarity}_STAR",
+                       probability=rate,
+                       value=operators(rarity, 3 + rarity))
+    for rarity in (5, 6):
+        parent = root.get_child_by_name(f"{rarity}_STAR")
+        parent.add_child(name=f"RATEUP_{rarity}_STAR",
+                         probability=0.5,
+                         value=operators(rarity, 2, "up"))
+        parent.add_child(name=f"{rarity}_STAR",
+                         probability=0.5,
+                         value=operators(rarity, 3 + rarity))
+    return root
+
+
+def alias_probabilities(table: AliasTable) -> np.ndarray:
+    """Chance the table's prob/alias columns give each outcome"""
+    p = table.prob.copy()
+    np.add.at(p, table.alias, 1 - table.prob)
+    return p / table.n
+
+
+def rarities(table: AliasTable) -> np.ndarray:
+    return np.array([op["rarity"] for op in table.values])
+
+
+def assert_frequencies(table: AliasTable, expected: np.ndarray,
+                       seed: int) -> None:
+    counts = np.bincount(table.sample(SAMPLES, default_rng(seed)),
+                         minlength=table.n)
+    # five standard deviations of a binomial count
+    tolerance = 5 * np.sqrt(SAMPLES * expected * (1 - expected)) + 1
+    assert (np.abs(counts - SAMPLES * expected) <= tolerance).all()
+
+
+def test_compiled_table_keeps_rarity_rates() -> None:
+    table = banner_tree().compile()
+    assert np.allclose(alias_probabilities(table), table.probabilities)
+    by_rarity = rarities(table)
+    for rarity, rate in RATES.items():
+        assert table.probabilities[by_rarity == rarity].sum() == \
+            pytest.approx(rate)
+    # a list value spreads its leaf's chance evenly over the operators
+    up = [leaf.name.startswith("RATEUP_") for leaf in table.leaves]
+    assert table.probabilities[np.array(up) & (by_rarity == 6)] == \
+        pytest.approx([0.02 * 0.5 / 2] * 2)
+
+    counts = np.bincount(by_rarity[table.sample(SAMPLES, default_rng(1))],
+                         minlength=7)
+    for rarity, rate in RATES.items():
+        tolerance = 5 * np.sqrt(SAMPLES * rate * (1 - rate))
+        assert abs(counts[rarity] - SAMPLES * rate) <= tolerance
+    assert_frequencies(table, table.probabilities, 2)
+
+
+def test_single_samples_follow_the_table() -> None:
+    table = banner_tree().compile()
+    rng = default_rng(3)
+    pulls = [table.sample(rng=rng) for _ in range(100_000)]
+    counts = np.bincount(rarities(table)[pulls], minlength=7)
+    assert counts[3:] / 100_000 == pytest.approx(list(RATES.values()),
+                                                 abs=0.01)
+
+
+@pytest.mark.parametrize("rarity_mask", [
+    lambda r: r == 6,
+    lambda r: r == 5,
+    lambda r: r != 6,
+    lambda r: (r == 3) | (r == 6),
+])
+def test_subset_renormalizes(rarity_mask) -> None:
+    table = banner_tree().compile()
+    mask = rarity_mask(rarities(table))
+    subset = table.subset(mask)
+    expected = table.probabilities[mask] / table.probabilities[mask].sum()
+    assert subset.n == mask.sum()
+    assert subset.values == [v for v, m in zip(table.values, mask) if m]
+    assert subset.leaves == [l for l, m in zip(table.leaves, mask) if m]
+    assert subset.probabilities == pytest.approx(expected)
+    assert np.allclose(alias_probabilities(subset), expected)
+    assert_frequencies(subset, expected, 4)
+
+
+def test_recompiles_after_probabilities_change() -> None:
+    root = banner_tree()
+    table = root.compile()
+    assert root.compile() is table
+    root.set_children_probabilities({
+        "3_STAR": 0,
+        "4_STAR": 0,
+        "5_STAR": 0.98,
+        "6_STAR": 0.02,
+    })
+    pity = root.compile()
+    assert pity is not table
+    assert pity.probabilities[rarities(pity) == 5].sum() == \
+        pytest.approx(0.98)
+    root.reset_children_recursive()
+    assert root.compile().probabilities == pytest.approx(table.probabilities)
+
+
+def test_weights_are_required() -> None:
+    with pytest.raises(ValueError):
+        AliasTable([])
+    with pytest.raises(ValueError):
+        AliasTable([0, 0])
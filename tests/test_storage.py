@@ -0,0 +1,60 @@
+"""WriteBehindStore caching and write-behind"""
+from pathlib import Path
+
+from exusiai_bot.storage import WriteBehindStore
+
+
+def make_store(tmp_path: Path, **kwargs) -> WriteBehindStore:
+    return WriteBehindStore("test",
+                            path=str(tmp_path / "kv.sqlite3"),
+                            flush_interval=60,
+                            **kwargs)
+
+
+def test_clean_values_are_evicted(tmp_path: Path) -> None:
+    store = make_store(tmp_path, max_cached=3)
+    for i in range(10):
+        store.set(str(i), i)
+    # nothing is flushed yet, so every value has to stay
+    assert len(store._cache) == 10
+    store.flush()
+    assert len(store._cache) == 3
+    assert [store.get(str(i)) for i in range(10)] == list(range(10))
+    assert len(store._cache) == 3
+    store.close()
+
+
+def test_recently_used_values_stay(tmp_path: Path) -> None:
+    store = make_store(tmp_path, max_cached=2)
+    store.set("a", 1)
+    store.set("b", 2)
+    store.flush()
+    store.get("a")
+    store.set("c", 3)
+    assert list(store._cache) == ["a", "c"]
+    store.close()
+
+
+def test_update_skips_none(tmp_path: Path) -> None:
+    store = make_store(tmp_path)
+    store.set("a", 1)
+    assert store.update("a", lambda value: None) is None
+    assert store.update("a", lambda value: value + 1) == 2
+    store.close()
+    store = make_store(tmp_path)
+    assert store.get("a") == 2
+    store.close()
+
+
+def test_unencodable_values_stay_dirty(tmp_path: Path) -> None:
+    store = make_store(tmp_path)
+    store.set("bad", object())
+    store.set("good", 1)
+    store.flush()
+    assert store._dirty == {"bad"}
+    store.delete("bad")
+    store.close()
+    store = make_store(tmp_path)
+    assert store.get("good") == 1
+    assert store.get("bad") is None
+    store.close()